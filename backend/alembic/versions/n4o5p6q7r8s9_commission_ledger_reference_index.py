@@ -0,0 +1,35 @@
+"""Index commission_ledger by (reference_id, reference_type).
+
+The webhook duplicate checks filter on reference_id + reference_type. The
+idempotency constraint leads with reference_id too, but it spans four columns
+and cannot answer the reference_type filter from the index.
+
+Revision ID: n4o5p6q7r8s9
+Revises: m3n4o5p6q7r8
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "n4o5p6q7r8s9"
+down_revision = "m3n4o5p6q7r8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so live webhooks keep writing to the ledger
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_commission_ledger_reference",
+            "commission_ledger", ["reference_id", "reference_type"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_commission_ledger_reference",
+            table_name="commission_ledger",
+            postgresql_concurrently=True,
+        )
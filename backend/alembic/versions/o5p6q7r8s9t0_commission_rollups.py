@@ -0,0 +1,46 @@
+"""Add commission_rollups: daily ledger totals per recipient, type and status.
+
+Backfilled from commission_ledger; afterwards maintained by the application
+in the same transaction as every ledger write.
+
+Revision ID: o5p6q7r8s9t0
+Revises: n4o5p6q7r8s9
+Create Date: 2026-10-17
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "o5p6q7r8s9t0"
+down_revision = "n4o5p6q7r8s9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "commission_rollups",
+        sa.Column("recipient_user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("day", sa.Date, nullable=False),
+        sa.Column("type", sa.String(20), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("total_amount", sa.Numeric(18, 2), nullable=False, server_default="0"),
+        sa.Column("source_total", sa.Numeric(18, 2), nullable=False, server_default="0"),
+        sa.Column("entry_count", sa.Integer, nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("recipient_user_id", "day", "type", "status"),
+    )
+    op.create_index("ix_commission_rollups_day", "commission_rollups", ["day"])
+
+    op.execute("""
+        INSERT INTO commission_rollups
+            (recipient_user_id, day, type, status, total_amount, source_total, entry_count)
+        SELECT recipient_user_id, created_at::date, type, status,
+               SUM(commission_amount), SUM(source_amount), COUNT(*)
+        FROM commission_ledger
+        GROUP BY 1, 2, 3, 4
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_commission_rollups_day", table_name="commission_rollups")
+    op.drop_table("commission_rollups")
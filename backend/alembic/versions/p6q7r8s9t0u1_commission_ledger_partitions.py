@@ -0,0 +1,151 @@
+"""Range-partition commission_ledger by month and add the ledger archive.
+
+commission_ledger is rebuilt as a table partitioned on the new ledger_month
+column (first day of the month of created_at), with one partition per month
+from the oldest entry up to three months ahead. Existing rows are copied over.
+Later partitions are created by app.services.commission_partitions.
+
+Every unique key now includes ledger_month, as Postgres requires on a
+partitioned table:
+- primary key (id, ledger_month)
+- (uuid, ledger_month)
+- uq_ledger_idempotency (reference_id, user_id, type, recipient_user_id, ledger_month)
+
+It also adds the commission_archive schema for detached months and the
+commission_ledger_archives catalog.
+
+The copy holds an exclusive lock on the ledger. Run it with the webhooks
+stopped or queued (COMMISSION_QUEUE_ENABLED).
+
+Revision ID: p6q7r8s9t0u1
+Revises: o5p6q7r8s9t0
+Create Date: 2026-10-17
+"""
+from datetime import date, datetime, timezone
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "p6q7r8s9t0u1"
+down_revision = "o5p6q7r8s9t0"
+branch_labels = None
+depends_on = None
+
+_MONTHS_AHEAD = 3
+
+_INDEXES = [
+    ("ix_commission_ledger_agent_id", ["agent_id"]),
+    ("ix_commission_ledger_created_at", ["created_at"]),
+    ("ix_commission_ledger_status", ["status"]),
+    ("ix_commission_ledger_type", ["type"]),
+    ("ix_commission_ledger_user_id", ["user_id"]),
+    ("ix_commission_ledger_recipient_user_id", ["recipient_user_id"]),
+    ("ix_commission_ledger_game_category", ["game_category"]),
+    ("ix_commission_ledger_reference", ["reference_id", "reference_type"]),
+    ("ix_commission_ledger_agent_status", ["agent_id", "status"]),
+    ("ix_commission_ledger_type_created_at", ["type", "created_at"]),
+    ("ix_commission_ledger_agent_created_status", ["agent_id", "created_at", "status"]),
+]
+
+_FOREIGN_KEYS = [
+    ("commission_ledger_agent_id_fkey", "admin_users", "agent_id"),
+    ("commission_ledger_policy_id_fkey", "commission_policies", "policy_id"),
+    ("commission_ledger_settlement_id_fkey", "settlements", "settlement_id"),
+    ("fk_commission_ledger_user_id", "users", "user_id"),
+    ("fk_commission_ledger_recipient_user_id", "users", "recipient_user_id"),
+]
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_keys(partitioned: bool) -> None:
+    """Constraints and indexes of commission_ledger, with or without ledger_month."""
+    month = ["ledger_month"] if partitioned else []
+    op.create_primary_key("commission_ledger_pkey", "commission_ledger", ["id", *month])
+    op.create_unique_constraint("commission_ledger_uuid_key", "commission_ledger", ["uuid", *month])
+    op.create_unique_constraint(
+        "uq_ledger_idempotency", "commission_ledger",
+        ["reference_id", "user_id", "type", "recipient_user_id", *month],
+    )
+    if partitioned:
+        op.create_check_constraint(
+            "ck_commission_ledger_month", "commission_ledger",
+            "ledger_month = date_trunc('month', created_at)::date",
+        )
+    for name, referred, col in _FOREIGN_KEYS:
+        op.create_foreign_key(name, "commission_ledger", referred, [col], ["id"])
+    for name, columns in _INDEXES:
+        op.create_index(name, "commission_ledger", columns)
+
+
+def _swap_in(new_table: str) -> None:
+    """Replace commission_ledger by new_table, keeping the id sequence."""
+    op.execute("ALTER SEQUENCE commission_ledger_id_seq OWNED BY NONE")
+    op.execute("DROP TABLE commission_ledger")
+    op.execute(f"ALTER TABLE {new_table} RENAME TO commission_ledger")
+    op.execute("ALTER SEQUENCE commission_ledger_id_seq OWNED BY commission_ledger.id")
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    op.execute("LOCK TABLE commission_ledger IN EXCLUSIVE MODE")
+
+    op.execute("""
+        CREATE TABLE commission_ledger_new (
+            LIKE commission_ledger INCLUDING DEFAULTS,
+            ledger_month DATE NOT NULL
+        ) PARTITION BY RANGE (ledger_month)
+    """)
+
+    oldest = conn.execute(sa.text("SELECT min(created_at) FROM commission_ledger")).scalar()
+    now = datetime.now(timezone.utc)
+    current = date(now.year, now.month, 1)
+    month = date(oldest.year, oldest.month, 1) if oldest else current
+    last = _add_months(current, _MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE commission_ledger_{month:%Y%m} PARTITION OF commission_ledger_new "
+            f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')"
+        )
+        month = _add_months(month, 1)
+
+    op.execute("""
+        INSERT INTO commission_ledger_new
+        SELECT *, date_trunc('month', created_at)::date FROM commission_ledger
+    """)
+    _swap_in("commission_ledger_new")
+    _create_keys(partitioned=True)
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS commission_archive")
+    op.create_table(
+        "commission_ledger_archives",
+        sa.Column("month", sa.Date, primary_key=True),
+        sa.Column("table_name", sa.String(100), nullable=False),
+        sa.Column("row_count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("commission_total", sa.Numeric(18, 2), nullable=False, server_default="0"),
+        sa.Column("archived_at", sa.DateTime, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    archives = conn.execute(sa.text("SELECT table_name FROM commission_ledger_archives")).scalars().all()
+    op.execute("LOCK TABLE commission_ledger IN EXCLUSIVE MODE")
+
+    # Archived months are folded back into the flat table
+    op.execute("CREATE TABLE commission_ledger_flat (LIKE commission_ledger INCLUDING DEFAULTS)")
+    for source in ["commission_ledger", *archives]:
+        op.execute(f"INSERT INTO commission_ledger_flat SELECT * FROM {source}")
+    op.execute("ALTER TABLE commission_ledger_flat DROP COLUMN ledger_month")
+    for source in archives:
+        op.execute(f"DROP TABLE {source}")
+
+    _swap_in("commission_ledger_flat")
+    _create_keys(partitioned=False)
+
+    op.drop_table("commission_ledger_archives")
+    op.execute("DROP SCHEMA IF EXISTS commission_archive")
@@ -0,0 +1,35 @@
+"""Index users by (referrer_id, id) and admin_users by (parent_id, id).
+
+Tree expansion pages through a node's direct children in id order. With the
+composite index a page is a range scan from the cursor, no matter how many
+children the node has.
+
+Revision ID: q7r8s9t0u1v2
+Revises: p6q7r8s9t0u1
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "q7r8s9t0u1v2"
+down_revision = "p6q7r8s9t0u1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so sign-ups keep writing to users
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_referrer_id_id", "users", ["referrer_id", "id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_admin_users_parent_id_id", "admin_users", ["parent_id", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_admin_users_parent_id_id", table_name="admin_users", postgresql_concurrently=True)
+        op.drop_index("ix_users_referrer_id_id", table_name="users", postgresql_concurrently=True)
@@ -0,0 +1,89 @@
+"""Add user_subtree_stats and agent_subtree_stats, filled from the current tree.
+
+One row per node with totals over the node and its whole subtree, kept
+current by app.services.subtree_stats. The backfill groups each closure
+table once, joined to the node balances and, for users, to per-recipient
+commission_rollups totals.
+
+Revision ID: r8s9t0u1v2w3
+Revises: q7r8s9t0u1v2
+Create Date: 2026-10-17
+"""
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "r8s9t0u1v2w3"
+down_revision = "q7r8s9t0u1v2"
+branch_labels = None
+depends_on = None
+
+
+def _money(name: str) -> sa.Column:
+    return sa.Column(name, sa.Numeric(18, 2), nullable=False, server_default="0")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_subtree_stats",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("descendant_count", sa.Integer, nullable=False, server_default="0"),
+        _money("subtree_balance"),
+        _money("bet_total"),
+        _money("commission_total"),
+        sa.Column("day", sa.Date, nullable=True),
+        _money("day_bet_amount"),
+        _money("day_commission"),
+        sa.Column("month", sa.Date, nullable=True),
+        _money("month_bet_amount"),
+        _money("month_commission"),
+        sa.Column("updated_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_table(
+        "agent_subtree_stats",
+        sa.Column("agent_id", sa.Integer, sa.ForeignKey("admin_users.id"), primary_key=True),
+        sa.Column("descendant_count", sa.Integer, nullable=False, server_default="0"),
+        _money("subtree_balance"),
+        sa.Column("updated_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+
+    today = datetime.now(timezone.utc).date()
+    op.get_bind().execute(sa.text("""
+        WITH earned AS (
+            SELECT recipient_user_id AS id,
+                   sum(source_total) FILTER (WHERE type = 'rolling') AS bet,
+                   sum(total_amount) AS commission,
+                   sum(source_total) FILTER (WHERE type = 'rolling' AND day = :day) AS day_bet,
+                   sum(total_amount) FILTER (WHERE day = :day) AS day_commission,
+                   sum(source_total) FILTER (WHERE type = 'rolling' AND day >= :month) AS month_bet,
+                   sum(total_amount) FILTER (WHERE day >= :month) AS month_commission
+            FROM commission_rollups
+            GROUP BY recipient_user_id
+        )
+        INSERT INTO user_subtree_stats (
+            user_id, descendant_count, subtree_balance, bet_total, commission_total,
+            day, day_bet_amount, day_commission, month, month_bet_amount, month_commission
+        )
+        SELECT t.ancestor_id, count(*) - 1, sum(u.balance),
+               coalesce(sum(e.bet), 0), coalesce(sum(e.commission), 0),
+               :day, coalesce(sum(e.day_bet), 0), coalesce(sum(e.day_commission), 0),
+               :month, coalesce(sum(e.month_bet), 0), coalesce(sum(e.month_commission), 0)
+        FROM user_tree t
+        JOIN users u ON u.id = t.descendant_id
+        LEFT JOIN earned e ON e.id = t.descendant_id
+        GROUP BY t.ancestor_id
+    """), {"day": today, "month": today.replace(day=1)})
+    op.execute("""
+        INSERT INTO agent_subtree_stats (agent_id, descendant_count, subtree_balance)
+        SELECT t.ancestor_id, count(*) - 1, sum(a.balance)
+        FROM admin_user_tree t
+        JOIN admin_users a ON a.id = t.descendant_id
+        GROUP BY t.ancestor_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("agent_subtree_stats")
+    op.drop_table("user_subtree_stats")
@@ -0,0 +1,36 @@
+"""Index the keyset pagination orders of users, transactions and bet_records.
+
+Cursor pages of the list endpoints continue from (timestamp, id) below the
+previous page's last row. With these indexes each page is a backward range
+scan from the cursor; audit_logs and commission_ledger already have a
+created_at index for the leading bound.
+
+Revision ID: s9t0u1v2w3x4
+Revises: r8s9t0u1v2w3
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "s9t0u1v2w3x4"
+down_revision = "r8s9t0u1v2w3"
+branch_labels = None
+depends_on = None
+
+_INDEXES = [
+    ("ix_users_created_at_id", "users", ["created_at", "id"]),
+    ("ix_transactions_created_at_id", "transactions", ["created_at", "id"]),
+    ("ix_bet_records_user_id_bet_at_id", "bet_records", ["user_id", "bet_at", "id"]),
+]
+
+
+def upgrade() -> None:
+    # Built concurrently so the tables keep taking writes
+    with op.get_context().autocommit_block():
+        for name, table, columns in _INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(_INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,39 @@
+"""Trigram and prefix indexes for member search (app.services.user_search).
+
+- pg_trgm GIN on username and real_name: serve ILIKE '%term%'
+- pg_trgm GIN on the phone number with formatting stripped (the expression
+  must stay identical to user_search.PHONE_DIGITS)
+- lower(username) text_pattern_ops: prefix search for terms too short for
+  trigrams
+
+Revision ID: t0u1v2w3x4y5
+Revises: s9t0u1v2w3x4
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "t0u1v2w3x4y5"
+down_revision = "s9t0u1v2w3x4"
+branch_labels = None
+depends_on = None
+
+_INDEXES = {
+    "ix_users_username_trgm": "USING gin (username gin_trgm_ops)",
+    "ix_users_real_name_trgm": "USING gin (real_name gin_trgm_ops)",
+    "ix_users_phone_digits_trgm": "USING gin ((regexp_replace(phone, '[^0-9]', '', 'g')) gin_trgm_ops)",
+    "ix_users_username_lower_prefix": "(lower(username) text_pattern_ops)",
+}
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Built concurrently so sign-ups keep writing to users
+    with op.get_context().autocommit_block():
+        for name, definition in _INDEXES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users {definition}")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name in reversed(_INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
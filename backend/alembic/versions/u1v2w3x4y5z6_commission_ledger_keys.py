@@ -0,0 +1,53 @@
+"""Add commission_ledger_keys, the cross-month idempotency keys of the ledger.
+
+uq_ledger_idempotency includes ledger_month (the partition key), so it only
+rejects a duplicate entry within one month. commission_ledger_keys holds
+(reference_id, user_id, type, recipient_user_id) unpartitioned; the commission
+engine claims a key before writing its entry. The keys are filled from the
+live ledger and from every archived month.
+
+Run it with the webhooks stopped or queued (COMMISSION_QUEUE_ENABLED), so no
+entry is written between the backfill and the new code.
+
+Revision ID: u1v2w3x4y5z6
+Revises: t0u1v2w3x4y5
+Create Date: 2026-10-17
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "u1v2w3x4y5z6"
+down_revision = "t0u1v2w3x4y5"
+branch_labels = None
+depends_on = None
+
+
+def _backfill(source: str) -> None:
+    op.execute(f"""
+        INSERT INTO commission_ledger_keys (reference_id, user_id, type, recipient_user_id, created_at)
+        SELECT reference_id, user_id, type, recipient_user_id, min(created_at)
+        FROM {source}
+        WHERE reference_id IS NOT NULL
+        GROUP BY reference_id, user_id, type, recipient_user_id
+        ON CONFLICT DO NOTHING
+    """)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "commission_ledger_keys",
+        sa.Column("reference_id", sa.String(100), primary_key=True),
+        sa.Column("user_id", sa.Integer, primary_key=True),
+        sa.Column("type", sa.String(20), primary_key=True),
+        sa.Column("recipient_user_id", sa.Integer, primary_key=True),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    _backfill("commission_ledger")
+    archived = op.get_bind().execute(sa.text("SELECT table_name FROM commission_ledger_archives")).scalars()
+    for table_name in archived.all():
+        _backfill(table_name)
+
+
+def downgrade() -> None:
+    op.drop_table("commission_ledger_keys")
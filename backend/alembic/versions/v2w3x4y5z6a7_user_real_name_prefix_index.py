@@ -0,0 +1,29 @@
+"""Prefix index on lower(real_name) for short member searches.
+
+Search terms shorter than 3 characters match a username or real name prefix
+(app.services.user_search); this serves the real name half the way
+ix_users_username_lower_prefix serves usernames.
+
+Revision ID: v2w3x4y5z6a7
+Revises: u1v2w3x4y5z6
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "v2w3x4y5z6a7"
+down_revision = "u1v2w3x4y5z6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_real_name_lower_prefix "
+            "ON users (lower(real_name) text_pattern_ops)"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_users_real_name_lower_prefix")
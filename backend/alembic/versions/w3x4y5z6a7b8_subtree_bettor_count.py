@@ -0,0 +1,54 @@
+"""Add user_subtree_stats.bettor_count and users.first_commission_at.
+
+The partner dashboard counted the distinct bettors under a user with
+count(DISTINCT user_id) over every commission ledger row credited inside
+the subtree. Users now carry the time their bets first earned commission,
+and each stats row counts the users in its subtree that have one. Both are
+filled from commission_ledger_keys, which holds every ledger key,
+archived months included.
+
+Revision ID: w3x4y5z6a7b8
+Revises: v2w3x4y5z6a7
+Create Date: 2026-10-17
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "w3x4y5z6a7b8"
+down_revision = "v2w3x4y5z6a7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("first_commission_at", sa.DateTime, nullable=True))
+    op.add_column(
+        "user_subtree_stats",
+        sa.Column("bettor_count", sa.Integer, nullable=False, server_default="0"),
+    )
+    op.execute("""
+        UPDATE users u SET first_commission_at = k.first
+        FROM (
+            SELECT user_id, min(created_at) AS first
+            FROM commission_ledger_keys
+            GROUP BY user_id
+        ) k
+        WHERE u.id = k.user_id
+    """)
+    op.execute("""
+        UPDATE user_subtree_stats s SET bettor_count = c.bettors
+        FROM (
+            SELECT t.ancestor_id, count(*) AS bettors
+            FROM user_tree t
+            JOIN users u ON u.id = t.descendant_id
+            WHERE u.first_commission_at IS NOT NULL
+            GROUP BY t.ancestor_id
+        ) c
+        WHERE s.user_id = c.ancestor_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column("user_subtree_stats", "bettor_count")
+    op.drop_column("users", "first_commission_at")
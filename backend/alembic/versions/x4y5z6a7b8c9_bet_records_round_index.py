@@ -0,0 +1,34 @@
+"""Index bet_records by (round_id, user_id, bet_at, id) for commission replay.
+
+A replay only recomputes the first record of each round and bettor, as the
+live webhooks do (app.services.commission_replay). Each candidate record is
+checked for an earlier one of the same round with a NOT EXISTS probe; this
+index makes that probe one short range scan.
+
+Revision ID: x4y5z6a7b8c9
+Revises: w3x4y5z6a7b8
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "x4y5z6a7b8c9"
+down_revision = "w3x4y5z6a7b8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so bet_records keeps taking writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_bet_records_round_id_user_id_bet_at_id", "bet_records",
+            ["round_id", "user_id", "bet_at", "id"], postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_bet_records_round_id_user_id_bet_at_id", table_name="bet_records",
+            postgresql_concurrently=True,
+        )
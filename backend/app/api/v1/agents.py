@@ -17,6 +17,7 @@ from app.schemas.agent import (
     AgentListResponse,
     AgentMoveRequest,
     AgentResponse,
+    AgentTreeChildrenResponse,
     AgentTreeResponse,
     AgentUpdate,
     PasswordResetRequest,
@@ -26,6 +27,9 @@ from app.schemas.commission import (
     AgentCommissionRateResponse,
     AgentCommissionRateUpdate,
 )
+from app.schemas.user import TreeVerifyRequest, TreeVerifyResponse
+from app.services import admin_scope
+from app.services.closure_verify import verify_tree
 from app.services.commission_engine import (
     validate_rate_against_children,
     validate_rate_against_parent,
@@ -33,6 +37,7 @@ from app.services.commission_engine import (
 from app.services.tree_service import (
     get_ancestors,
     get_children,
+    get_children_page,
     get_descendant_count,
     get_subtree_for_tree_view,
     insert_node,
@@ -207,6 +212,8 @@ async def create_agent(
 
     await session.commit()
     await session.refresh(user)
+    # The parent's and every ancestor's scope gained this agent
+    await admin_scope.invalidate()
 
     return await _build_agent_response(session, user)
 
@@ -308,6 +315,23 @@ async def get_agent_tree(
     return AgentTreeResponse(nodes=nodes)
 
 
+@router.get("/{agent_id}/tree/children", response_model=AgentTreeChildrenResponse)
+async def get_agent_tree_children(
+    agent_id: int,
+    cursor: int | None = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    session: AsyncSession = Depends(get_session),
+    current_user: AdminUser = Depends(PermissionChecker("agents.tree")),
+):
+    """Expand one tree node: a page of direct children with their subtree totals."""
+    user = await session.get(AdminUser, agent_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    items, next_cursor = await get_children_page(session, agent_id, cursor, limit)
+    return AgentTreeChildrenResponse(items=items, next_cursor=next_cursor)
+
+
 # ─── Tree: Ancestors ─────────────────────────────────────────────────
 
 @router.get("/{agent_id}/ancestors")
@@ -375,12 +399,33 @@ async def move_agent(
     if agent_id == body.new_parent_id:
         raise HTTPException(status_code=400, detail="Cannot move agent under itself")
 
-    await move_node(session, agent_id, body.new_parent_id)
+    try:
+        await move_node(session, agent_id, body.new_parent_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     await session.commit()
+    await admin_scope.invalidate()
 
     return {"detail": "Agent moved successfully"}
 
 
+@router.post("/tree/verify", response_model=TreeVerifyResponse)
+async def verify_agent_tree(
+    body: TreeVerifyRequest,
+    current_user: AdminUser = Depends(PermissionChecker("agents.update")),
+):
+    """Diff admin_user_tree against admin_users.parent_id; apply=True also repairs it.
+
+    Reads the whole tree, so it is limited to super admins.
+    """
+    if current_user.role != "super_admin":
+        raise HTTPException(status_code=403, detail="Only super admins can verify the tree")
+    try:
+        return await verify_tree("agent", apply=body.apply)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # ─── Commission Rates (Hierarchical) ─────────────────────────────
 
 GAME_CATEGORIES = ["casino", "slot", "holdem", "sports", "shooting", "coin", "mini_game"]
@@ -24,6 +24,7 @@ from app.schemas.analytics import (
     RtpByProviderResponse,
     RtpTrendResponse,
 )
+from app.services.commission_cache import invalidate_user_status
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
@@ -212,6 +213,7 @@ async def bulk_update_user_status(
 
     success_count = 0
     errors = []
+    updated_ids = []
 
     for user_id in body.user_ids:
         user = await session.get(User, user_id)
@@ -221,9 +223,12 @@ async def bulk_update_user_status(
         user.status = body.new_status
         user.updated_at = datetime.now(timezone.utc)
         session.add(user)
+        updated_ids.append(user_id)
         success_count += 1
 
     await session.commit()
+    for user_id in updated_ids:
+        invalidate_user_status(user_id)
 
     return BulkOperationResult(
         success_count=success_count,
@@ -1,10 +1,10 @@
 """Audit log endpoints: list, detail, Excel export."""
 
 import io
-from datetime import date, datetime, timezone
+from datetime import date
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import func, select
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import StreamingResponse
 
@@ -13,6 +13,14 @@ from app.database import get_session
 from app.models.admin_user import AdminUser
 from app.models.audit_log import AuditLog
 from app.schemas.audit import AuditLogListResponse, AuditLogResponse
+from app.services.list_query import (
+    contains_any,
+    count_total,
+    day_range,
+    equals,
+    fetch_page,
+    wants_totals,
+)
 
 router = APIRouter(prefix="/audit", tags=["audit"])
 
@@ -48,20 +56,26 @@ async def _batch_admin_usernames(session: AsyncSession, logs: list[AuditLog]) ->
     return {row[0]: row[1] for row in result.all()}
 
 
-def _parse_dates(start_date: str | None, end_date: str | None) -> tuple[datetime | None, datetime | None]:
-    start = None
-    end = None
-    if start_date:
-        start = datetime.combine(
-            datetime.strptime(start_date, "%Y-%m-%d").date(),
-            datetime.min.time(), tzinfo=timezone.utc,
-        )
-    if end_date:
-        end = datetime.combine(
-            datetime.strptime(end_date, "%Y-%m-%d").date(),
-            datetime.max.time(), tzinfo=timezone.utc,
+def _log_filters(
+    action: str | None,
+    module: str | None,
+    admin_user_id: int | None,
+    admin_username: str | None,
+    start_date: str | None,
+    end_date: str | None,
+) -> list:
+    conditions = [
+        *equals((AuditLog.action, action), (AuditLog.module, module), (AuditLog.admin_user_id, admin_user_id)),
+        *day_range(AuditLog.created_at, start_date, end_date),
+    ]
+    if admin_username:
+        admin_ids_subq = (
+            select(AdminUser.id)
+            .where(*contains_any([AdminUser.username], admin_username))
+            .scalar_subquery()
         )
-    return start, end
+        conditions.append(AuditLog.admin_user_id.in_(admin_ids_subq))
+    return conditions
 
 
 # ─── List Audit Logs ──────────────────────────────────────────────
@@ -70,6 +84,7 @@ def _parse_dates(start_date: str | None, end_date: str | None) -> tuple[datetime
 async def list_audit_logs(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None, description="Keyset mode: empty for the first page, then next_cursor"),
     action: str | None = Query(None),
     module: str | None = Query(None),
     admin_user_id: int | None = Query(None),
@@ -79,40 +94,26 @@ async def list_audit_logs(
     session: AsyncSession = Depends(get_session),
     current_user: AdminUser = Depends(PermissionChecker("audit_log.view")),
 ):
-    base = select(AuditLog)
-
-    if action:
-        base = base.where(AuditLog.action == action)
-    if module:
-        base = base.where(AuditLog.module == module)
-    if admin_user_id:
-        base = base.where(AuditLog.admin_user_id == admin_user_id)
-    if admin_username:
-        admin_ids_subq = (
-            select(AdminUser.id)
-            .where(AdminUser.username.ilike(f"%{admin_username}%"))
-            .scalar_subquery()
-        )
-        base = base.where(AuditLog.admin_user_id.in_(admin_ids_subq))
-
-    start, end = _parse_dates(start_date, end_date)
-    if start:
-        base = base.where(AuditLog.created_at >= start)
-    if end:
-        base = base.where(AuditLog.created_at <= end)
-
-    count_stmt = select(func.count()).select_from(base.subquery())
-    total = (await session.execute(count_stmt)).scalar() or 0
+    base = select(AuditLog).where(
+        *_log_filters(action, module, admin_user_id, admin_username, start_date, end_date),
+    )
 
-    stmt = base.order_by(AuditLog.created_at.desc()).offset(
-        (page - 1) * page_size
-    ).limit(page_size)
-    result = await session.execute(stmt)
-    logs = result.scalars().all()
+    try:
+        rows, next_cursor = await fetch_page(
+            session, base, ts_column=AuditLog.created_at, id_column=AuditLog.id,
+            page=page, page_size=page_size, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total, total_is_estimate = await count_total(session, base) if wants_totals(cursor) else (None, False)
 
+    logs = [row[0] for row in rows]
     username_map = await _batch_admin_usernames(session, logs)
     items = [_build_log_response(log, username_map.get(log.admin_user_id)) for log in logs]
-    return AuditLogListResponse(items=items, total=total, page=page, page_size=page_size)
+    return AuditLogListResponse(
+        items=items, total=total, page=page, page_size=page_size, next_cursor=next_cursor,
+        total_is_estimate=total_is_estimate,
+    )
 
 
 # ─── Export Audit Logs (Excel) ── MUST be before {log_id} route ──
@@ -128,27 +129,9 @@ async def export_audit_logs(
     session: AsyncSession = Depends(get_session),
     current_user: AdminUser = Depends(PermissionChecker("audit_log.export")),
 ):
-    base = select(AuditLog)
-
-    if action:
-        base = base.where(AuditLog.action == action)
-    if module:
-        base = base.where(AuditLog.module == module)
-    if admin_user_id:
-        base = base.where(AuditLog.admin_user_id == admin_user_id)
-    if admin_username:
-        admin_ids_subq = (
-            select(AdminUser.id)
-            .where(AdminUser.username.ilike(f"%{admin_username}%"))
-            .scalar_subquery()
-        )
-        base = base.where(AuditLog.admin_user_id.in_(admin_ids_subq))
-
-    start, end = _parse_dates(start_date, end_date)
-    if start:
-        base = base.where(AuditLog.created_at >= start)
-    if end:
-        base = base.where(AuditLog.created_at <= end)
+    base = select(AuditLog).where(
+        *_log_filters(action, module, admin_user_id, admin_username, start_date, end_date),
+    )
 
     stmt = base.order_by(AuditLog.created_at.desc()).limit(5000)
     result = await session.execute(stmt)
@@ -3,10 +3,10 @@
 import hashlib
 import hmac
 import time as _time
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from decimal import Decimal
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy import and_, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -17,15 +17,23 @@ from app.models.admin_user import AdminUser
 from app.models.commission import (
     AgentCommissionOverride,
     CommissionLedger,
+    CommissionLedgerKey,
     CommissionPolicy,
 )
 from app.models.user import User
 from app.schemas.commission import (
+    BetBatchWebhook,
     BetWebhook,
     CommissionPolicyCreate,
     CommissionPolicyListResponse,
     CommissionPolicyResponse,
     CommissionPolicyUpdate,
+    CommissionReplayRequest,
+    CommissionReplayResponse,
+    CommissionSimulateRequest,
+    CommissionSimulateResponse,
+    LedgerArchiveMonth,
+    LedgerArchiveRequest,
     LedgerListResponse,
     LedgerResponse,
     LedgerSummary,
@@ -34,10 +42,24 @@ from app.schemas.commission import (
     OverrideUpdate,
     RoundResultWebhook,
 )
+from app.services.commission_cache import invalidate_policies, mark_rounds_seen, seen_rounds
 from app.services.commission_engine import (
     calculate_losing_commission,
     calculate_rolling_commission,
+    process_rolling_batch,
+    process_round_settlement,
 )
+from app.services.commission_partitions import (
+    archive_months,
+    archived_months,
+    ledger_period,
+    ledger_source,
+)
+from app.services.commission_queue import enqueue_event
+from app.services.commission_replay import replay_commissions
+from app.services.commission_rollup import sum_by_type
+from app.services.commission_simulator import simulate_rate_changes
+from app.services.list_query import count_total, equals, fetch_page, wants_totals
 
 router = APIRouter(prefix="/commissions", tags=["commissions"])
 
@@ -96,6 +118,7 @@ async def create_policy(
     )
     session.add(policy)
     await session.commit()
+    await invalidate_policies()
     await session.refresh(policy)
     return CommissionPolicyResponse.model_validate(policy)
 
@@ -130,6 +153,7 @@ async def update_policy(
 
     session.add(policy)
     await session.commit()
+    await invalidate_policies()
     await session.refresh(policy)
     return CommissionPolicyResponse.model_validate(policy)
 
@@ -158,6 +182,7 @@ async def delete_policy(
     else:
         await session.delete(policy)
         await session.commit()
+    await invalidate_policies()
 
 
 # ─── Agent Override CRUD ──────────────────────────────────────────
@@ -333,6 +358,7 @@ def _build_ledger_response(ledger: CommissionLedger, recipient_username: str | N
 async def list_ledger(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None, description="Keyset mode: empty for the first page, then next_cursor"),
     recipient_user_id: int | None = Query(None),
     user_id: int | None = Query(None),
     type_filter: str | None = Query(None, alias="type"),
@@ -343,45 +369,49 @@ async def list_ledger(
     session: AsyncSession = Depends(get_session),
     current_user: AdminUser = Depends(PermissionChecker("commission.view")),
 ):
-    base = select(CommissionLedger)
-    if recipient_user_id:
-        base = base.where(CommissionLedger.recipient_user_id == recipient_user_id)
-    if user_id:
-        base = base.where(CommissionLedger.user_id == user_id)
-    if type_filter:
-        base = base.where(CommissionLedger.type == type_filter)
-    if status_filter:
-        base = base.where(CommissionLedger.status == status_filter)
-    if game_category:
-        base = base.where(CommissionLedger.game_category == game_category)
-    if date_from:
-        base = base.where(CommissionLedger.created_at >= datetime.fromisoformat(f"{date_from}T00:00:00"))
-    if date_to:
-        base = base.where(CommissionLedger.created_at <= datetime.fromisoformat(f"{date_to}T23:59:59"))
-
-    count_stmt = select(func.count()).select_from(base.subquery())
-    total = (await session.execute(count_stmt)).scalar() or 0
-
-    sum_stmt = select(func.coalesce(func.sum(CommissionLedger.commission_amount), 0)).select_from(base.subquery())
-    total_commission = (await session.execute(sum_stmt)).scalar() or Decimal("0")
+    period_from = datetime.fromisoformat(f"{date_from}T00:00:00") if date_from else None
+    period_to = datetime.fromisoformat(f"{date_to}T23:59:59") if date_to else None
+    # Includes archived months when the range reaches them
+    ledger = await ledger_source(session, period_from, period_to)
+
+    base = select(ledger).where(
+        *ledger_period(ledger, period_from, period_to),
+        *equals(
+            (ledger.recipient_user_id, recipient_user_id),
+            (ledger.user_id, user_id),
+            (ledger.type, type_filter),
+            (ledger.status, status_filter),
+            (ledger.game_category, game_category),
+        ),
+    )
 
     # Alias for recipient and bettor user joins
     RecipientUser = User.__table__.alias("recipient_user")
     BettorUser = User.__table__.alias("bettor_user")
 
     stmt = (
-        base.join(RecipientUser, RecipientUser.c.id == CommissionLedger.recipient_user_id, isouter=True)
-        .join(BettorUser, BettorUser.c.id == CommissionLedger.user_id, isouter=True)
+        base.join(RecipientUser, RecipientUser.c.id == ledger.recipient_user_id, isouter=True)
+        .join(BettorUser, BettorUser.c.id == ledger.user_id, isouter=True)
         .add_columns(
             RecipientUser.c.username.label("recipient_username"),
             BettorUser.c.username.label("user_username"),
         )
-        .order_by(CommissionLedger.created_at.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
     )
-    result = await session.execute(stmt)
-    rows = result.all()
+    try:
+        rows, next_cursor = await fetch_page(
+            session, stmt, ts_column=ledger.created_at, id_column=ledger.id,
+            page=page, page_size=page_size, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    total = total_commission = None
+    total_is_estimate = False
+    if wants_totals(cursor):
+        total, total_is_estimate = await count_total(session, base)
+        filtered = base.subquery()
+        sum_stmt = select(func.coalesce(func.sum(filtered.c.commission_amount), 0))
+        total_commission = (await session.execute(sum_stmt)).scalar() or Decimal("0")
 
     items = [_build_ledger_response(row[0], row[1], row[2]) for row in rows]
 
@@ -390,6 +420,8 @@ async def list_ledger(
         total=total,
         page=page,
         page_size=page_size,
+        next_cursor=next_cursor,
+        total_is_estimate=total_is_estimate,
         total_commission=total_commission,
     )
 
@@ -405,23 +437,36 @@ async def ledger_summary(
     current_user: AdminUser = Depends(PermissionChecker("commission.view")),
 ):
     """Aggregate commission totals by type."""
+    if not user_id and not game_category:
+        # The daily rollup has no bettor or category dimension; everything else it answers
+        by_type = await sum_by_type(
+            session,
+            recipient_ids=[recipient_user_id] if recipient_user_id else None,
+            day_from=date.fromisoformat(date_from) if date_from else None,
+            day_to=date.fromisoformat(date_to) if date_to else None,
+        )
+        return [
+            LedgerSummary(type=ctype, total_amount=amount, count=count)
+            for ctype, (amount, _, count) in by_type.items()
+        ]
+
+    period_from = datetime.fromisoformat(f"{date_from}T00:00:00") if date_from else None
+    period_to = datetime.fromisoformat(f"{date_to}T23:59:59") if date_to else None
+    ledger = await ledger_source(session, period_from, period_to)
+
     base = select(
-        CommissionLedger.type,
-        func.sum(CommissionLedger.commission_amount).label("total_amount"),
+        ledger.type,
+        func.sum(ledger.commission_amount).label("total_amount"),
         func.count().label("count"),
-    )
+    ).where(*ledger_period(ledger, period_from, period_to))
     if recipient_user_id:
-        base = base.where(CommissionLedger.recipient_user_id == recipient_user_id)
+        base = base.where(ledger.recipient_user_id == recipient_user_id)
     if user_id:
-        base = base.where(CommissionLedger.user_id == user_id)
+        base = base.where(ledger.user_id == user_id)
     if game_category:
-        base = base.where(CommissionLedger.game_category == game_category)
-    if date_from:
-        base = base.where(CommissionLedger.created_at >= datetime.fromisoformat(f"{date_from}T00:00:00"))
-    if date_to:
-        base = base.where(CommissionLedger.created_at <= datetime.fromisoformat(f"{date_to}T23:59:59"))
+        base = base.where(ledger.game_category == game_category)
 
-    stmt = base.group_by(CommissionLedger.type)
+    stmt = base.group_by(ledger.type)
     result = await session.execute(stmt)
 
     return [
@@ -430,6 +475,77 @@ async def ledger_summary(
     ]
 
 
+@router.get("/ledger/archives", response_model=list[LedgerArchiveMonth])
+async def list_ledger_archives(
+    session: AsyncSession = Depends(get_session),
+    current_user: AdminUser = Depends(PermissionChecker("commission.view")),
+):
+    """Ledger months detached into the archive (still readable through /ledger)."""
+    return [LedgerArchiveMonth.model_validate(a) for a in await archived_months(session)]
+
+
+@router.post("/ledger/archives", response_model=list[LedgerArchiveMonth])
+async def archive_ledger(
+    body: LedgerArchiveRequest,
+    current_user: AdminUser = Depends(PermissionChecker("commission.update")),
+):
+    """Archive settled ledger months now instead of waiting for the maintenance task."""
+    try:
+        archived = await archive_months(body.older_than_months)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [LedgerArchiveMonth(**a) for a in archived]
+
+
+# ─── Replay ───────────────────────────────────────────────────────
+
+@router.post("/replay", response_model=CommissionReplayResponse)
+async def replay_ledger(
+    body: CommissionReplayRequest,
+    current_user: AdminUser = Depends(PermissionChecker("commission.update")),
+):
+    """Recompute commissions of bets in a date range with the current rates and tree.
+
+    dry_run (default) only reports differences against the ledger; otherwise
+    correcting entries are written and recipients' points adjusted.
+    """
+    if body.date_to <= body.date_from:
+        raise HTTPException(status_code=400, detail="date_to must be after date_from")
+
+    try:
+        return await replay_commissions(
+            body.date_from,
+            body.date_to,
+            dry_run=body.dry_run,
+            commission_type=body.commission_type,
+            game_category=body.game_category,
+            workers=body.workers,
+            chunk_size=body.chunk_size,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/simulate", response_model=CommissionSimulateResponse)
+async def simulate_commission(
+    body: CommissionSimulateRequest,
+    session: AsyncSession = Depends(get_session),
+    current_user: AdminUser = Depends(PermissionChecker("commission.view")),
+):
+    """Estimate per-recipient commission before/after proposed rate changes."""
+    if body.date_to <= body.date_from:
+        raise HTTPException(status_code=400, detail="date_to must be after date_from")
+    if all(c.rolling_rate is None and c.losing_rate is None for c in body.changes):
+        raise HTTPException(status_code=400, detail="No rate changes given")
+
+    return await simulate_rate_changes(
+        session,
+        [c.model_dump() for c in body.changes],
+        body.date_from,
+        body.date_to,
+    )
+
+
 # ─── Webhooks (External Game Events) ─────────────────────────────
 
 _WEBHOOK_TIMESTAMP_TOLERANCE = 300  # 5 minutes
@@ -482,15 +598,26 @@ async def _verify_webhook_signature(request: Request) -> None:
 async def receive_bet_webhook(
     body: BetWebhook,
     request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_session),
 ):
     """Receive bet event from game backend. Generates rolling commissions.
 
     MLM model: user_id is the bettor. Commission is distributed to the bettor
     (self-rolling) and all ancestors in the referral tree (waterfall).
+    With COMMISSION_QUEUE_ENABLED the event is only queued (202).
     """
     await _verify_webhook_signature(request)
 
+    # Provider retries of processed rounds are answered from Redis alone
+    if await seen_rounds("rolling", [body.round_id]):
+        return {"detail": "Already processed", "entries": 0}
+
+    if settings.COMMISSION_QUEUE_ENABLED:
+        event_id = await enqueue_event("bet", body.model_dump(mode="json"))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"detail": "Queued", "event_id": event_id}
+
     # Verify user exists
     user = await session.get(User, body.user_id)
     if not user:
@@ -498,14 +625,15 @@ async def receive_bet_webhook(
 
     # Check duplicate round_id
     existing = await session.execute(
-        select(CommissionLedger).where(
+        select(CommissionLedgerKey.reference_id).where(
             and_(
-                CommissionLedger.reference_id == body.round_id,
-                CommissionLedger.reference_type == "bet",
+                CommissionLedgerKey.reference_id == body.round_id,
+                CommissionLedgerKey.type == "rolling",
             )
         ).limit(1)
     )
-    if existing.scalar_one_or_none():
+    if existing.scalar_one_or_none() is not None:
+        await mark_rounds_seen("rolling", [body.round_id])
         return {"detail": "Already processed", "entries": 0}
 
     entries = await calculate_rolling_commission(
@@ -517,6 +645,7 @@ async def receive_bet_webhook(
         game_code=body.game_code,
     )
     await session.commit()
+    await mark_rounds_seen("rolling", [body.round_id])
 
     return {
         "detail": "Rolling commission processed",
@@ -525,18 +654,61 @@ async def receive_bet_webhook(
     }
 
 
+@router.post("/webhook/bets:batch", status_code=status.HTTP_201_CREATED)
+async def receive_bet_batch_webhook(
+    body: BetBatchWebhook,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+):
+    """Receive many bet events in one call. Generates rolling commissions.
+
+    All rounds are processed in one transaction; the response lists a per-round
+    outcome (processed / duplicate / skipped / user_not_found) in request order.
+    """
+    await _verify_webhook_signature(request)
+
+    outcomes = await process_rolling_batch(
+        session=session,
+        bets=[b.model_dump() for b in body.bets],
+    )
+    await session.commit()
+    await mark_rounds_seen("rolling", list({
+        o["round_id"] for o in outcomes if o["status"] != "user_not_found"
+    }))
+
+    processed = [o for o in outcomes if o["status"] == "processed"]
+    return {
+        "detail": "Rolling commission batch processed",
+        "processed": len(processed),
+        "duplicates": sum(1 for o in outcomes if o["status"] == "duplicate"),
+        "entries": sum(o["entries"] for o in outcomes),
+        "total": str(sum(o["total"] for o in processed)),
+        "results": [{**o, "total": str(o["total"])} for o in outcomes],
+    }
+
+
 @router.post("/webhook/round-result", status_code=status.HTTP_201_CREATED)
 async def receive_round_result_webhook(
     body: RoundResultWebhook,
     request: Request,
+    response: Response,
     session: AsyncSession = Depends(get_session),
 ):
     """Receive game round result from game backend. Generates losing commissions on losses.
 
     MLM model: user_id is the bettor. Losing commission distributed via waterfall.
+    With COMMISSION_QUEUE_ENABLED the event is only queued (202).
     """
     await _verify_webhook_signature(request)
 
+    if await seen_rounds("losing", [body.round_id]):
+        return {"detail": "Already processed", "entries": 0}
+
+    if settings.COMMISSION_QUEUE_ENABLED:
+        event_id = await enqueue_event("round_result", body.model_dump(mode="json"))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"detail": "Queued", "event_id": event_id}
+
     user = await session.get(User, body.user_id)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
@@ -546,14 +718,15 @@ async def receive_round_result_webhook(
 
     # Check duplicate
     existing = await session.execute(
-        select(CommissionLedger).where(
+        select(CommissionLedgerKey.reference_id).where(
             and_(
-                CommissionLedger.reference_id == body.round_id,
-                CommissionLedger.reference_type == "round_result",
+                CommissionLedgerKey.reference_id == body.round_id,
+                CommissionLedgerKey.type == "losing",
             )
         ).limit(1)
     )
-    if existing.scalar_one_or_none():
+    if existing.scalar_one_or_none() is not None:
+        await mark_rounds_seen("losing", [body.round_id])
         return {"detail": "Already processed", "entries": 0}
 
     entries = await calculate_losing_commission(
@@ -566,9 +739,61 @@ async def receive_round_result_webhook(
         game_code=body.game_code,
     )
     await session.commit()
+    await mark_rounds_seen("losing", [body.round_id])
 
     return {
         "detail": "Losing commission processed",
         "entries": len(entries),
         "total": str(sum(e.commission_amount for e in entries)),
     }
+
+
+@router.post("/webhook/round-settlement", status_code=status.HTTP_201_CREATED)
+async def receive_round_settlement_webhook(
+    body: RoundResultWebhook,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_session),
+):
+    """Receive a settled round and generate rolling and losing commission together.
+
+    For providers that only send round results: replaces calling both the bet
+    and round-result webhooks. Rolling stays idempotent on the bet, losing on
+    the round result, so mixing this with the separate webhooks is safe.
+    With COMMISSION_QUEUE_ENABLED the event is only queued (202).
+    """
+    await _verify_webhook_signature(request)
+
+    seen = [await seen_rounds(ctype, [body.round_id]) for ctype in ("rolling", "losing")]
+    if all(seen):
+        return {"detail": "Already processed", "rolling_entries": 0, "losing_entries": 0}
+
+    if settings.COMMISSION_QUEUE_ENABLED:
+        event_id = await enqueue_event("round_settlement", body.model_dump(mode="json"))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"detail": "Queued", "event_id": event_id}
+
+    user = await session.get(User, body.user_id)
+    if not user:
+        raise HTTPException(status_code=400, detail="User not found")
+
+    entries = await process_round_settlement(
+        session=session,
+        user_id=body.user_id,
+        game_category=body.game_category,
+        bet_amount=body.bet_amount,
+        win_amount=body.win_amount,
+        round_id=body.round_id,
+        result=body.result,
+        game_code=body.game_code,
+    )
+    await session.commit()
+    await mark_rounds_seen("rolling", [body.round_id])
+    await mark_rounds_seen("losing", [body.round_id])
+
+    return {
+        "detail": "Round commission processed",
+        "rolling_entries": len(entries["rolling"]),
+        "losing_entries": len(entries["losing"]),
+        "total": str(sum(e.commission_amount for rows in entries.values() for e in rows)),
+    }
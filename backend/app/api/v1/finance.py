@@ -1,7 +1,5 @@
 """Finance/Transaction management endpoints."""
 
-from datetime import datetime, time as time_type, timezone
-
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -21,7 +19,7 @@ from app.schemas.transaction import (
     WithdrawalCreate,
 )
 from app.services import notification_service
-from app.utils.events import publish_event
+from app.services.list_query import count_total, day_range, equals, fetch_page, wants_totals
 from app.services.transaction_service import (
     approve_transaction,
     create_adjustment,
@@ -29,6 +27,7 @@ from app.services.transaction_service import (
     create_withdrawal,
     reject_transaction,
 )
+from app.utils.events import publish_event
 
 router = APIRouter(prefix="/finance", tags=["finance"])
 
@@ -116,6 +115,7 @@ async def _batch_build_responses(
 async def list_transactions(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None, description="Keyset mode: empty for the first page, then next_cursor"),
     type_filter: str | None = Query(None, alias="type"),
     status_filter: str | None = Query(None, alias="status"),
     user_id: int | None = Query(None),
@@ -124,43 +124,35 @@ async def list_transactions(
     session: AsyncSession = Depends(get_session),
     current_user: AdminUser = Depends(PermissionChecker("transaction.view")),
 ):
-    base = select(Transaction)
-    if type_filter:
-        base = base.where(Transaction.type == type_filter)
-    if status_filter:
-        base = base.where(Transaction.status == status_filter)
-    if user_id:
-        base = base.where(Transaction.user_id == user_id)
-    if start_date:
-        start_dt = datetime.combine(
-            datetime.strptime(start_date, "%Y-%m-%d").date(),
-            time_type.min,
-            tzinfo=timezone.utc,
-        )
-        base = base.where(Transaction.created_at >= start_dt)
-    if end_date:
-        end_dt = datetime.combine(
-            datetime.strptime(end_date, "%Y-%m-%d").date(),
-            time_type.max,
-            tzinfo=timezone.utc,
-        )
-        base = base.where(Transaction.created_at <= end_dt)
-
-    count_stmt = select(func.count()).select_from(base.subquery())
-    total = (await session.execute(count_stmt)).scalar() or 0
+    base = select(Transaction).where(
+        *equals(
+            (Transaction.type, type_filter),
+            (Transaction.status, status_filter),
+            (Transaction.user_id, user_id),
+        ),
+        *day_range(Transaction.created_at, start_date, end_date),
+    )
 
-    sum_stmt = select(func.coalesce(func.sum(Transaction.amount), 0)).select_from(base.subquery())
-    total_amount = (await session.execute(sum_stmt)).scalar()
+    try:
+        rows, next_cursor = await fetch_page(
+            session, base, ts_column=Transaction.created_at, id_column=Transaction.id,
+            page=page, page_size=page_size, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    stmt = base.order_by(Transaction.created_at.desc()).offset(
-        (page - 1) * page_size
-    ).limit(page_size)
-    result = await session.execute(stmt)
-    transactions = result.scalars().all()
+    total = total_amount = None
+    total_is_estimate = False
+    if wants_totals(cursor):
+        total, total_is_estimate = await count_total(session, base)
+        filtered = base.subquery()
+        sum_stmt = select(func.coalesce(func.sum(filtered.c.amount), 0))
+        total_amount = (await session.execute(sum_stmt)).scalar()
 
-    items = await _batch_build_responses(session, list(transactions))
+    items = await _batch_build_responses(session, [row[0] for row in rows])
     return TransactionListResponse(
         items=items, total=total, page=page, page_size=page_size, total_amount=total_amount,
+        next_cursor=next_cursor, total_is_estimate=total_is_estimate,
     )
 
 
@@ -15,10 +15,13 @@ from app.models.transaction import Transaction
 from app.models.user import User
 from app.schemas.monitoring import (
     ActiveAlertsResponse,
+    CommissionQueuePartition,
+    CommissionQueueStatsResponse,
     HealthCheckResponse,
     LiveTransactionResponse,
     RealtimeStatsResponse,
 )
+from app.services.commission_queue import get_queue_stats
 
 router = APIRouter(prefix="/monitoring", tags=["monitoring"])
 
@@ -192,3 +195,23 @@ async def health_check(
         service="admin-panel-backend",
         checks=checks,
     )
+
+
+# ─── Commission Queue ────────────────────────────────────────────
+
+@router.get("/commission-queue", response_model=CommissionQueueStatsResponse)
+async def commission_queue_stats(
+    current_user: AdminUser = Depends(PermissionChecker("monitoring.view")),
+):
+    if not settings.COMMISSION_QUEUE_ENABLED:
+        return CommissionQueueStatsResponse(enabled=False)
+
+    partitions = [CommissionQueuePartition(**p) for p in await get_queue_stats()]
+    ages = [p.oldest_age_seconds for p in partitions if p.oldest_age_seconds is not None]
+    return CommissionQueueStatsResponse(
+        enabled=True,
+        total_lag=sum(p.lag or 0 for p in partitions),
+        total_pending=sum(p.pending for p in partitions),
+        max_age_seconds=max(ages) if ages else None,
+        partitions=partitions,
+    )
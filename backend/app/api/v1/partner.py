@@ -28,6 +28,8 @@ from app.schemas.partner import (
     PartnerUserItem,
     PartnerUserListResponse,
 )
+from app.services.commission_rollup import sum_by_type
+from app.services.subtree_stats import get_user_totals
 from app.services.user_tree_service import get_descendants as get_user_descendants
 
 router = APIRouter(prefix="/partner", tags=["partner"])
@@ -58,33 +60,12 @@ async def get_partner_dashboard(
     current_user: AdminUser = Depends(PermissionChecker("partner.view")),
 ) -> PartnerDashboardStats:
     user_id = await _resolve_user_id(session, current_user)
-    descendant_ids = await _get_user_descendant_ids(session, user_id)
-    all_ids = [user_id] + descendant_ids
-
-    # Count sub-agents (excluding self)
-    total_sub_agents = len(descendant_ids)
-
-    # Count unique bettors from commission ledger under this subtree
-    total_sub_users = (await session.execute(
-        select(func.count(func.distinct(CommissionLedger.user_id))).where(
-            CommissionLedger.recipient_user_id.in_(all_ids)
-        )
-    )).scalar() or 0
-
-    # Total bet amount from commission ledger (source_amount for rolling type)
-    total_bet_amount = (await session.execute(
-        select(func.coalesce(func.sum(CommissionLedger.source_amount), 0)).where(
-            CommissionLedger.recipient_user_id.in_(all_ids),
-            CommissionLedger.type == "rolling",
-        )
-    )).scalar() or 0
+    # Subtree totals, bettors included, are one maintained row (see subtree_stats)
+    totals = await get_user_totals(session, user_id)
 
     # Total commission earned (own only)
-    total_commission = (await session.execute(
-        select(func.coalesce(func.sum(CommissionLedger.commission_amount), 0)).where(
-            CommissionLedger.recipient_user_id == user_id,
-        )
-    )).scalar() or 0
+    own = await sum_by_type(session, recipient_ids=[user_id])
+    total_commission = sum(amount for amount, _, _ in own.values())
 
     # This month's data
     month_start = datetime.combine(date.today().replace(day=1), time_type.min, tzinfo=timezone.utc)
@@ -97,21 +78,14 @@ async def get_partner_dashboard(
         )
     )).scalar() or 0
 
-    month_bet_amount = (await session.execute(
-        select(func.coalesce(func.sum(CommissionLedger.source_amount), 0)).where(
-            CommissionLedger.recipient_user_id.in_(all_ids),
-            CommissionLedger.type == "rolling",
-            CommissionLedger.created_at >= month_start,
-        )
-    )).scalar() or 0
-
     return PartnerDashboardStats(
-        total_sub_users=total_sub_users,
-        total_sub_agents=total_sub_agents,
-        total_bet_amount=float(total_bet_amount),
+        total_sub_users=totals["bettor_count"],
+        total_sub_agents=totals["descendant_count"],
+        # Rolling source credited to recipients in the subtree
+        total_bet_amount=float(totals["bet_total"]),
         total_commission=float(total_commission),
         month_settlement=float(month_settlement),
-        month_bet_amount=float(month_bet_amount),
+        month_bet_amount=float(totals["month_bet_amount"]),
     )
 
 
@@ -23,6 +23,7 @@ from app.schemas.salary import (
     SalaryPaymentListResponse,
     SalaryPaymentResponse,
 )
+from app.services import subtree_stats
 
 router = APIRouter(prefix="/salary", tags=["salary"])
 
@@ -390,6 +391,7 @@ async def pay_payment(
         raise HTTPException(status_code=404, detail="Agent not found")
 
     agent.balance += payment.total_amount
+    subtree_stats.record_agent(session, agent.id, balance=payment.total_amount)
     agent.updated_at = datetime.now(timezone.utc)
     session.add(agent)
 
@@ -1,5 +1,6 @@
 """Settlement management endpoints."""
 
+import asyncio
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
@@ -12,6 +13,8 @@ from app.database import get_session
 from app.models.admin_user import AdminUser
 from app.models.settlement import Settlement
 from app.schemas.settlement import (
+    BulkSettlementCreate,
+    BulkSettlementJob,
     SettlementAction,
     SettlementCreate,
     SettlementListResponse,
@@ -21,15 +24,21 @@ from app.schemas.settlement import (
 from app.services.settlement_service import (
     confirm_settlement,
     create_settlement,
+    get_bulk_settlement_job,
     pay_settlement,
     preview_settlement,
     reject_settlement,
+    run_bulk_settlement,
+    start_bulk_settlement,
 )
 
 router = APIRouter(prefix="/settlements", tags=["settlements"])
 
 ConfirmedBy = aliased(AdminUser)
 
+# Running bulk settlement tasks (referenced so they are not garbage-collected)
+_bulk_tasks: set[asyncio.Task] = set()
+
 
 def _parse_date(date_str: str) -> datetime:
     return datetime.fromisoformat(f"{date_str}T00:00:00")
@@ -143,6 +152,45 @@ async def create_settlement_endpoint(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ─── Bulk Period Settlement ───────────────────────────────────────
+
+@router.post("/bulk", response_model=BulkSettlementJob, status_code=status.HTTP_202_ACCEPTED)
+async def start_bulk_settlement_endpoint(
+    body: BulkSettlementCreate,
+    current_user: AdminUser = Depends(PermissionChecker("settlement.create")),
+):
+    """Create draft settlements for every recipient with pending commission in the period.
+
+    Runs in the background; poll GET /settlements/bulk/{job_id} for progress.
+    Starting the same period again resumes after an interrupted run.
+    """
+    try:
+        job = await start_bulk_settlement(
+            _parse_date(body.period_start),
+            _parse_date_end(body.period_end),
+            body.memo,
+            current_user.id,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    task = asyncio.create_task(run_bulk_settlement(dict(job)))
+    _bulk_tasks.add(task)
+    task.add_done_callback(_bulk_tasks.discard)
+    return BulkSettlementJob(**job)
+
+
+@router.get("/bulk/{job_id}", response_model=BulkSettlementJob)
+async def get_bulk_settlement_endpoint(
+    job_id: str,
+    current_user: AdminUser = Depends(PermissionChecker("settlement.view")),
+):
+    job = await get_bulk_settlement_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Bulk settlement job not found")
+    return BulkSettlementJob(**job)
+
+
 # ─── Get One ──────────────────────────────────────────────────────
 
 @router.get("/{settlement_id}", response_model=SettlementResponse)
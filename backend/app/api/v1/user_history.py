@@ -25,6 +25,7 @@ from app.schemas.user_history import (
     PointLogResponse,
     PointSummary,
 )
+from app.services.list_query import between, count_total, equals, fetch_page, wants_totals
 
 router = APIRouter(prefix="/users", tags=["user-history"])
 
@@ -43,6 +44,7 @@ async def list_user_bets(
     user_id: int,
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None, description="Keyset mode: empty for the first page, then next_cursor"),
     game_category: str | None = Query(None),
     date_from: datetime | None = Query(None),
     date_to: datetime | None = Query(None),
@@ -51,36 +53,39 @@ async def list_user_bets(
 ):
     await _verify_user(session, user_id)
 
-    base = select(BetRecord).where(BetRecord.user_id == user_id)
-    if game_category:
-        base = base.where(BetRecord.game_category == game_category)
-    if date_from:
-        base = base.where(BetRecord.bet_at >= date_from)
-    if date_to:
-        base = base.where(BetRecord.bet_at <= date_to)
-
-    count_stmt = select(func.count()).select_from(base.subquery())
-    total = (await session.execute(count_stmt)).scalar() or 0
-
-    # Summary
-    sum_base = select(
-        func.coalesce(func.sum(BetRecord.bet_amount), 0).label("total_bet"),
-        func.coalesce(func.sum(BetRecord.win_amount), 0).label("total_win"),
-        func.coalesce(func.sum(BetRecord.profit), 0).label("net_profit"),
-    ).where(BetRecord.user_id == user_id)
-    if game_category:
-        sum_base = sum_base.where(BetRecord.game_category == game_category)
-    if date_from:
-        sum_base = sum_base.where(BetRecord.bet_at >= date_from)
-    if date_to:
-        sum_base = sum_base.where(BetRecord.bet_at <= date_to)
-
-    sum_row = (await session.execute(sum_base)).one()
+    filters = [
+        BetRecord.user_id == user_id,
+        *equals((BetRecord.game_category, game_category)),
+        *between(BetRecord.bet_at, date_from, date_to),
+    ]
+    base = select(BetRecord).where(*filters)
 
-    stmt = base.order_by(BetRecord.bet_at.desc()).offset((page - 1) * page_size).limit(page_size)
-    result = await session.execute(stmt)
-    records = result.scalars().all()
+    try:
+        rows, next_cursor = await fetch_page(
+            session, base, ts_column=BetRecord.bet_at, id_column=BetRecord.id,
+            page=page, page_size=page_size, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    total = summary = None
+    total_is_estimate = False
+    if wants_totals(cursor):
+        total, total_is_estimate = await count_total(session, base)
+        sum_row = (await session.execute(
+            select(
+                func.coalesce(func.sum(BetRecord.bet_amount), 0).label("total_bet"),
+                func.coalesce(func.sum(BetRecord.win_amount), 0).label("total_win"),
+                func.coalesce(func.sum(BetRecord.profit), 0).label("net_profit"),
+            ).where(*filters)
+        )).one()
+        summary = BetSummary(
+            total_bet=sum_row.total_bet,
+            total_win=sum_row.total_win,
+            net_profit=sum_row.net_profit,
+        )
 
+    records = [row[0] for row in rows]
     items = [
         BetRecordResponse(
             id=r.id,
@@ -103,11 +108,9 @@ async def list_user_bets(
         total=total,
         page=page,
         page_size=page_size,
-        summary=BetSummary(
-            total_bet=sum_row.total_bet,
-            total_win=sum_row.total_win,
-            net_profit=sum_row.net_profit,
-        ),
+        next_cursor=next_cursor,
+        total_is_estimate=total_is_estimate,
+        summary=summary,
     )
 
 
@@ -126,30 +129,22 @@ async def list_user_money_logs(
 ):
     user = await _verify_user(session, user_id)
 
-    base = select(MoneyLog).where(MoneyLog.user_id == user_id)
-    if type_filter:
-        base = base.where(MoneyLog.type == type_filter)
-    if date_from:
-        base = base.where(MoneyLog.created_at >= date_from)
-    if date_to:
-        base = base.where(MoneyLog.created_at <= date_to)
+    filters = [
+        MoneyLog.user_id == user_id,
+        *equals((MoneyLog.type, type_filter)),
+        *between(MoneyLog.created_at, date_from, date_to),
+    ]
+    base = select(MoneyLog).where(*filters)
 
-    count_stmt = select(func.count()).select_from(base.subquery())
-    total = (await session.execute(count_stmt)).scalar() or 0
+    total, total_is_estimate = await count_total(session, base)
 
     # Summary: credit = positive amounts, debit = negative amounts
-    sum_base = select(
-        func.coalesce(func.sum(case((MoneyLog.amount > 0, MoneyLog.amount))), 0).label("total_credit"),
-        func.coalesce(func.sum(case((MoneyLog.amount < 0, func.abs(MoneyLog.amount)))), 0).label("total_debit"),
-    ).where(MoneyLog.user_id == user_id)
-    if type_filter:
-        sum_base = sum_base.where(MoneyLog.type == type_filter)
-    if date_from:
-        sum_base = sum_base.where(MoneyLog.created_at >= date_from)
-    if date_to:
-        sum_base = sum_base.where(MoneyLog.created_at <= date_to)
-
-    sum_row = (await session.execute(sum_base)).one()
+    sum_row = (await session.execute(
+        select(
+            func.coalesce(func.sum(case((MoneyLog.amount > 0, MoneyLog.amount))), 0).label("total_credit"),
+            func.coalesce(func.sum(case((MoneyLog.amount < 0, func.abs(MoneyLog.amount)))), 0).label("total_debit"),
+        ).where(*filters)
+    )).one()
 
     stmt = base.order_by(MoneyLog.created_at.desc()).offset((page - 1) * page_size).limit(page_size)
     result = await session.execute(stmt)
@@ -174,6 +169,7 @@ async def list_user_money_logs(
         total=total,
         page=page,
         page_size=page_size,
+        total_is_estimate=total_is_estimate,
         summary=MoneySummary(
             current_balance=user.balance,
             total_credit=sum_row.total_credit,
@@ -6,12 +6,12 @@ from datetime import datetime, timezone
 from decimal import Decimal
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import func, or_, select
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import PermissionChecker
 from app.database import get_session
-from app.models.admin_user import AdminUser, AdminUserTree
+from app.models.admin_user import AdminUser
 from app.models.user import User, UserTree
 from app.models.user_betting_permission import UserBettingPermission
 from app.models.user_game_rolling_rate import UserGameRollingRate
@@ -26,12 +26,16 @@ from app.schemas.user import (
     NullBettingConfigResponse,
     NullBettingConfigUpdate,
     PasswordSet,
+    TreeVerifyRequest,
+    TreeVerifyResponse,
     UserCreate,
     UserDetailResponse,
     UserListResponse,
+    UserMoveRequest,
     UserResponse,
     UserStatistics,
     UserSummaryStats,
+    UserTreeChildrenResponse,
     UserTreeNode,
     UserTreeResponse,
     UserUpdate,
@@ -39,22 +43,32 @@ from app.schemas.user import (
     WalletAddressResponse,
     WalletAddressUpdate,
 )
-from app.services import notification_service
+from app.services import admin_scope, notification_service, user_tree_index
+from app.services.closure_verify import verify_tree
+from app.services.commission_cache import (
+    clear_ancestor_chains,
+    invalidate_rates,
+    invalidate_user_status,
+)
+from app.services.commission_engine import LOSING_MAX_RATE, ROLLING_MAX_RATES
+from app.services.list_query import count_total, equals, fetch_page, wants_totals
 from app.services.promotion_service import cascade_promotion_check
+from app.services.user_detail import load_user_detail
+from app.services.user_search import search_filter, search_rank
 from app.services.user_tree_service import (
     get_ancestors,
+    get_children_page,
     get_direct_referral_count,
     get_subtree_for_tree_view,
     insert_node,
+    move_node,
 )
 from app.utils.security import hash_password
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-async def _build_response(session: AsyncSession, user: User) -> UserResponse:
-    referrer = await session.get(User, user.referrer_id) if user.referrer_id else None
-    ref_count = await get_direct_referral_count(session, user.id)
+def _to_response(user: User, referrer_username: str | None, direct_referral_count: int) -> UserResponse:
     return UserResponse(
         id=user.id,
         uuid=str(user.uuid),
@@ -68,14 +82,14 @@ async def _build_response(session: AsyncSession, user: User) -> UserResponse:
         deposit_address=user.deposit_address,
         deposit_network=user.deposit_network,
         referrer_id=user.referrer_id,
-        referrer_username=referrer.username if referrer else None,
+        referrer_username=referrer_username,
         depth=user.depth,
         rank=user.rank,
         balance=user.balance,
         points=user.points,
         status=user.status,
         level=user.level,
-        direct_referral_count=ref_count,
+        direct_referral_count=direct_referral_count,
         total_deposit=user.total_deposit,
         total_withdrawal=user.total_withdrawal,
         total_bet=user.total_bet,
@@ -93,6 +107,12 @@ async def _build_response(session: AsyncSession, user: User) -> UserResponse:
     )
 
 
+async def _build_response(session: AsyncSession, user: User) -> UserResponse:
+    referrer = await session.get(User, user.referrer_id) if user.referrer_id else None
+    ref_count = await get_direct_referral_count(session, user.id)
+    return _to_response(user, referrer.username if referrer else None, ref_count)
+
+
 async def _build_response_batch(
     session: AsyncSession,
     users: list[User],
@@ -119,45 +139,14 @@ async def _build_response_batch(
     ref_count_result = await session.execute(ref_count_stmt)
     ref_count_map: dict[int, int] = {r.ancestor_id: r.cnt for r in ref_count_result.all()}
 
-    items = []
-    for user in users:
-        items.append(UserResponse(
-            id=user.id,
-            uuid=str(user.uuid),
-            username=user.username,
-            real_name=user.real_name,
-            phone=user.phone,
-            email=user.email,
-            nickname=user.nickname,
-            color=user.color,
-            registration_ip=user.registration_ip,
-            deposit_address=user.deposit_address,
-            deposit_network=user.deposit_network,
-            referrer_id=user.referrer_id,
-            referrer_username=referrer_map.get(user.referrer_id) if user.referrer_id else None,
-            depth=user.depth,
-            rank=user.rank,
-            balance=user.balance,
-            points=user.points,
-            status=user.status,
-            level=user.level,
-            direct_referral_count=ref_count_map.get(user.id, 0),
-            total_deposit=user.total_deposit,
-            total_withdrawal=user.total_withdrawal,
-            total_bet=user.total_bet,
-            total_win=user.total_win,
-            login_count=user.login_count,
-            last_deposit_at=user.last_deposit_at,
-            last_bet_at=user.last_bet_at,
-            commission_enabled=user.commission_enabled,
-            commission_type=user.commission_type,
-            losing_rate=user.losing_rate,
-            memo=user.memo,
-            last_login_at=user.last_login_at,
-            created_at=user.created_at,
-            updated_at=user.updated_at,
-        ))
-    return items
+    return [
+        _to_response(
+            user,
+            referrer_map.get(user.referrer_id) if user.referrer_id else None,
+            ref_count_map.get(user.id, 0),
+        )
+        for user in users
+    ]
 
 
 async def _get_user_or_404(session: AsyncSession, user_id: int) -> User:
@@ -175,40 +164,13 @@ async def _verify_user_access(
     """Verify admin has access to the target user.
 
     super_admin: unrestricted access.
-    Other roles: check if target user's referral chain intersects with the
-    set of users managed by any agent in the current admin's subtree.
+    Other roles: the target user or one of their referral ancestors must be
+    the member account of an agent in the current admin's subtree (the
+    admin's cached scope, see admin_scope).
     """
     if current_user.role == "super_admin":
         return
-
-    # Get all admin IDs in current_user's subtree (including self)
-    descendant_stmt = select(AdminUserTree.descendant_id).where(
-        AdminUserTree.ancestor_id == current_user.id,
-    )
-    descendant_result = await session.execute(descendant_stmt)
-    subtree_agent_ids = {r[0] for r in descendant_result.all()}
-
-    # Get usernames of agents in the subtree to cross-reference with user referral chain
-    agent_stmt = select(AdminUser.username).where(AdminUser.id.in_(subtree_agent_ids))
-    agent_result = await session.execute(agent_stmt)
-    agent_usernames = {r[0] for r in agent_result.all()}
-
-    # Walk the target user's referral ancestor chain (via user_tree)
-    # Check if any user in the chain has a username matching an agent in the subtree
-    ancestor_stmt = select(UserTree.ancestor_id).where(
-        UserTree.descendant_id == target_user_id,
-    )
-    ancestor_result = await session.execute(ancestor_stmt)
-    user_ancestor_ids = {r[0] for r in ancestor_result.all()}
-    user_ancestor_ids.add(target_user_id)
-
-    # Fetch usernames for all ancestors + target user
-    user_stmt = select(User.username).where(User.id.in_(user_ancestor_ids))
-    user_result = await session.execute(user_stmt)
-    ancestor_usernames = {r[0] for r in user_result.all()}
-
-    # Check if the user's referral chain intersects with the admin's agent scope
-    if agent_usernames & ancestor_usernames:
+    if await admin_scope.can_access(session, current_user.id, target_user_id):
         return
 
     raise HTTPException(
@@ -223,42 +185,33 @@ async def _verify_user_access(
 async def list_users(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-    search: str | None = Query(None, max_length=100),
+    cursor: str | None = Query(None, description="Keyset mode: empty for the first page, then next_cursor"),
+    search: str | None = Query(None, max_length=100, description="Id, username, name or phone"),
     status_filter: str | None = Query(None, alias="status"),
     rank: str | None = Query(None),
     referrer_id: int | None = Query(None),
     session: AsyncSession = Depends(get_session),
     current_user: AdminUser = Depends(PermissionChecker("users.view")),
 ):
-    base = select(User)
-
-    if search:
-        safe_search = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
-        base = base.where(
-            or_(
-                User.username.ilike(f"%{safe_search}%", escape="\\"),
-                User.real_name.ilike(f"%{safe_search}%", escape="\\"),
-                User.phone.ilike(f"%{safe_search}%", escape="\\"),
-            )
-        )
-    if status_filter:
-        base = base.where(User.status == status_filter)
-    if rank:
-        base = base.where(User.rank == rank)
-    if referrer_id:
-        base = base.where(User.referrer_id == referrer_id)
-
-    count_stmt = select(func.count()).select_from(base.subquery())
-    total = (await session.execute(count_stmt)).scalar() or 0
-
-    stmt = base.order_by(User.created_at.desc()).offset(
-        (page - 1) * page_size
-    ).limit(page_size)
-    result = await session.execute(stmt)
-    users = result.scalars().all()
+    base = select(User).where(
+        *search_filter(search),
+        *equals((User.status, status_filter), (User.rank, rank), (User.referrer_id, referrer_id)),
+    )
 
-    items = await _build_response_batch(session, list(users))
-    return UserListResponse(items=items, total=total, page=page, page_size=page_size)
+    try:
+        rows, next_cursor = await fetch_page(
+            session, base, ts_column=User.created_at, id_column=User.id,
+            page=page, page_size=page_size, cursor=cursor, rank=search_rank(search),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total, total_is_estimate = await count_total(session, base) if wants_totals(cursor) else (None, False)
+
+    items = await _build_response_batch(session, [row[0] for row in rows])
+    return UserListResponse(
+        items=items, total=total, page=page, page_size=page_size, next_cursor=next_cursor,
+        total_is_estimate=total_is_estimate,
+    )
 
 
 # ─── Summary Stats ───────────────────────────────────────────────
@@ -308,15 +261,18 @@ async def bulk_update_status(
         raise HTTPException(status_code=404, detail=f"Users not found: {missing_ids}")
 
     now = datetime.now(timezone.utc).replace(tzinfo=None)
-    updated_count = 0
+    changed_ids = []
     for user in users:
         if user.status != body.status:
             user.status = body.status
             user.updated_at = now
             session.add(user)
-            updated_count += 1
+            changed_ids.append(user.id)
+    updated_count = len(changed_ids)
 
     await session.commit()
+    for uid in changed_ids:
+        invalidate_user_status(uid)
     return {"updated_count": updated_count, "status": body.status, "user_ids": body.user_ids}
 
 
@@ -369,6 +325,7 @@ async def create_user(
 
     await session.commit()
     await session.refresh(user)
+    await admin_scope.user_created(session, user.username)
     notification_service.notify_new_user(user.username)
     return await _build_response(session, user)
 
@@ -411,8 +368,8 @@ async def update_user(
     # Validate losing_rate: child <= parent
     if "losing_rate" in update_data and update_data["losing_rate"] is not None:
         new_lr = Decimal(str(update_data["losing_rate"]))
-        if new_lr > Decimal("50"):
-            raise HTTPException(status_code=400, detail="죽장율은 최대 50%입니다")
+        if new_lr > LOSING_MAX_RATE:
+            raise HTTPException(status_code=400, detail=f"죽장율은 최대 {LOSING_MAX_RATE}%입니다")
         if user.referrer_id:
             parent = await session.get(User, user.referrer_id)
             if parent and new_lr > parent.losing_rate:
@@ -427,6 +384,8 @@ async def update_user(
 
     session.add(user)
     await session.commit()
+    if "status" in update_data:
+        invalidate_user_status(user_id)
     await session.refresh(user)
     return await _build_response(session, user)
 
@@ -445,6 +404,7 @@ async def delete_user(
     user.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
     session.add(user)
     await session.commit()
+    invalidate_user_status(user_id)
 
 
 # ─── Detail (composite) ──────────────────────────────────────────
@@ -456,8 +416,10 @@ async def get_user_detail(
     current_user: AdminUser = Depends(PermissionChecker("users.view")),
 ):
     await _verify_user_access(session, current_user, user_id)
-    user = await _get_user_or_404(session, user_id)
-    user_resp = await _build_response(session, user)
+    detail = await load_user_detail(session, user_id)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user = detail.user
 
     stats = UserStatistics(
         total_deposit=user.total_deposit,
@@ -468,55 +430,13 @@ async def get_user_detail(
         deposit_withdrawal_diff=user.total_deposit - user.total_withdrawal,
     )
 
-    wallet_result = await session.execute(
-        select(UserWalletAddress).where(UserWalletAddress.user_id == user_id)
-    )
-    wallet_addresses = [
-        WalletAddressResponse(
-            id=w.id, coin_type=w.coin_type, network=w.network,
-            address=w.address, label=w.label,
-            is_primary=w.is_primary, status=w.status,
-        )
-        for w in wallet_result.scalars().all()
-    ]
-
-    bp_result = await session.execute(
-        select(UserBettingPermission).where(UserBettingPermission.user_id == user_id)
-    )
-    betting_perms = [
-        BettingPermissionResponse(id=bp.id, game_category=bp.game_category, is_allowed=bp.is_allowed)
-        for bp in bp_result.scalars().all()
-    ]
-
-    nbc_result = await session.execute(
-        select(UserNullBettingConfig).where(UserNullBettingConfig.user_id == user_id)
-    )
-    null_configs = [
-        NullBettingConfigResponse(
-            id=n.id, game_category=n.game_category,
-            every_n_bets=n.every_n_bets, inherit_to_children=n.inherit_to_children,
-        )
-        for n in nbc_result.scalars().all()
-    ]
-
-    grr_result = await session.execute(
-        select(UserGameRollingRate).where(UserGameRollingRate.user_id == user_id)
-    )
-    rolling_rates = [
-        GameRollingRateResponse(
-            id=r.id, game_category=r.game_category,
-            provider=r.provider, rolling_rate=r.rolling_rate,
-        )
-        for r in grr_result.scalars().all()
-    ]
-
     return UserDetailResponse(
-        user=user_resp,
+        user=_to_response(user, detail.referrer_username, detail.direct_referral_count),
         statistics=stats,
-        wallet_addresses=wallet_addresses,
-        betting_permissions=betting_perms,
-        null_betting_configs=null_configs,
-        game_rolling_rates=rolling_rates,
+        wallet_addresses=[WalletAddressResponse(**w) for w in detail.wallet_addresses],
+        betting_permissions=[BettingPermissionResponse(**bp) for bp in detail.betting_permissions],
+        null_betting_configs=[NullBettingConfigResponse(**n) for n in detail.null_betting_configs],
+        game_rolling_rates=[GameRollingRateResponse(**r) for r in detail.game_rolling_rates],
     )
 
 
@@ -745,17 +665,6 @@ async def update_null_betting(
 
 # ─── Game Rolling Rates ──────────────────────────────────────────
 
-ROLLING_MAX_RATES: dict[str, Decimal] = {
-    "casino": Decimal("1.5"),
-    "slot": Decimal("5"),
-    "holdem": Decimal("5"),
-    "sports": Decimal("5"),
-    "shooting": Decimal("5"),
-    "coin": Decimal("5"),
-    "mini_game": Decimal("3"),
-}
-
-
 @router.put("/{user_id}/rolling-rates", response_model=list[GameRollingRateResponse])
 async def update_rolling_rates(
     user_id: int,
@@ -811,6 +720,7 @@ async def update_rolling_rates(
             session.add(grr)
 
     await session.commit()
+    await invalidate_rates(user_id, {item.game_category for item in body})
 
     result = await session.execute(
         select(UserGameRollingRate).where(UserGameRollingRate.user_id == user_id)
@@ -872,6 +782,7 @@ async def suspend_user(
     user.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
     session.add(user)
     await session.commit()
+    invalidate_user_status(user_id)
     await session.refresh(user)
     return await _build_response(session, user)
 
@@ -891,6 +802,68 @@ async def get_user_tree(
     return UserTreeResponse(nodes=nodes)
 
 
+@router.get("/{user_id}/tree/children", response_model=UserTreeChildrenResponse)
+async def get_user_tree_children(
+    user_id: int,
+    cursor: int | None = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    session: AsyncSession = Depends(get_session),
+    current_user: AdminUser = Depends(PermissionChecker("users.view")),
+):
+    """Expand one tree node: a page of direct referrals with their subtree totals."""
+    await _verify_user_access(session, current_user, user_id)
+    await _get_user_or_404(session, user_id)
+    items, next_cursor = await get_children_page(session, user_id, cursor, limit)
+    return UserTreeChildrenResponse(items=items, next_cursor=next_cursor)
+
+
+# ─── Move (re-parent subtree) ─────────────────────────────────────
+
+@router.post("/{user_id}/move")
+async def move_user(
+    user_id: int,
+    body: UserMoveRequest,
+    session: AsyncSession = Depends(get_session),
+    current_user: AdminUser = Depends(PermissionChecker("users.update")),
+):
+    await _verify_user_access(session, current_user, user_id)
+    await _verify_user_access(session, current_user, body.new_referrer_id)
+    await _get_user_or_404(session, user_id)
+
+    try:
+        moved = await move_node(session, user_id, body.new_referrer_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await session.commit()
+
+    # Every moved user's ancestor chain changed
+    clear_ancestor_chains()
+    await user_tree_index.invalidate()
+
+    # The new upline gained referrals
+    await cascade_promotion_check(session, user_id)
+    await session.commit()
+
+    return {"detail": "User moved successfully", "moved": moved}
+
+
+@router.post("/tree/verify", response_model=TreeVerifyResponse)
+async def verify_user_tree(
+    body: TreeVerifyRequest,
+    current_user: AdminUser = Depends(PermissionChecker("users.update")),
+):
+    """Diff user_tree against users.referrer_id; apply=True also repairs it.
+
+    Reads the whole tree, so it is limited to super admins.
+    """
+    if current_user.role != "super_admin":
+        raise HTTPException(status_code=403, detail="Only super admins can verify the tree")
+    try:
+        return await verify_tree("user", apply=body.apply)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # ─── Referrals (direct children) ─────────────────────────────────
 
 @router.get("/{user_id}/referrals", response_model=UserListResponse)
@@ -20,6 +20,26 @@ class Settings(BaseSettings):
     TELEGRAM_CHAT_ID: str = ""
     WEBHOOK_SECRET: str = ""
 
+    # Commission webhook queue (Redis Streams). When enabled, the bet/round-result
+    # webhooks only verify and enqueue (202); a worker pool applies commissions.
+    COMMISSION_QUEUE_ENABLED: bool = False
+    COMMISSION_QUEUE_PARTITIONS: int = 8
+    COMMISSION_QUEUE_RUN_WORKERS: bool = True  # run the worker pool in this process
+    # How long processed (round_id, type) keys answer webhook retries from Redis
+    COMMISSION_DEDUP_TTL: int = 86400  # seconds
+
+    # commission_ledger monthly partitions and archive
+    COMMISSION_LEDGER_PARTITIONS_AHEAD: int = 3  # months created in advance
+    COMMISSION_LEDGER_MAINTENANCE_INTERVAL: int = 21600  # seconds between partition/archive runs
+    COMMISSION_ARCHIVE_AFTER_MONTHS: int = 12  # 0 disables archiving
+    COMMISSION_ARCHIVE_TABLESPACE: str = ""  # e.g. a tablespace on compressed storage
+
+    # In-process referral tree index (falls back to the user_tree closure table when cold)
+    USER_TREE_INDEX_ENABLED: bool = True
+
+    # Subtree aggregates (user_subtree_stats / agent_subtree_stats)
+    SUBTREE_STATS_RECONCILE_INTERVAL: int = 3600  # seconds between reconcile runs; 0 disables
+
     # DB connection pool
     DB_POOL_SIZE: int = 10
     DB_MAX_OVERFLOW: int = 20
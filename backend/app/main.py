@@ -50,6 +50,7 @@ from app.database import async_session, init_db
 from app.middleware.audit import AuditLogMiddleware
 from app.middleware.rate_limit import RateLimitMiddleware
 from app.middleware.security import SecurityHeadersMiddleware
+from app.services import commission_partitions, commission_queue, subtree_stats
 
 
 @asynccontextmanager
@@ -59,7 +60,17 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         import logging
         logging.warning(f"DB init skipped: {e}")
+
+    commission_partitions.start_maintenance()
+    subtree_stats.start_reconcile()
+    run_queue = settings.COMMISSION_QUEUE_ENABLED and settings.COMMISSION_QUEUE_RUN_WORKERS
+    if run_queue:
+        commission_queue.start_workers()
     yield
+    if run_queue:
+        await commission_queue.stop_workers()
+    await subtree_stats.stop_reconcile()
+    await commission_partitions.stop_maintenance()
 
 
 app = FastAPI(
@@ -9,7 +9,10 @@ from app.models.betting_limit import BettingLimit  # noqa: F401
 from app.models.commission import (  # noqa: F401
     AgentCommissionOverride,
     CommissionLedger,
+    CommissionLedgerArchive,
+    CommissionLedgerKey,
     CommissionPolicy,
+    CommissionRollup,
 )
 from app.models.fraud_alert import FraudAlert, FraudRule  # noqa: F401
 from app.models.game import Game, GameProvider, GameRound  # noqa: F401
@@ -29,6 +32,7 @@ from app.models.role import (  # noqa: F401
 )
 from app.models.setting import AgentSalaryConfig, Announcement, Setting  # noqa: F401
 from app.models.settlement import Settlement  # noqa: F401
+from app.models.subtree_stats import AgentSubtreeStats, UserSubtreeStats  # noqa: F401
 from app.models.transaction import Transaction  # noqa: F401
 from app.models.transaction_limit import TransactionLimit  # noqa: F401
 from app.models.user import User, UserTree  # noqa: F401
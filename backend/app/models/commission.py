@@ -1,8 +1,8 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from decimal import Decimal
 from uuid import UUID, uuid4
 
-from sqlalchemy import Column, UniqueConstraint
+from sqlalchemy import CheckConstraint, Column, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, SQLModel
 
@@ -47,15 +47,30 @@ class CommissionLedger(SQLModel, table=True):
 
     MLM model: user_id = bettor, recipient_user_id = who earns the commission (User).
     agent_id is kept nullable for legacy/admin-override scenarios.
+
+    Range-partitioned by ledger_month (first day of the UTC month of
+    created_at), one partition per month; see app.services.commission_partitions.
+    Every unique key includes ledger_month, as Postgres requires, so
+    uq_ledger_idempotency is only unique within a month: entries written by
+    the commission engine are made unique across months by CommissionLedgerKey.
     """
 
     __tablename__ = "commission_ledger"
     __table_args__ = (
-        UniqueConstraint("reference_id", "user_id", "type", "recipient_user_id", name="uq_ledger_idempotency"),
+        UniqueConstraint(
+            "reference_id", "user_id", "type", "recipient_user_id", "ledger_month",
+            name="uq_ledger_idempotency",
+        ),
+        UniqueConstraint("uuid", "ledger_month", name="commission_ledger_uuid_key"),
+        CheckConstraint(
+            "ledger_month = date_trunc('month', created_at)::date", name="ck_commission_ledger_month",
+        ),
+        Index("ix_commission_ledger_reference", "reference_id", "reference_type"),
+        {"postgresql_partition_by": "RANGE (ledger_month)"},
     )
 
-    id: int | None = Field(default=None, primary_key=True)
-    uuid: UUID = Field(default_factory=uuid4, unique=True)
+    id: int | None = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    uuid: UUID = Field(default_factory=uuid4)
 
     # Who earns the commission (User in MLM tree, including self-rolling)
     recipient_user_id: int = Field(foreign_key="users.id", index=True)
@@ -84,3 +99,56 @@ class CommissionLedger(SQLModel, table=True):
 
     description: str | None = Field(default=None)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
+    # Partition key; writers set it together with created_at
+    ledger_month: date = Field(primary_key=True)
+
+
+class CommissionLedgerKey(SQLModel, table=True):
+    """Idempotency key of a commission_ledger entry written by the engine.
+
+    Unpartitioned and never archived, so the key of a round stays unique
+    whichever month its entries landed in. The engine inserts the keys in the
+    same transaction as the entries and writes only the entries whose key it
+    inserted; a concurrent or later delivery of the same round finds them taken.
+    """
+
+    __tablename__ = "commission_ledger_keys"
+
+    reference_id: str = Field(max_length=100, primary_key=True)
+    user_id: int = Field(primary_key=True)
+    type: str = Field(max_length=20, primary_key=True)
+    recipient_user_id: int = Field(primary_key=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class CommissionLedgerArchive(SQLModel, table=True):
+    """A ledger month detached from commission_ledger into the archive schema."""
+
+    __tablename__ = "commission_ledger_archives"
+
+    month: date = Field(primary_key=True)
+    table_name: str = Field(max_length=100)  # schema-qualified
+    row_count: int = Field(default=0)
+    commission_total: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    archived_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class CommissionRollup(SQLModel, table=True):
+    """Daily commission totals per recipient, type and status.
+
+    Maintained in the same transaction as every ledger write (inserts, replay
+    corrections, status changes) by app.services.commission_rollup, so period
+    sums read O(days) rows instead of the raw ledger. day is the UTC date of
+    CommissionLedger.created_at.
+    """
+
+    __tablename__ = "commission_rollups"
+
+    recipient_user_id: int = Field(foreign_key="users.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    type: str = Field(max_length=20, primary_key=True)
+    status: str = Field(max_length=20, primary_key=True)
+
+    total_amount: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    source_total: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    entry_count: int = Field(default=0)
@@ -0,0 +1,44 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlmodel import Field, SQLModel
+
+
+class UserSubtreeStats(SQLModel, table=True):
+    """Totals over a user and their whole referral subtree.
+
+    Kept current by app.services.subtree_stats, which adds each transaction's
+    deltas to every ancestor-or-self row at commit, and re-derived from
+    users / commission_rollups by a periodic reconcile. Commission totals are
+    by recipient, so bet_total is the rolling source credited inside the
+    subtree, and bettor_count the users in it whose bets have earned
+    commission (users.first_commission_at set). day_* and month_* hold the UTC day / month named in day / month
+    and read as zero once those are past.
+    """
+
+    __tablename__ = "user_subtree_stats"
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    descendant_count: int = Field(default=0)
+    bettor_count: int = Field(default=0)
+    subtree_balance: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    bet_total: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    commission_total: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    day: date | None = Field(default=None)
+    day_bet_amount: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    day_commission: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    month: date | None = Field(default=None)
+    month_bet_amount: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    month_commission: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class AgentSubtreeStats(SQLModel, table=True):
+    """Descendant count and balance over an agent and its sub-agent subtree."""
+
+    __tablename__ = "agent_subtree_stats"
+
+    agent_id: int = Field(foreign_key="admin_users.id", primary_key=True)
+    descendant_count: int = Field(default=0)
+    subtree_balance: Decimal = Field(default=Decimal("0"), max_digits=18, decimal_places=2)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
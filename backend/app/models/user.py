@@ -53,6 +53,8 @@ class User(SQLModel, table=True):
     last_login_ip: str | None = Field(default=None, max_length=45)
     last_deposit_at: datetime | None = Field(default=None)
     last_bet_at: datetime | None = Field(default=None)
+    # First commission ledger row from this user's bets (user_subtree_stats.bettor_count)
+    first_commission_at: datetime | None = Field(default=None)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -76,6 +76,17 @@ class AgentTreeResponse(BaseModel):
     nodes: list[AgentTreeNode]
 
 
+class AgentTreeChild(AgentTreeNode):
+    descendant_count: int
+    subtree_balance: float
+    has_children: bool
+
+
+class AgentTreeChildrenResponse(BaseModel):
+    items: list[AgentTreeChild]
+    next_cursor: int | None = None
+
+
 class AgentAncestor(BaseModel):
     id: int
     username: str
@@ -23,6 +23,8 @@ class AuditLogResponse(BaseModel):
 
 class AuditLogListResponse(BaseModel):
     items: list[AuditLogResponse]
-    total: int
+    total: int | None
     page: int
     page_size: int
+    next_cursor: str | None = None
+    total_is_estimate: bool = False
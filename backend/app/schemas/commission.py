@@ -1,6 +1,6 @@
 """Commission system schemas: policies, overrides, ledger, webhooks."""
 
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 
 from pydantic import BaseModel, Field
@@ -116,10 +116,12 @@ class LedgerResponse(BaseModel):
 
 class LedgerListResponse(BaseModel):
     items: list[LedgerResponse]
-    total: int
+    total: int | None
     page: int
     page_size: int
-    total_commission: Decimal = Decimal("0")
+    next_cursor: str | None = None
+    total_is_estimate: bool = False
+    total_commission: Decimal | None = Decimal("0")
 
 
 class LedgerSummary(BaseModel):
@@ -128,6 +130,103 @@ class LedgerSummary(BaseModel):
     count: int
 
 
+class LedgerArchiveMonth(BaseModel):
+    month: date
+    table_name: str
+    row_count: int
+    commission_total: Decimal | None = None
+    archived_at: datetime | None = None
+
+    model_config = {"from_attributes": True}
+
+
+class LedgerArchiveRequest(BaseModel):
+    """Archive settled months older than this many months (default from settings)."""
+    older_than_months: int | None = Field(default=None, ge=1)
+
+
+# ─── Commission Replay ────────────────────────────────────────────
+
+class CommissionReplayRequest(BaseModel):
+    """Recompute commissions of past bets with the current rates and tree."""
+    date_from: datetime
+    date_to: datetime
+    commission_type: str | None = Field(default=None, pattern=r"^(rolling|losing)$")
+    game_category: str | None = Field(
+        default=None,
+        pattern=r"^(casino|slot|holdem|sports|shooting|coin|mini_game)$",
+    )
+    dry_run: bool = True
+    workers: int = Field(default=4, ge=1, le=16)
+    chunk_size: int = Field(default=2000, ge=100, le=5000)
+
+
+class CommissionReplayDiff(BaseModel):
+    round_id: str
+    user_id: int
+    type: str
+    recipient_user_id: int
+    expected: Decimal
+    recorded: Decimal
+    delta: Decimal
+
+
+class CommissionReplayRecipient(BaseModel):
+    recipient_user_id: int
+    delta: Decimal
+
+
+class CommissionReplayResponse(BaseModel):
+    dry_run: bool
+    bets_scanned: int
+    rounds_changed: int
+    entries_changed: int
+    total_delta: dict[str, Decimal]
+    corrections_written: int
+    locked: int
+    skipped_long_round_ids: int
+    recipient_deltas: list[CommissionReplayRecipient]
+    samples: list[CommissionReplayDiff]
+
+
+# ─── Rate Change Simulation ───────────────────────────────────────
+
+class SimulatedRateChange(BaseModel):
+    user_id: int
+    game_category: str = Field(pattern=r"^(casino|slot|holdem|sports|shooting|coin|mini_game)$")
+    rolling_rate: Decimal | None = Field(default=None, ge=0, le=100)
+    losing_rate: Decimal | None = Field(default=None, ge=0, le=100)
+
+
+class CommissionSimulateRequest(BaseModel):
+    """Proposed rate changes replayed over bets placed in [date_from, date_to)."""
+    changes: list[SimulatedRateChange] = Field(min_length=1, max_length=100)
+    date_from: datetime
+    date_to: datetime
+
+
+class SimulatedAmounts(BaseModel):
+    before: Decimal
+    after: Decimal
+
+
+class CommissionSimulateItem(BaseModel):
+    recipient_user_id: int
+    username: str | None = None
+    before: Decimal
+    after: Decimal
+    delta: Decimal
+    by_type: dict[str, SimulatedAmounts]
+
+
+class CommissionSimulateResponse(BaseModel):
+    bettors_scanned: int
+    total_before: Decimal
+    total_after: Decimal
+    total_delta: Decimal
+    items: list[CommissionSimulateItem]
+
+
 # ─── Agent Commission Rate (Hierarchical) ────────────────────────
 
 class AgentCommissionRateResponse(BaseModel):
@@ -166,6 +265,11 @@ class BetWebhook(BaseModel):
     bet_amount: Decimal = Field(gt=0)
 
 
+class BetBatchWebhook(BaseModel):
+    """Webhook carrying many bet events — processed in a single transaction."""
+    bets: list[BetWebhook] = Field(min_length=1, max_length=1000)
+
+
 class RoundResultWebhook(BaseModel):
     """Webhook for game round result — triggers losing commission on losses."""
     user_id: int
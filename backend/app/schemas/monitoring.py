@@ -39,3 +39,19 @@ class HealthCheckResponse(BaseModel):
     version: str
     service: str
     checks: dict[str, str]
+
+
+class CommissionQueuePartition(BaseModel):
+    partition: int
+    length: int
+    lag: int | None = None  # entries not yet delivered to a worker
+    pending: int = 0  # delivered, not yet acknowledged
+    oldest_age_seconds: float | None = None
+
+
+class CommissionQueueStatsResponse(BaseModel):
+    enabled: bool
+    total_lag: int = 0
+    total_pending: int = 0
+    max_age_seconds: float | None = None
+    partitions: list[CommissionQueuePartition] = []
@@ -13,6 +13,31 @@ class SettlementCreate(BaseModel):
     memo: str | None = None
 
 
+class BulkSettlementCreate(BaseModel):
+    """Settle every recipient with pending commission in the period."""
+    period_start: str = Field(description="YYYY-MM-DD")
+    period_end: str = Field(description="YYYY-MM-DD")
+    memo: str | None = None
+
+
+class BulkSettlementJob(BaseModel):
+    job_id: str
+    status: str  # running, completed, failed
+    period_start: datetime
+    period_end: datetime
+    memo: str | None = None
+    started_by: int
+    recipients_total: int | None = None
+    recipients_done: int
+    settlements_created: int
+    skipped_overlapping: int
+    gross_total: Decimal
+    last_recipient_id: int
+    started_at: datetime
+    finished_at: datetime | None = None
+    error: str | None = None
+
+
 class SettlementResponse(BaseModel):
     id: int
     uuid: str
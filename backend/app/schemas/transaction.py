@@ -63,10 +63,12 @@ class TransactionResponse(BaseModel):
 
 class TransactionListResponse(BaseModel):
     items: list[TransactionResponse]
-    total: int
+    total: int | None
     page: int
     page_size: int
-    total_amount: Decimal = Decimal("0")
+    next_cursor: str | None = None
+    total_is_estimate: bool = False
+    total_amount: Decimal | None = Decimal("0")
 
 
 class TransactionSummary(BaseModel):
@@ -71,9 +71,11 @@ class UserResponse(BaseModel):
 
 class UserListResponse(BaseModel):
     items: list[UserResponse]
-    total: int
+    total: int | None
     page: int
     page_size: int
+    next_cursor: str | None = None
+    total_is_estimate: bool = False
 
 
 class UserTreeNode(BaseModel):
@@ -91,6 +93,17 @@ class UserTreeResponse(BaseModel):
     nodes: list[UserTreeNode]
 
 
+class UserTreeChild(UserTreeNode):
+    descendant_count: int
+    subtree_balance: float
+    has_children: bool
+
+
+class UserTreeChildrenResponse(BaseModel):
+    items: list[UserTreeChild]
+    next_cursor: int | None = None
+
+
 # ─── User Detail (composite) ─────────────────────────────────────
 
 class UserStatistics(BaseModel):
@@ -189,6 +202,41 @@ class UserSummaryStats(BaseModel):
     total_points: float
 
 
+class UserMoveRequest(BaseModel):
+    new_referrer_id: int
+
+
+# ─── Closure Verify (shared with agents) ─────────────────────────
+
+class TreeVerifyRequest(BaseModel):
+    """Diff the closure table against the parent pointers; apply=True also fixes it."""
+    apply: bool = False
+
+
+class TreeVerifyDiff(BaseModel):
+    kind: str  # missing, extra, wrong_depth
+    ancestor_id: int
+    descendant_id: int
+    expected_depth: int | None = None
+    recorded_depth: int | None = None
+
+
+class TreeVerifyResponse(BaseModel):
+    tree: str
+    applied: bool
+    nodes: int
+    closure_rows: int
+    expected_rows: int
+    missing: int
+    extra: int
+    wrong_depth: int
+    node_depth_mismatches: int
+    rows_written: int
+    unplaced_nodes: list[int]
+    samples: list[TreeVerifyDiff]
+    timings: dict[str, float]
+
+
 class BulkStatusUpdate(BaseModel):
     user_ids: list[int] = Field(min_length=1, max_length=100)
     status: str = Field(pattern=r"^(active|suspended|banned)$")
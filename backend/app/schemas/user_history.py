@@ -26,10 +26,12 @@ class BetRecordResponse(BaseModel):
 
 class BetRecordListResponse(BaseModel):
     items: list[BetRecordResponse]
-    total: int
+    total: int | None
     page: int
     page_size: int
-    summary: BetSummary
+    next_cursor: str | None = None
+    total_is_estimate: bool = False
+    summary: BetSummary | None
 
 
 class MoneySummary(BaseModel):
@@ -54,6 +56,7 @@ class MoneyLogListResponse(BaseModel):
     total: int
     page: int
     page_size: int
+    total_is_estimate: bool = False
     summary: MoneySummary
 
 
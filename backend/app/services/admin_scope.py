@@ -0,0 +1,97 @@
+"""Cached admin access scopes for user-scoped endpoints.
+
+A non-super admin may open a user when the user or one of their referral
+ancestors shares a username with an agent in the admin's subtree (an agent
+and the member account they play under have the same username). The scope is
+kept as the ids of those member accounts, the admin's "roots":
+
+- loaded with one query and cached per admin in each worker
+- a check is then an ancestor-membership test of the target against the
+  roots, answered from the tree index when it is warm and otherwise from
+  the target's closure rows (one query)
+
+Roots only change with the agent tree (create, move) or when a member gets
+an agent's username. Those paths call invalidate(), which drops the local
+copies and bumps a Redis version (a cache_service.VersionWatch) so other
+workers drop theirs within VERSION_CHECK_INTERVAL. A TTL is the backstop
+for writes that skip it.
+"""
+
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.admin_user import AdminUser, AdminUserTree
+from app.models.user import User, UserTree
+from app.services.cache_service import VersionWatch
+from app.services.user_tree_index import get_index
+
+_SCOPE_TTL = 300.0  # seconds
+_SCOPE_MAX_ENTRIES = 10_000
+
+# admin id -> (root user ids, loaded_at)
+_scopes: dict[int, tuple[frozenset[int], float]] = {}
+_watch = VersionWatch("admin_scope:version")
+# Bumped on every clear so a load that raced with an invalidation is not stored
+_generation = 0
+
+
+def _clear() -> None:
+    global _generation
+    _scopes.clear()
+    _generation += 1
+
+
+async def get_scope(session: AsyncSession, admin_id: int) -> frozenset[int]:
+    """Ids of the member accounts of the agents in admin_id's subtree (self included)."""
+    if await _watch.changed():
+        _clear()
+    now = time.monotonic()
+    cached = _scopes.get(admin_id)
+    if cached is not None and now - cached[1] < _SCOPE_TTL:
+        return cached[0]
+
+    generation = _generation
+    agent_usernames = (
+        select(AdminUser.username)
+        .join(AdminUserTree, AdminUserTree.descendant_id == AdminUser.id)
+        .where(AdminUserTree.ancestor_id == admin_id)
+    )
+    roots = frozenset((await session.execute(
+        select(User.id).where(User.username.in_(agent_usernames))
+    )).scalars().all())
+    if generation == _generation:
+        if len(_scopes) >= _SCOPE_MAX_ENTRIES:
+            _scopes.clear()
+        _scopes[admin_id] = (roots, now)
+    return roots
+
+
+async def can_access(session: AsyncSession, admin_id: int, user_id: int) -> bool:
+    """True if user_id is one of the admin's roots or below one."""
+    roots = await get_scope(session, admin_id)
+    if not roots:
+        return False
+    if user_id in roots:
+        return True
+    index = await get_index()
+    if index is not None and user_id in index:
+        return any(ancestor_id in roots for ancestor_id, _ in index.ancestors(user_id))
+    ancestor_ids = (await session.execute(
+        select(UserTree.ancestor_id).where(UserTree.descendant_id == user_id, UserTree.depth > 0)
+    )).scalars().all()
+    return any(ancestor_id in roots for ancestor_id in ancestor_ids)
+
+
+async def invalidate() -> None:
+    """Drop every admin's scope, here and (via Redis) in other workers."""
+    _clear()
+    await _watch.bump()
+
+
+async def user_created(session: AsyncSession, username: str) -> None:
+    """Call after committing a new member; an agent's username makes it a root."""
+    agent = await session.execute(select(AdminUser.id).where(AdminUser.username == username))
+    if agent.first() is not None:
+        await invalidate()
@@ -1,12 +1,22 @@
-"""Redis caching service for dashboard and frequently accessed data."""
+"""Redis caching service for dashboard and frequently accessed data, and the
+shared version counters that invalidate in-process caches across workers.
+"""
 
 import json
+import logging
+import time
 from typing import Any
 
 import redis.asyncio as redis
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+VERSION_CHECK_INTERVAL = 2.0  # seconds — max staleness across workers
+_VERSION_LOG_TTL = 3600  # seconds a published change stays readable
+_VERSION_LOG_MAX_GAP = 1000  # more versions behind than this → drop everything
+
 _redis: redis.Redis | None = None
 
 
@@ -52,3 +62,77 @@ async def blacklist_token(jti: str, ttl: int) -> None:
 async def is_token_blacklisted(jti: str) -> bool:
     r = await get_redis()
     return await r.exists(f"token_blacklist:{jti}") > 0
+
+
+# ─── Version counters ─────────────────────────────────────────────
+
+class VersionWatch:
+    """A shared version counter in Redis, polled at most every VERSION_CHECK_INTERVAL.
+
+    Writers may attach a change description to a bump; it is kept in a hash
+    next to the counter (field = version) so readers can apply it selectively.
+    """
+
+    __slots__ = ("checked_at", "key", "log_key", "version")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.log_key = f"{key}:log"
+        self.version: int | None = None
+        self.checked_at = 0.0
+
+    async def poll(self) -> list[str] | None:
+        """Changes published since the last poll.
+
+        [] if nothing moved; None if the local copy must be dropped entirely
+        (first poll, unreadable version, or a change without a description).
+        """
+        now = time.monotonic()
+        if now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return []
+        self.checked_at = now
+
+        try:
+            r = await get_redis()
+            version = int(await r.get(self.key) or 0)
+            if version == self.version:
+                return []
+            changes = None
+            if self.version is not None and 0 < version - self.version <= _VERSION_LOG_MAX_GAP:
+                raw = await r.hmget(self.log_key, [str(v) for v in range(self.version + 1, version + 1)])
+                if all(raw):
+                    changes = [c.decode() if isinstance(c, bytes) else c for c in raw]
+        except Exception as e:
+            # Without the shared version we cannot trust entries older than one interval
+            logger.warning("Cache version check failed for %s: %s", self.key, e)
+            self.version = None
+            return None
+
+        self.version = version
+        return changes
+
+    async def changed(self) -> bool:
+        """True if the local copy must be dropped (version moved or unreadable)."""
+        return await self.poll() != []
+
+    async def bump(self, change: str | None = None) -> None:
+        """Publish a change (applied locally by the caller).
+
+        The local version stays at the last one polled, so the next poll
+        replays every change published since, concurrent ones and this one
+        included: readers must apply changes idempotently. A change without
+        a description makes that poll drop everything.
+        """
+        try:
+            r = await get_redis()
+            version = await r.incr(self.key)
+            if change is not None:
+                await r.hset(self.log_key, str(version), change)
+                await r.expire(self.log_key, _VERSION_LOG_TTL)
+                if self.version == version - 1:
+                    # Nobody else moved the counter: our own change is already applied
+                    self.version = version
+        except Exception as e:
+            # Unknown whether (and as which version) the change went out
+            self.version = None
+            logger.warning("Cache version bump failed for %s: %s", self.key, e)
@@ -0,0 +1,160 @@
+"""Closure-table operations shared by the agent and user trees.
+
+Subtree moves
+-------------
+A move is four statements no matter how large the subtree is:
+
+1. lock the subtree rows and the new parent, in ascending id order
+2. DELETE the links from outside ancestors into the subtree
+3. INSERT ... SELECT the new links (new parent's ancestors x subtree)
+4. one UPDATE for depth (and the moved node's parent column)
+
+Every move takes its row locks in the same global id order, so two
+concurrent moves that share rows queue on each other instead of
+deadlocking. The cycle check is repeated under those locks, which makes it
+safe against a concurrent move made between the caller's check and ours.
+
+Lazy expansion
+--------------
+Tree screens open one level at a time: a keyset page of direct children
+(parent column, id) plus subtree totals for just that page.
+"""
+
+from decimal import Decimal
+
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+async def move_subtree(
+    session: AsyncSession,
+    *,
+    tree,
+    nodes,
+    parent_column,
+    node_id: int,
+    new_parent_id: int,
+    shift_totals=None,
+    check=None,
+) -> int:
+    """Re-parent node_id (with its subtree) under new_parent_id; returns the subtree size.
+
+    tree is the closure model (ancestor_id, descendant_id, depth), nodes the
+    node model with id and depth, parent_column the node's parent attribute.
+    shift_totals(session, node_id, sign), if given, moves the node's subtree
+    aggregates off its old ancestors (-1) and onto the new ones (+1).
+    check(session), if given, runs once the nodes are locked and before
+    anything changes; it raises ValueError to refuse the move.
+    Raises ValueError if either node is missing or the move would create a cycle.
+    The caller commits.
+    """
+    if node_id == new_parent_id:
+        raise ValueError("Cannot move a node under itself")
+
+    subtree = select(tree.descendant_id).where(tree.ancestor_id == node_id)
+    locked = (await session.execute(
+        select(nodes.id, nodes.depth)
+        .where((nodes.id.in_(subtree)) | (nodes.id == new_parent_id))
+        .order_by(nodes.id)
+        .with_for_update()
+    )).all()
+    depths = dict(locked)
+    if node_id not in depths:
+        raise ValueError("Node not found")
+    if new_parent_id not in depths:
+        raise ValueError("New parent not found")
+
+    in_subtree = (await session.execute(
+        select(tree.descendant_id).where(
+            tree.ancestor_id == node_id, tree.descendant_id == new_parent_id,
+        )
+    )).first()
+    if in_subtree:
+        raise ValueError("Cannot move: would create circular reference")
+    if check is not None:
+        await check(session)
+
+    if shift_totals is not None:
+        await shift_totals(session, node_id, -1)
+
+    # Links from ancestors outside the subtree to nodes inside it
+    await session.execute(
+        delete(tree)
+        .where(tree.descendant_id.in_(subtree), tree.ancestor_id.notin_(subtree))
+        .execution_options(synchronize_session=False)
+    )
+
+    # New parent's ancestors (itself included) x subtree nodes
+    anc = aliased(tree, name="anc")
+    sub = aliased(tree, name="sub")
+    await session.execute(
+        insert(tree).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(anc.ancestor_id, sub.descendant_id, anc.depth + sub.depth + literal(1))
+            .where(anc.descendant_id == new_parent_id, sub.ancestor_id == node_id),
+        )
+    )
+    if shift_totals is not None:
+        await shift_totals(session, node_id, 1)
+
+    depth_delta = depths[new_parent_id] + 1 - depths[node_id]
+    await session.execute(
+        update(nodes)
+        .where(nodes.id.in_(subtree))
+        .values({
+            nodes.depth: nodes.depth + depth_delta,
+            parent_column: case((nodes.id == node_id, new_parent_id), else_=parent_column),
+        })
+        .execution_options(synchronize_session=False)
+    )
+
+    # Bring already-loaded rows in line without a per-row reload
+    for obj in list(session.sync_session.identity_map.values()):
+        if isinstance(obj, nodes) and obj.id in depths and obj.id != new_parent_id:
+            set_committed_value(obj, "depth", depths[obj.id] + depth_delta)
+            if obj.id == node_id:
+                set_committed_value(obj, parent_column.key, new_parent_id)
+    return len(depths) - 1
+
+
+async def children_page(
+    session: AsyncSession,
+    *,
+    nodes,
+    parent_column,
+    node_id: int,
+    cursor: int | None,
+    limit: int,
+) -> tuple[list, int | None]:
+    """Direct children ordered by id after cursor; returns (rows, next cursor or None)."""
+    stmt = select(nodes).where(parent_column == node_id)
+    if cursor is not None:
+        stmt = stmt.where(nodes.id > cursor)
+    rows = (await session.execute(stmt.order_by(nodes.id).limit(limit + 1))).scalars().all()
+    if len(rows) > limit:
+        return list(rows[:limit]), rows[limit - 1].id
+    return list(rows), None
+
+
+async def subtree_totals(
+    session: AsyncSession,
+    *,
+    tree,
+    nodes,
+    node_ids: list[int],
+) -> dict[int, tuple[int, Decimal]]:
+    """(descendant count, balance of node plus descendants) per node, in one grouped query."""
+    if not node_ids:
+        return {}
+    stmt = (
+        select(tree.ancestor_id, func.count(), func.coalesce(func.sum(nodes.balance), 0))
+        .join(nodes, nodes.id == tree.descendant_id)
+        .where(tree.ancestor_id.in_(node_ids))
+        .group_by(tree.ancestor_id)
+    )
+    return {
+        node_id: (count - 1, Decimal(total))
+        for node_id, count, total in (await session.execute(stmt)).all()
+    }
@@ -0,0 +1,320 @@
+"""Verify (and repair) a closure table against its parent pointers.
+
+user_tree / admin_user_tree are derived data: every row must follow from
+users.referrer_id / admin_users.parent_id. This rebuilds the expected
+closure in memory and merges it against the table in primary-key order:
+
+- the nodes are loaded once as id / parent / depth arrays sorted by id,
+  about 50 bytes per node whatever the closure size
+- children are laid out CSR-style (offsets + one child array), so the
+  expected rows of one ancestor are its subtree, walked on demand
+- the table is read through a server-side cursor ordered by
+  (ancestor_id, descendant_id), the primary key, and merged against the
+  expected rows of each ancestor sorted by descendant id
+
+Differences are counted, sampled and, in apply mode, fixed in batches with
+bulk DELETE / INSERT through unnest() arrays, so neither side is ever held
+in full. Nodes on a parent cycle cannot be placed; they are reported and
+apply refuses to run until the pointers are fixed.
+
+Verify runs in a REPEATABLE READ snapshot. Apply also takes an EXCLUSIVE
+lock on the closure table first: inserts and moves wait, plain reads go on.
+"""
+
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterator
+
+from sqlalchemy import BindParameter, Integer, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import async_session
+from app.models.admin_user import AdminUser, AdminUserTree
+from app.models.user import User, UserTree
+from app.services import admin_scope, subtree_stats, user_tree_index
+from app.services.commission_cache import clear_ancestor_chains
+
+logger = logging.getLogger(__name__)
+
+TREES = {
+    "user": (UserTree, User, User.referrer_id),
+    "agent": (AdminUserTree, AdminUser, AdminUser.parent_id),
+}
+
+_NONE = -1
+_BATCH = 10_000  # rows per cursor fetch and per repair statement
+_SAMPLES = 20
+_SCAN_FACTOR = 32  # subtrees above n / this are collected by a marker scan, not a sort
+
+
+class _Forest:
+    """Parent-pointer forest over positions 0..n-1 in ascending id order."""
+
+    __slots__ = ("child", "depth", "ids", "start", "stored_depth")
+
+    def __init__(self, ids: array, parents: array, stored_depth: array):
+        n = len(ids)
+        self.ids = ids
+        self.stored_depth = stored_depth
+
+        # Parent ids -> positions; unknown parents make roots, a self-parent stays a cycle
+        parent = array("q", [_NONE]) * n
+        for i in range(n):
+            p = parents[i]
+            if p != _NONE:
+                j = bisect_left(ids, p)
+                if j < n and ids[j] == p:
+                    parent[i] = j
+
+        start = array("q", [0]) * (n + 1)
+        for i in range(n):
+            if parent[i] != _NONE:
+                start[parent[i] + 1] += 1
+        for i in range(n):
+            start[i + 1] += start[i]
+        child = array("q", [0]) * n
+        fill = array("q", start[:n])
+        for i in range(n):
+            p = parent[i]
+            if p != _NONE:
+                child[fill[p]] = i
+                fill[p] += 1
+        self.start, self.child = start, child
+
+        # Depth from the roots down; whatever stays -1 hangs off a cycle
+        depth = array("l", [-1]) * n
+        for root in range(n):
+            if parent[root] != _NONE:
+                continue
+            depth[root] = 0
+            stack = [root]
+            while stack:
+                s = stack.pop()
+                for k in range(start[s], start[s + 1]):
+                    c = child[k]
+                    depth[c] = depth[s] + 1
+                    stack.append(c)
+        self.depth = depth
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def unplaced(self) -> list[int]:
+        """Ids of nodes on, or below, a parent cycle."""
+        return [self.ids[i] for i in range(len(self.ids)) if self.depth[i] < 0]
+
+    def expected(self) -> Iterator[tuple[int, int, int]]:
+        """(ancestor_id, descendant_id, depth) in primary-key order."""
+        n, ids, depth, start, child = len(self.ids), self.ids, self.depth, self.start, self.child
+        marked = bytearray(n)
+        for a in range(n):
+            if depth[a] < 0:
+                continue
+            subtree = array("q", [a])
+            k = 0
+            while k < len(subtree):
+                s = subtree[k]
+                subtree.extend(child[start[s]:start[s + 1]])
+                k += 1
+            if len(subtree) * _SCAN_FACTOR > n:
+                for s in subtree:
+                    marked[s] = 1
+                lo, hi = min(subtree), max(subtree)
+                positions = (s for s in range(lo, hi + 1) if marked[s])
+            else:
+                positions = sorted(subtree)
+            base = depth[a]
+            for s in positions:
+                marked[s] = 0
+                yield ids[a], ids[s], depth[s] - base
+
+
+async def _load(session: AsyncSession, nodes, parent_column) -> _Forest:
+    ids, parents, depths = array("q"), array("q"), array("l")
+    result = await session.stream(
+        select(nodes.id, parent_column, nodes.depth)
+        .order_by(nodes.id)
+        .execution_options(yield_per=_BATCH)
+    )
+    async for partition in result.partitions():
+        for node_id, parent_id, depth in partition:
+            ids.append(node_id)
+            parents.append(_NONE if parent_id is None else parent_id)
+            depths.append(depth)
+    return _Forest(ids, parents, depths)
+
+
+class _Repair:
+    """Buffered fixes, flushed as one DELETE and one INSERT per batch."""
+
+    __slots__ = ("deletes", "inserts", "session", "table", "written")
+
+    def __init__(self, session: AsyncSession, table: str):
+        self.session, self.table = session, table
+        self.deletes: list[tuple[int, int]] = []
+        self.inserts: list[tuple[int, int, int]] = []
+        self.written = 0
+
+    async def add(self, delete: tuple | None = None, insert: tuple | None = None) -> None:
+        if delete:
+            self.deletes.append(delete)
+        if insert:
+            self.inserts.append(insert)
+        if len(self.deletes) + len(self.inserts) >= _BATCH:
+            await self.flush()
+
+    async def flush(self) -> None:
+        # Deletes first: a wrong-depth row is deleted and re-inserted in the same batch
+        if self.deletes:
+            a, d = zip(*self.deletes, strict=True)
+            await self.session.execute(text(
+                f"DELETE FROM {self.table} t USING unnest(:a, :d) AS x(a, d) "
+                "WHERE t.ancestor_id = x.a AND t.descendant_id = x.d"
+            ).bindparams(_ids("a", a), _ids("d", d)))
+        if self.inserts:
+            a, d, depth = zip(*self.inserts, strict=True)
+            await self.session.execute(text(
+                f"INSERT INTO {self.table} (ancestor_id, descendant_id, depth) "
+                "SELECT * FROM unnest(:a, :d, :depth)"
+            ).bindparams(_ids("a", a), _ids("d", d),
+                         bindparam("depth", list(depth), type_=ARRAY(Integer))))
+        self.written += len(self.deletes) + len(self.inserts)
+        self.deletes, self.inserts = [], []
+
+
+def _ids(name: str, values) -> BindParameter:
+    return bindparam(name, list(values), type_=ARRAY(Integer))
+
+
+def _sample(report: dict, kind: str, ancestor_id: int, descendant_id: int,
+            expected: int | None, recorded: int | None) -> None:
+    report[kind] += 1
+    if len(report["samples"]) < _SAMPLES:
+        report["samples"].append({
+            "kind": kind, "ancestor_id": ancestor_id, "descendant_id": descendant_id,
+            "expected_depth": expected, "recorded_depth": recorded,
+        })
+
+
+async def verify_tree(kind: str, *, apply: bool = False) -> dict:
+    """Diff the "user" or "agent" closure table against the parent pointers.
+
+    With apply=True the differences (and drifted node depths) are fixed in
+    the same transaction. Raises ValueError for an unknown tree, or when
+    applying while parent pointers form a cycle.
+    """
+    if kind not in TREES:
+        raise ValueError(f"Unknown tree {kind!r}; expected one of {', '.join(TREES)}")
+    tree, nodes, parent_column = TREES[kind]
+    table = tree.__tablename__
+    report = {
+        "tree": kind, "applied": False, "nodes": 0, "closure_rows": 0, "expected_rows": 0,
+        "missing": 0, "extra": 0, "wrong_depth": 0, "node_depth_mismatches": 0, "rows_written": 0,
+        "unplaced_nodes": [], "samples": [], "timings": {},
+    }
+    timings = report["timings"]
+    started = mark = time.perf_counter()
+
+    def phase(name: str) -> None:
+        nonlocal mark
+        now = time.perf_counter()
+        timings[name] = round(now - mark, 3)
+        mark = now
+
+    async with async_session() as session:
+        await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        if apply:
+            # Before the first query, so the snapshot already includes the lock
+            await session.execute(text(f"LOCK TABLE {table} IN EXCLUSIVE MODE"))
+        forest = await _load(session, nodes, parent_column)
+        report["nodes"] = len(forest)
+        unplaced = forest.unplaced()
+        report["unplaced_nodes"] = unplaced[:_SAMPLES]
+        phase("load")
+        if apply and unplaced:
+            raise ValueError(
+                f"{len(unplaced)} {kind} nodes are on or below a parent cycle (e.g. id {unplaced[0]}); "
+                "fix their parent pointers first"
+            )
+
+        repair = _Repair(session, table) if apply else None
+        expected = forest.expected()
+        want = next(expected, None)
+        result = await session.stream(
+            select(tree.ancestor_id, tree.descendant_id, tree.depth)
+            .order_by(tree.ancestor_id, tree.descendant_id)
+            .execution_options(yield_per=_BATCH)
+        )
+        async for partition in result.partitions():
+            for ancestor_id, descendant_id, depth in partition:
+                report["closure_rows"] += 1
+                key = (ancestor_id, descendant_id)
+                while want is not None and want[:2] < key:
+                    report["expected_rows"] += 1
+                    _sample(report, "missing", *want, None)
+                    if repair:
+                        await repair.add(insert=want)
+                    want = next(expected, None)
+                if want is not None and want[:2] == key:
+                    report["expected_rows"] += 1
+                    if want[2] != depth:
+                        _sample(report, "wrong_depth", *want, depth)
+                        if repair:
+                            await repair.add(delete=key, insert=want)
+                    want = next(expected, None)
+                else:
+                    _sample(report, "extra", ancestor_id, descendant_id, None, depth)
+                    if repair:
+                        await repair.add(delete=key)
+        while want is not None:
+            report["expected_rows"] += 1
+            _sample(report, "missing", *want, None)
+            if repair:
+                await repair.add(insert=want)
+            want = next(expected, None)
+        if repair:
+            await repair.flush()
+            report["rows_written"] = repair.written
+        phase("diff")
+
+        drifted = [
+            (forest.ids[i], forest.depth[i]) for i in range(len(forest))
+            if forest.depth[i] >= 0 and forest.depth[i] != forest.stored_depth[i]
+        ]
+        report["node_depth_mismatches"] = len(drifted)
+        if apply:
+            for i in range(0, len(drifted), _BATCH):
+                node_ids, depths = zip(*drifted[i:i + _BATCH], strict=True)
+                await session.execute(text(
+                    f"UPDATE {nodes.__tablename__} n SET depth = x.depth "
+                    "FROM unnest(:ids, :depths) AS x(id, depth) WHERE n.id = x.id"
+                ).bindparams(_ids("ids", node_ids),
+                             bindparam("depths", list(depths), type_=ARRAY(Integer))))
+            await session.commit()
+            report["applied"] = True
+        phase("node_depths")
+
+    changed = report["missing"] + report["extra"] + report["wrong_depth"]
+    if apply and changed:
+        if kind == "user":
+            clear_ancestor_chains()
+            await user_tree_index.invalidate()
+        else:
+            await admin_scope.invalidate()
+        # Subtree totals were summed over the old rows
+        await subtree_stats.reconcile()
+        phase("reconcile")
+
+    timings["total"] = round(time.perf_counter() - started, 3)
+    level = logging.WARNING if changed or report["node_depth_mismatches"] or unplaced else logging.INFO
+    logger.log(
+        level, "Closure check %s%s: %d nodes, %d rows, %d missing, %d extra, %d wrong depth, "
+        "%d node depths, %d unplaced in %.1fs",
+        table, " (applied)" if apply else "", report["nodes"], report["closure_rows"],
+        report["missing"], report["extra"], report["wrong_depth"],
+        report["node_depth_mismatches"], len(unplaced), timings["total"],
+    )
+    return report
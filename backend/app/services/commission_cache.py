@@ -0,0 +1,461 @@
+"""In-process caches for the commission hot path.
+
+The webhook path reads the same referral data and rates on every bet while
+they only change a few times a day. Each app worker keeps its own copy:
+
+- Ancestor chains: invalidated by the write paths. Tree moves and repairs
+  publish a "reset" on the tree index's version counter, which every worker
+  polls here too, so no worker keeps crediting an old upline for long; a
+  60s TTL is the backstop.
+- Rates and commission policies: invalidated through version counters in
+  Redis that writers bump; every worker re-reads them at most every few
+  seconds, so stale entries are dropped within a bounded delay. A rate bump
+  also records which (user, category) changed, so other workers drop only
+  the affected entries instead of everything.
+- Processed rounds: (round_id, type) keys in Redis with a TTL, so provider
+  retries are answered without touching Postgres. The ledger's unique
+  constraint stays the authority; a Redis miss only means a DB check.
+- Waterfall vectors: the resolved (level, recipient, effective_rate) shares
+  per (bettor, category, type), built from the two caches above and dropped
+  together with the chain, rate or status they were derived from.
+"""
+
+import logging
+import time
+from array import array
+from decimal import Decimal
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.commission import CommissionPolicy
+from app.models.user import User, UserTree
+from app.models.user_game_rolling_rate import UserGameRollingRate
+from app.services.cache_service import VersionWatch, get_redis
+from app.services.user_tree_index import TREE_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+
+_CHAIN_TTL = 60.0  # seconds
+_CHAIN_MAX_ENTRIES = 200_000
+
+_RATES_MAX_ENTRIES = 500_000
+_WATERFALL_MAX_ENTRIES = 500_000
+
+
+class AncestorChain:
+    """Ancestors of one user, nearest first, as compact parallel arrays."""
+
+    __slots__ = ("ancestor_ids", "loaded_at", "statuses")
+
+    def __init__(self, ancestor_ids: array, statuses: tuple[str, ...], loaded_at: float):
+        self.ancestor_ids = ancestor_ids
+        self.statuses = statuses
+        self.loaded_at = loaded_at
+
+    def active_ids(self) -> list[int]:
+        """Ancestor ids with status 'active' (the commission waterfall chain)."""
+        return [aid for aid, st in zip(self.ancestor_ids, self.statuses, strict=True) if st == "active"]
+
+
+_chains: dict[int, AncestorChain] = {}
+_tree_watch = VersionWatch(TREE_VERSION_KEY)
+
+
+def _fresh(chain: AncestorChain | None, now: float) -> bool:
+    return chain is not None and now - chain.loaded_at < _CHAIN_TTL
+
+
+async def get_ancestor_chains(
+    session: AsyncSession,
+    user_ids: list[int],
+) -> dict[int, AncestorChain]:
+    """Return ancestor chains for many users, loading misses in one query."""
+    await _sync_tree()
+    now = time.monotonic()
+    found: dict[int, AncestorChain] = {}
+    missing: list[int] = []
+    for uid in user_ids:
+        chain = _chains.get(uid)
+        if _fresh(chain, now):
+            found[uid] = chain
+        else:
+            missing.append(uid)
+
+    if missing:
+        stmt = (
+            select(UserTree.descendant_id, UserTree.ancestor_id, User.status)
+            .join(User, User.id == UserTree.ancestor_id)
+            .where(UserTree.descendant_id.in_(missing), UserTree.depth > 0)
+            .order_by(UserTree.descendant_id, UserTree.depth)
+        )
+        rows: dict[int, tuple[list[int], list[str]]] = {uid: ([], []) for uid in missing}
+        for descendant_id, ancestor_id, status in (await session.execute(stmt)).all():
+            ids, statuses = rows[descendant_id]
+            ids.append(ancestor_id)
+            statuses.append(status)
+
+        if len(_chains) + len(missing) > _CHAIN_MAX_ENTRIES:
+            _chains.clear()
+            _clear_waterfalls()
+        for uid, (ids, statuses) in rows.items():
+            chain = AncestorChain(array("q", ids), tuple(statuses), now)
+            _chains[uid] = chain
+            found[uid] = chain
+
+    return found
+
+
+async def get_ancestor_chain(session: AsyncSession, user_id: int) -> AncestorChain:
+    """Return the cached ancestor chain of a single user."""
+    return (await get_ancestor_chains(session, [user_id]))[user_id]
+
+
+def invalidate_ancestor_chain(user_id: int) -> None:
+    """Drop the cached chain of one user (called from user_tree_service.insert_node)."""
+    _chains.pop(user_id, None)
+    _drop_waterfalls(lambda bettor_id, chain: bettor_id == user_id)
+
+
+def invalidate_user_status(user_id: int) -> None:
+    """Drop every cached chain that embeds this user's status."""
+    _chains.pop(user_id, None)
+    stale = [uid for uid, chain in _chains.items() if user_id in chain.ancestor_ids]
+    for uid in stale:
+        del _chains[uid]
+    _drop_waterfalls(lambda bettor_id, chain: bettor_id == user_id or user_id in chain.ancestor_ids)
+
+
+def clear_ancestor_chains() -> None:
+    _chains.clear()
+    _clear_waterfalls()
+
+
+async def _sync_tree() -> None:
+    """Drop every chain when another worker moved or repaired the tree.
+
+    Inserts ("add" entries) only create new chains and are ignored; a
+    "reset", or a lost log, clears everything.
+    """
+    changes = await _tree_watch.poll()
+    if changes is None or any(not change.startswith("add:") for change in changes):
+        clear_ancestor_chains()
+
+
+# ─── Rates ────────────────────────────────────────────────────────
+
+_ZERO = Decimal("0")
+
+# (user_id, game_category) -> (rolling_rate, losing_rate); missing rows cache as zeros
+_rates: dict[tuple[int, str], tuple[Decimal, Decimal]] = {}
+_rates_watch = VersionWatch("commission:rates:version")
+# Bumped on every clear so a load that raced with an invalidation is not stored
+_rates_generation = 0
+
+
+def _clear_rates() -> None:
+    global _rates_generation
+    _rates.clear()
+    _rates_generation += 1
+    _clear_waterfalls()
+
+
+def _drop_rate(user_id: int, game_category: str) -> None:
+    """Drop one user's rate and every waterfall it feeds (the user's subtree)."""
+    global _rates_generation
+    _rates.pop((user_id, game_category), None)
+    _rates_generation += 1
+    _drop_waterfalls(
+        lambda bettor_id, chain: bettor_id == user_id or user_id in chain.ancestor_ids,
+        game_category,
+    )
+
+
+async def _sync_rates() -> None:
+    """Apply rate changes published by other workers since the last poll."""
+    changes = await _rates_watch.poll()
+    if changes is None:
+        _clear_rates()
+        return
+    for change in changes:
+        user_id, game_category = change.split(":", 1)
+        _drop_rate(int(user_id), game_category)
+
+
+async def get_rates(
+    session: AsyncSession,
+    user_ids: list[int],
+    game_category: str,
+    commission_type: str,
+) -> dict[int, Decimal]:
+    """Cached equivalent of commission_engine.get_user_rates_bulk (provider-agnostic rows)."""
+    await _sync_rates()
+    pick = 0 if commission_type == "rolling" else 1
+
+    rates: dict[int, Decimal] = {}
+    missing: list[int] = []
+    for uid in user_ids:
+        pair = _rates.get((uid, game_category))
+        if pair is None:
+            missing.append(uid)
+        else:
+            rates[uid] = pair[pick]
+
+    if missing:
+        generation = _rates_generation
+        stmt = select(
+            UserGameRollingRate.user_id,
+            UserGameRollingRate.rolling_rate,
+            UserGameRollingRate.losing_rate,
+        ).where(
+            UserGameRollingRate.user_id.in_(missing),
+            UserGameRollingRate.game_category == game_category,
+            UserGameRollingRate.provider.is_(None),
+        )
+        loaded = {
+            row.user_id: (row.rolling_rate or _ZERO, row.losing_rate or _ZERO)
+            for row in (await session.execute(stmt)).all()
+        }
+        store = generation == _rates_generation
+        if store and len(_rates) + len(missing) > _RATES_MAX_ENTRIES:
+            _rates.clear()
+        for uid in missing:
+            pair = loaded.get(uid, (_ZERO, _ZERO))
+            rates[uid] = pair[pick]
+            if store:
+                _rates[(uid, game_category)] = pair
+
+    return rates
+
+
+async def bump_rates_version() -> None:
+    """Invalidate rate caches in this worker now and in all others within one interval."""
+    _clear_rates()
+    await _rates_watch.bump()
+
+
+async def invalidate_rates(user_id: int, game_categories: set[str]) -> None:
+    """Drop one user's rates (and the waterfalls of its subtree) here and in all workers."""
+    for game_category in game_categories:
+        _drop_rate(user_id, game_category)
+        await _rates_watch.bump(f"{user_id}:{game_category}")
+
+
+# ─── Waterfall vectors ────────────────────────────────────────────
+
+# (level, recipient_id, effective_rate) shares of one bet, bettor first
+Waterfall = tuple[tuple[int, int, Decimal], ...]
+
+# (bettor_id, game_category, commission_type) -> (chain it was built from, shares)
+_waterfalls: dict[tuple[int, str, str], tuple[AncestorChain, Waterfall]] = {}
+_waterfalls_generation = 0
+
+
+def compute_waterfall(
+    chain_user_ids: list[int],
+    rates_map: dict[int, Decimal],
+) -> list[tuple[int, int, Decimal]]:
+    """Resolve (level, recipient_id, effective_rate) for a bettor chain.
+
+    chain_user_ids[0] is the bettor (earns the full own rate); every ancestor
+    earns (their_rate - child_in_path_rate). Non-positive shares are dropped.
+    """
+    shares = []
+    for i, uid in enumerate(chain_user_ids):
+        my_rate = rates_map.get(uid, Decimal("0"))
+        if my_rate <= 0:
+            continue
+
+        if i == 0:
+            effective_rate = my_rate
+        else:
+            child_rate = rates_map.get(chain_user_ids[i - 1], Decimal("0"))
+            effective_rate = my_rate - child_rate
+            if effective_rate <= 0:
+                continue
+
+        shares.append((i, uid, effective_rate))
+    return shares
+
+
+def _clear_waterfalls() -> None:
+    global _waterfalls_generation
+    _waterfalls.clear()
+    _waterfalls_generation += 1
+
+
+def _drop_waterfalls(stale, game_category: str | None = None) -> None:
+    """Drop vectors for which stale(bettor_id, chain) holds, optionally in one category."""
+    global _waterfalls_generation
+    _waterfalls_generation += 1
+    keys = [
+        key for key, (chain, _) in _waterfalls.items()
+        if (game_category is None or key[1] == game_category) and stale(key[0], chain)
+    ]
+    for key in keys:
+        del _waterfalls[key]
+
+
+async def get_waterfalls(
+    session: AsyncSession,
+    user_ids: list[int],
+    game_category: str,
+    commission_type: str,
+) -> dict[int, Waterfall]:
+    """Precomputed waterfall shares of many bettors for one category and type.
+
+    Hits cost one dict lookup each; misses are built from the chain and rate
+    caches in one pass. A vector expires with the chain it was built from.
+    """
+    await _sync_tree()
+    await _sync_rates()
+    now = time.monotonic()
+    found: dict[int, Waterfall] = {}
+    missing: list[int] = []
+    for uid in user_ids:
+        entry = _waterfalls.get((uid, game_category, commission_type))
+        if entry is not None and _fresh(entry[0], now):
+            found[uid] = entry[1]
+        else:
+            missing.append(uid)
+
+    if missing:
+        generation = _waterfalls_generation
+        chains = await get_ancestor_chains(session, missing)
+        members = {uid: [uid, *chains[uid].active_ids()] for uid in missing}
+        rates = await get_rates(
+            session, list({m for ids in members.values() for m in ids}), game_category, commission_type,
+        )
+        store = generation == _waterfalls_generation
+        if store and len(_waterfalls) + len(missing) > _WATERFALL_MAX_ENTRIES:
+            _clear_waterfalls()
+        for uid in missing:
+            shares = tuple(compute_waterfall(members[uid], rates))
+            found[uid] = shares
+            if store:
+                _waterfalls[(uid, game_category, commission_type)] = (chains[uid], shares)
+
+    return found
+
+
+async def get_waterfall(
+    session: AsyncSession,
+    user_id: int,
+    game_category: str,
+    commission_type: str,
+) -> Waterfall:
+    """Precomputed waterfall shares of a single bettor."""
+    return (await get_waterfalls(session, [user_id], game_category, commission_type))[user_id]
+
+
+# ─── Commission policies ──────────────────────────────────────────
+
+
+class PolicyRef:
+    """The parts of an active CommissionPolicy the engine needs per bet."""
+
+    __slots__ = ("id", "min_bet_amount")
+
+    def __init__(self, id: int, min_bet_amount: Decimal):
+        self.id = id
+        self.min_bet_amount = min_bet_amount
+
+
+# (type, game_category) -> highest-priority active policy with the NULL-category
+# fallback already applied; (type, None) holds the category-agnostic policy.
+_policies: dict[tuple[str, str | None], PolicyRef] | None = None
+_policies_watch = VersionWatch("commission:policies:version")
+_policies_generation = 0
+
+
+async def _load_policies(session: AsyncSession) -> dict[tuple[str, str | None], PolicyRef]:
+    stmt = (
+        select(
+            CommissionPolicy.id,
+            CommissionPolicy.type,
+            CommissionPolicy.game_category,
+            CommissionPolicy.min_bet_amount,
+        )
+        .where(CommissionPolicy.active == True)
+        .order_by(CommissionPolicy.priority.desc(), CommissionPolicy.id)
+    )
+    best: dict[tuple[str, str | None], PolicyRef] = {}
+    for row in (await session.execute(stmt)).all():
+        best.setdefault((row.type, row.game_category), PolicyRef(row.id, row.min_bet_amount))
+
+    types = {ptype for ptype, _ in best}
+    categories = {category for _, category in best if category is not None}
+    resolved = {(ptype, None): best[(ptype, None)] for ptype in types if (ptype, None) in best}
+    for ptype in types:
+        for category in categories:
+            ref = best.get((ptype, category)) or best.get((ptype, None))
+            if ref is not None:
+                resolved[(ptype, category)] = ref
+    return resolved
+
+
+async def resolve_policy(
+    session: AsyncSession,
+    commission_type: str,
+    game_category: str,
+) -> PolicyRef | None:
+    """Active policy for (type, category), falling back to the category-agnostic one."""
+    global _policies, _policies_generation
+    if await _policies_watch.changed():
+        _policies = None
+        _policies_generation += 1
+
+    policies = _policies
+    if policies is None:
+        generation = _policies_generation
+        policies = await _load_policies(session)
+        if generation == _policies_generation:
+            _policies = policies
+
+    ref = policies.get((commission_type, game_category))
+    if ref is None:
+        ref = policies.get((commission_type, None))
+    return ref
+
+
+async def invalidate_policies() -> None:
+    """Called by the /commissions/policies CRUD endpoints after commit."""
+    global _policies, _policies_generation
+    _policies = None
+    _policies_generation += 1
+    await _policies_watch.bump()
+
+
+# ─── Processed rounds ─────────────────────────────────────────────
+
+
+def _seen_key(commission_type: str, round_id: str) -> str:
+    return f"commission:seen:{commission_type}:{round_id}"
+
+
+async def seen_rounds(commission_type: str, round_ids: list[str]) -> set[str]:
+    """Rounds already processed for this type (empty if Redis is unavailable)."""
+    if not round_ids:
+        return set()
+    try:
+        r = await get_redis()
+        flags = await r.mget([_seen_key(commission_type, rid) for rid in round_ids])
+    except Exception as e:
+        logger.warning("Processed-round lookup failed: %s", e)
+        return set()
+    return {rid for rid, flag in zip(round_ids, flags, strict=True) if flag}
+
+
+async def mark_rounds_seen(commission_type: str, round_ids: list[str]) -> None:
+    """Record rounds as processed. Call only after the ledger rows are committed."""
+    if not round_ids:
+        return
+    try:
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        for rid in round_ids:
+            pipe.set(_seen_key(commission_type, rid), 1, ex=settings.COMMISSION_DEDUP_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning("Processed-round mark failed: %s", e)
@@ -13,16 +13,28 @@ Waterfall:
 Hierarchy uses UserTree (Closure Table) + UserGameRollingRate for per-user rates.
 """
 
+from collections.abc import Iterable
+from datetime import datetime, timezone
 from decimal import ROUND_HALF_UP, Decimal
 
-from sqlalchemy import and_, select
+from sqlalchemy import Boolean, Integer, Numeric, and_, case, column, select, values
 from sqlalchemy import update as sa_update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.commission import CommissionLedger, CommissionPolicy
+from app.models.commission import CommissionLedger, CommissionLedgerKey
 from app.models.user import User
 from app.models.user_game_rolling_rate import UserGameRollingRate
-from app.services.user_tree_service import get_ancestors
+from app.services import subtree_stats
+from app.services.commission_cache import (
+    PolicyRef,
+    get_waterfall,
+    get_waterfalls,
+    resolve_policy,
+    seen_rounds,
+)
+from app.services.commission_partitions import month_of
+from app.services.commission_rollup import apply_rollup, entry_deltas
 
 
 async def get_user_rate(
@@ -71,47 +83,165 @@ async def get_user_rates_bulk(
     return {r.user_id: (r.losing_rate or Decimal("0")) for r in rows}
 
 
-def _calc_amount(source: Decimal, rate_pct: Decimal) -> Decimal:
+_LEDGER_INSERT_CHUNK = 1000  # rows per INSERT (asyncpg caps bind parameters at 32767)
+
+# Webhook event each commission type is idempotent on
+_REFERENCE_TYPES = {"rolling": "bet", "losing": "round_result"}
+
+
+def calc_amount(source: Decimal, rate_pct: Decimal) -> Decimal:
     """Calculate commission: source × (rate / 100), rounded to 2 decimals."""
     return (source * rate_pct / Decimal("100")).quantize(
         Decimal("0.01"), rounding=ROUND_HALF_UP
     )
 
 
-async def _find_policy(
-    session: AsyncSession,
+def _ledger_rows(
+    shares,
+    *,
+    user_id: int,
     commission_type: str,
     game_category: str,
-) -> CommissionPolicy | None:
-    """Find active policy for reference (min_bet_amount check)."""
-    stmt = (
-        select(CommissionPolicy)
-        .where(
-            CommissionPolicy.type == commission_type,
-            CommissionPolicy.game_category == game_category,
-            CommissionPolicy.active == True,
+    source_amount: Decimal,
+    round_id: str,
+    policy_id: int | None,
+    game_code: str | None,
+) -> list[dict]:
+    """Ledger row dicts for one bettor's waterfall shares (zero amounts dropped)."""
+    label = "Rolling" if commission_type == "rolling" else "Losing"
+    rows = []
+    for i, uid, effective_rate in shares:
+        amount = calc_amount(source_amount, effective_rate)
+        if amount <= 0:
+            continue
+        rows.append({
+            "recipient_user_id": uid,
+            "user_id": user_id,
+            "policy_id": policy_id,
+            "type": commission_type,
+            "level": i,
+            "game_category": game_category,
+            "source_amount": source_amount,
+            "rate": effective_rate,
+            "commission_amount": amount,
+            "status": "pending",
+            "reference_type": _REFERENCE_TYPES[commission_type],
+            "reference_id": round_id,
+            "description": f"{label} L{i} {game_category} {game_code or ''}".strip(),
+        })
+    return rows
+
+
+async def credit_points(
+    session: AsyncSession, credits: dict[int, Decimal], bettors: Iterable[int] = ()
+) -> None:
+    """Add points to many users in one statement with deterministic lock order.
+
+    The recipients are row-locked in ascending id order by a FOR UPDATE
+    subquery before the UPDATE applies, so two transactions crediting
+    overlapping chains always queue on the same first row instead of
+    deadlocking on each other's ancestors.
+
+    bettors (the users whose bets the credits came from) are locked in the
+    same pass. The first time one earns commission, users.first_commission_at
+    is set and their ancestors' user_subtree_stats.bettor_count goes up.
+    """
+    bettors = set(bettors)
+    if not credits and not bettors:
+        return
+    now = datetime.now(timezone.utc)
+    credit = values(
+        column("id", Integer),
+        column("amount", Numeric(18, 2)),
+        column("bettor", Boolean),
+        name="credit",
+    ).data([
+        (user_id, credits.get(user_id, Decimal("0")), user_id in bettors)
+        for user_id in sorted(credits.keys() | bettors)
+    ])
+    locked = (
+        select(
+            User.id,
+            credit.c.amount,
+            and_(credit.c.bettor, User.first_commission_at.is_(None)).label("first"),
         )
-        .order_by(CommissionPolicy.priority.desc())
-        .limit(1)
+        .join(credit, credit.c.id == User.id)
+        .order_by(User.id)
+        .with_for_update(of=User)
+        .subquery("locked")
     )
-    result = await session.execute(stmt)
-    policy = result.scalar_one_or_none()
-    if policy:
-        return policy
-
-    # Fallback: category-agnostic policy
-    stmt = (
-        select(CommissionPolicy)
-        .where(
-            CommissionPolicy.type == commission_type,
-            CommissionPolicy.game_category.is_(None),
-            CommissionPolicy.active == True,
+    result = await session.execute(
+        sa_update(User)
+        .where(User.id == locked.c.id)
+        .values(
+            points=User.points + locked.c.amount,
+            first_commission_at=case((locked.c.first, now), else_=User.first_commission_at),
         )
-        .order_by(CommissionPolicy.priority.desc())
-        .limit(1)
+        .returning(User.id, locked.c.first)
+        .execution_options(synchronize_session=False)
     )
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+    for user_id, first in result.all():
+        if first:
+            subtree_stats.record_user(session, user_id, bettors=1)
+
+
+_KEY_FIELDS = ("reference_id", "user_id", "type", "recipient_user_id")
+
+
+async def _claim_keys(session: AsyncSession, rows: list[dict], now: datetime) -> list[dict]:
+    """The rows whose idempotency key this transaction inserted into commission_ledger_keys.
+
+    INSERT ... ON CONFLICT DO NOTHING: a key committed by an earlier delivery,
+    in any ledger month (archived ones included), is skipped; one being
+    inserted by a concurrent transaction blocks until that commits and is then
+    skipped too.
+    """
+    claimed: set[tuple] = set()
+    for start in range(0, len(rows), _LEDGER_INSERT_CHUNK):
+        chunk = rows[start:start + _LEDGER_INSERT_CHUNK]
+        stmt = (
+            pg_insert(CommissionLedgerKey)
+            .values([{**{f: row[f] for f in _KEY_FIELDS}, "created_at": now} for row in chunk])
+            .on_conflict_do_nothing()
+            .returning(*(getattr(CommissionLedgerKey, f) for f in _KEY_FIELDS))
+        )
+        claimed.update(tuple(key) for key in (await session.execute(stmt)).all())
+    return [row for row in rows if tuple(row[f] for f in _KEY_FIELDS) in claimed]
+
+
+async def _write_ledger(session: AsyncSession, rows: list[dict]) -> list[CommissionLedger]:
+    """Bulk-insert ledger rows, credit their recipients' points, update the rollup.
+
+    Each row's key is claimed in commission_ledger_keys first (see
+    _claim_keys), so a round delivered twice is written once even when the
+    deliveries fall in different ledger months. The rows still go in as
+    INSERT ... ON CONFLICT DO NOTHING on uq_ledger_idempotency; only the rows
+    actually inserted are returned and credited.
+    """
+    now = datetime.now(timezone.utc)
+    for row in rows:
+        row["created_at"] = now
+        row["ledger_month"] = month_of(now)
+    rows = await _claim_keys(session, rows, now)
+
+    inserted: list[CommissionLedger] = []
+    for start in range(0, len(rows), _LEDGER_INSERT_CHUNK):
+        stmt = (
+            pg_insert(CommissionLedger)
+            .values(rows[start:start + _LEDGER_INSERT_CHUNK])
+            .on_conflict_do_nothing(constraint="uq_ledger_idempotency")
+            .returning(CommissionLedger)
+        )
+        inserted.extend((await session.scalars(stmt)).all())
+
+    credits: dict[int, Decimal] = {}
+    for entry in inserted:
+        credits[entry.recipient_user_id] = (
+            credits.get(entry.recipient_user_id, Decimal("0")) + entry.commission_amount
+        )
+    await credit_points(session, credits, bettors={entry.user_id for entry in inserted})
+    await apply_rollup(session, entry_deltas(inserted))
+    return inserted
 
 
 async def calculate_rolling_commission(
@@ -127,86 +257,43 @@ async def calculate_rolling_commission(
     1. Bettor (self-rolling): earns own rolling_rate% of bet_amount → points
     2. Referrer chain: each ancestor earns (their_rate - child_rate)% → points
 
-    All commission accumulates in User.points via atomic UPDATE.
+    All commission accumulates in User.points via one set-based UPDATE.
     """
     bettor = await session.get(User, user_id)
     if not bettor or not bettor.commission_enabled or bettor.commission_type != "rolling":
         return []
 
-    policy = await _find_policy(session, "rolling", game_category)
+    policy = await resolve_policy(session, "rolling", game_category)
     if policy and bet_amount < policy.min_bet_amount:
         return []
 
-    # Idempotency: skip if already processed for this round (FOR UPDATE to prevent race)
-    dup_stmt = select(CommissionLedger).where(
-        CommissionLedger.reference_id == round_id,
-        CommissionLedger.user_id == user_id,
-        CommissionLedger.type == "rolling",
-    ).with_for_update().limit(1)
-    if (await session.execute(dup_stmt)).scalar_one_or_none():
-        return []
-
-    # Build chain: bettor (self) + all ancestors in referral tree
-    ancestors = await get_ancestors(session, user_id)
-
-    # chain[0] = bettor, chain[1] = direct referrer, chain[2] = grandparent, ...
-    chain_user_ids = [user_id] + [a["user"].id for a in ancestors if a["user"].status == "active"]
-
-    if not chain_user_ids:
+    # Idempotency: skip if already processed for this round (races are caught by
+    # the key claim in _write_ledger)
+    dup_stmt = select(CommissionLedgerKey.reference_id).where(
+        CommissionLedgerKey.reference_id == round_id,
+        CommissionLedgerKey.user_id == user_id,
+        CommissionLedgerKey.type == "rolling",
+    ).limit(1)
+    if (await session.execute(dup_stmt)).scalar_one_or_none() is not None:
         return []
 
-    # Batch fetch all rolling rates for this game category
-    rates_map = await get_user_rates_bulk(session, chain_user_ids, game_category, "rolling")
-
-    entries = []
-    policy_id = policy.id if policy else None
-
-    for i, uid in enumerate(chain_user_ids):
-        my_rate = rates_map.get(uid, Decimal("0"))
-        if my_rate <= 0:
-            continue
-
-        if i == 0:
-            # Self-rolling: bettor earns their full rate
-            effective_rate = my_rate
-        else:
-            # Waterfall: ancestor earns (their_rate - child_in_path_rate)
-            child_uid = chain_user_ids[i - 1]
-            child_rate = rates_map.get(child_uid, Decimal("0"))
-            effective_rate = my_rate - child_rate
-            if effective_rate <= 0:
-                continue
-
-        amount = _calc_amount(bet_amount, effective_rate)
-        if amount <= 0:
-            continue
-
-        entry = CommissionLedger(
-            recipient_user_id=uid,
-            user_id=user_id,
-            policy_id=policy_id,
-            type="rolling",
-            level=i,
-            game_category=game_category,
-            source_amount=bet_amount,
-            rate=effective_rate,
-            commission_amount=amount,
-            status="pending",
-            reference_type="bet",
-            reference_id=round_id,
-            description=f"Rolling L{i} {game_category} {game_code or ''}".strip(),
-        )
-        session.add(entry)
-        entries.append(entry)
-
-        # Atomic points update (no SELECT FOR UPDATE needed — atomic UPDATE)
-        await session.execute(
-            sa_update(User)
-            .where(User.id == uid)
-            .values(points=User.points + amount)
-        )
+    # Precomputed (level, recipient, effective_rate) shares: bettor first, then
+    # every active ancestor earning the margin over its child in the path
+    shares = await get_waterfall(session, user_id, game_category, "rolling")
+
+    rows = _ledger_rows(
+        shares,
+        user_id=user_id,
+        commission_type="rolling",
+        game_category=game_category,
+        source_amount=bet_amount,
+        round_id=round_id,
+        policy_id=policy.id if policy else None,
+        game_code=game_code,
+    )
 
-    return entries
+    # One bulk INSERT + one UPDATE for all recipients (see _write_ledger)
+    return await _write_ledger(session, rows)
 
 
 async def calculate_losing_commission(
@@ -231,75 +318,230 @@ async def calculate_losing_commission(
     if not bettor or not bettor.commission_enabled or bettor.commission_type != "losing":
         return []
 
-    policy = await _find_policy(session, "losing", game_category)
+    policy = await resolve_policy(session, "losing", game_category)
     if policy and bet_amount < policy.min_bet_amount:
         return []
 
-    # Idempotency check (FOR UPDATE to prevent race)
-    dup_stmt = select(CommissionLedger).where(
-        CommissionLedger.reference_id == round_id,
-        CommissionLedger.user_id == user_id,
-        CommissionLedger.type == "losing",
-    ).with_for_update().limit(1)
-    if (await session.execute(dup_stmt)).scalar_one_or_none():
+    # Idempotency check (races are caught by the key claim in _write_ledger)
+    dup_stmt = select(CommissionLedgerKey.reference_id).where(
+        CommissionLedgerKey.reference_id == round_id,
+        CommissionLedgerKey.user_id == user_id,
+        CommissionLedgerKey.type == "losing",
+    ).limit(1)
+    if (await session.execute(dup_stmt)).scalar_one_or_none() is not None:
         return []
 
-    # Build chain: bettor (self) + all ancestors
-    ancestors = await get_ancestors(session, user_id)
-    chain_user_ids = [user_id] + [a["user"].id for a in ancestors if a["user"].status == "active"]
+    # Precomputed waterfall shares (bettor + active ancestors)
+    shares = await get_waterfall(session, user_id, game_category, "losing")
+
+    rows = _ledger_rows(
+        shares,
+        user_id=user_id,
+        commission_type="losing",
+        game_category=game_category,
+        source_amount=loss_amount,
+        round_id=round_id,
+        policy_id=policy.id if policy else None,
+        game_code=game_code,
+    )
 
-    if not chain_user_ids:
-        return []
+    # One bulk INSERT + one UPDATE for all recipients (see _write_ledger)
+    return await _write_ledger(session, rows)
 
-    rates_map = await get_user_rates_bulk(session, chain_user_ids, game_category, "losing")
 
-    entries = []
-    policy_id = policy.id if policy else None
+async def process_round_settlement(
+    session: AsyncSession,
+    user_id: int,
+    game_category: str,
+    bet_amount: Decimal,
+    win_amount: Decimal,
+    round_id: str,
+    result: str,
+    game_code: str | None = None,
+) -> dict[str, list[CommissionLedger]]:
+    """Rolling and losing commission of one settled round in a single pass.
+
+    For providers that only report round results: the bettor, the duplicate
+    check and the waterfall vectors are loaded once for both types, and all
+    ledger rows go through one _write_ledger call. Idempotency stays per type
+    (rolling rows keyed as "bet", losing rows as "round_result"), so this
+    coexists with the separate bet and round-result webhooks.
+    """
+    entries: dict[str, list[CommissionLedger]] = {"rolling": [], "losing": []}
 
-    for i, uid in enumerate(chain_user_ids):
-        my_rate = rates_map.get(uid, Decimal("0"))
-        if my_rate <= 0:
-            continue
+    bettor = await session.get(User, user_id)
+    if not bettor or not bettor.commission_enabled:
+        return entries
+
+    sources = {"rolling": bet_amount}
+    if result == "lose" and bet_amount > win_amount:
+        sources["losing"] = bet_amount - win_amount
+    sources = {ctype: amount for ctype, amount in sources.items() if ctype == bettor.commission_type}
+
+    policies: dict[str, PolicyRef | None] = {}
+    for ctype in list(sources):
+        policies[ctype] = await resolve_policy(session, ctype, game_category)
+        if policies[ctype] and bet_amount < policies[ctype].min_bet_amount:
+            del sources[ctype]
+    if not sources:
+        return entries
+
+    # One duplicate check for both types (races are caught by the key claim)
+    dup_stmt = select(CommissionLedgerKey.type).where(
+        CommissionLedgerKey.reference_id == round_id,
+        CommissionLedgerKey.user_id == user_id,
+        CommissionLedgerKey.type.in_(list(sources)),
+    ).distinct()
+    for ctype in (await session.execute(dup_stmt)).scalars().all():
+        sources.pop(ctype, None)
+
+    rows = []
+    for ctype, source_amount in sources.items():
+        policy = policies[ctype]
+        rows.extend(_ledger_rows(
+            await get_waterfall(session, user_id, game_category, ctype),
+            user_id=user_id,
+            commission_type=ctype,
+            game_category=game_category,
+            source_amount=source_amount,
+            round_id=round_id,
+            policy_id=policy.id if policy else None,
+            game_code=game_code,
+        ))
+
+    for entry in await _write_ledger(session, rows):
+        entries[entry.type].append(entry)
+    return entries
 
-        if i == 0:
-            effective_rate = my_rate
-        else:
-            child_uid = chain_user_ids[i - 1]
-            child_rate = rates_map.get(child_uid, Decimal("0"))
-            effective_rate = my_rate - child_rate
-            if effective_rate <= 0:
-                continue
 
-        amount = _calc_amount(loss_amount, effective_rate)
-        if amount <= 0:
+async def process_rolling_batch(
+    session: AsyncSession,
+    bets: list[dict],
+) -> list[dict]:
+    """Process many bet events in one transaction (rolling commission).
+
+    Same waterfall as calculate_rolling_commission, but bettors, policies and
+    waterfall vectors are fetched once for the whole batch. Ledger rows
+    go in through _write_ledger, so rows of a concurrently processed round are
+    skipped and points are credited only for rows actually inserted.
+
+    Each bet dict: user_id, game_category, bet_amount, round_id, game_code.
+    Returns one outcome per bet: processed / duplicate / skipped / user_not_found.
+    """
+    outcomes = [
+        {
+            "round_id": b["round_id"],
+            "user_id": b["user_id"],
+            "status": "skipped",
+            "entries": 0,
+            "total": Decimal("0"),
+        }
+        for b in bets
+    ]
+    if not bets:
+        return outcomes
+
+    user_ids = list({b["user_id"] for b in bets})
+    user_stmt = select(User.id, User.commission_enabled, User.commission_type).where(
+        User.id.in_(user_ids)
+    )
+    bettors = {row.id: row for row in (await session.execute(user_stmt)).all()}
+
+    # Rounds known to Redis as processed skip the ledger lookup entirely
+    round_ids = list({b["round_id"] for b in bets})
+    processed_rounds = await seen_rounds("rolling", round_ids)
+    unknown = [rid for rid in round_ids if rid not in processed_rounds]
+    if unknown:
+        dup_stmt = select(CommissionLedgerKey.reference_id).where(
+            CommissionLedgerKey.type == "rolling",
+            CommissionLedgerKey.reference_id.in_(unknown),
+        ).distinct()
+        processed_rounds.update((await session.execute(dup_stmt)).scalars().all())
+
+    policies: dict[str, PolicyRef | None] = {}
+    for category in {b["game_category"] for b in bets}:
+        policies[category] = await resolve_policy(session, "rolling", category)
+
+    # Filter to bets that actually need a waterfall
+    pending: list[int] = []
+    for idx, b in enumerate(bets):
+        bettor = bettors.get(b["user_id"])
+        if not bettor:
+            outcomes[idx]["status"] = "user_not_found"
             continue
+        if b["round_id"] in processed_rounds:
+            outcomes[idx]["status"] = "duplicate"
+            continue
+        processed_rounds.add(b["round_id"])
 
-        entry = CommissionLedger(
-            recipient_user_id=uid,
-            user_id=user_id,
-            policy_id=policy_id,
-            type="losing",
-            level=i,
-            game_category=game_category,
-            source_amount=loss_amount,
-            rate=effective_rate,
-            commission_amount=amount,
-            status="pending",
-            reference_type="round_result",
-            reference_id=round_id,
-            description=f"Losing L{i} {game_category} {game_code or ''}".strip(),
+        if not bettor.commission_enabled or bettor.commission_type != "rolling":
+            continue
+        policy = policies[b["game_category"]]
+        if policy and b["bet_amount"] < policy.min_bet_amount:
+            continue
+        pending.append(idx)
+
+    if not pending:
+        return outcomes
+
+    waterfalls_by_category = {}
+    for category in {bets[idx]["game_category"] for idx in pending}:
+        bettor_ids = list({
+            bets[idx]["user_id"] for idx in pending if bets[idx]["game_category"] == category
+        })
+        waterfalls_by_category[category] = await get_waterfalls(
+            session, bettor_ids, category, "rolling"
         )
-        session.add(entry)
-        entries.append(entry)
-
-        # Atomic points update
-        await session.execute(
-            sa_update(User)
-            .where(User.id == uid)
-            .values(points=User.points + amount)
+
+    rows = []
+    for idx in pending:
+        b = bets[idx]
+        user_id, category = b["user_id"], b["game_category"]
+        policy = policies[category]
+        rows.extend(_ledger_rows(
+            waterfalls_by_category[category][user_id],
+            user_id=user_id,
+            commission_type="rolling",
+            game_category=category,
+            source_amount=b["bet_amount"],
+            round_id=b["round_id"],
+            policy_id=policy.id if policy else None,
+            game_code=b.get("game_code"),
+        ))
+
+    if not rows:
+        return outcomes
+
+    per_round: dict[tuple[str, int], list[Decimal]] = {}
+    for entry in await _write_ledger(session, rows):
+        per_round.setdefault((entry.reference_id, entry.user_id), []).append(
+            entry.commission_amount
         )
 
-    return entries
+    attempted = {(r["reference_id"], r["user_id"]) for r in rows}
+    for idx in pending:
+        key = (bets[idx]["round_id"], bets[idx]["user_id"])
+        if key in per_round:
+            outcomes[idx]["status"] = "processed"
+            outcomes[idx]["entries"] = len(per_round[key])
+            outcomes[idx]["total"] = sum(per_round[key])
+        elif key in attempted:
+            outcomes[idx]["status"] = "duplicate"
+
+    return outcomes
+
+
+# Highest rates a member may be given (percent): rolling per game category, losing overall
+ROLLING_MAX_RATES: dict[str, Decimal] = {
+    "casino": Decimal("1.5"),
+    "slot": Decimal("5"),
+    "holdem": Decimal("5"),
+    "sports": Decimal("5"),
+    "shooting": Decimal("5"),
+    "coin": Decimal("5"),
+    "mini_game": Decimal("3"),
+}
+LOSING_MAX_RATE = Decimal("50")
 
 
 async def validate_rate_against_parent(
@@ -0,0 +1,283 @@
+"""Monthly partitions of commission_ledger and their archive.
+
+commission_ledger is range-partitioned on ledger_month, the first day of the
+UTC month of created_at (a CHECK keeps the two consistent). Postgres needs
+the partition key in every unique constraint, so uq_ledger_idempotency is
+(reference_id, user_id, type, recipient_user_id, ledger_month) and ON CONFLICT
+only sees a duplicate within one month. Cross-month uniqueness comes from the
+unpartitioned commission_ledger_keys, which the engine writes in the same
+transaction as the entries and which is never archived.
+
+ensure_partitions creates the partitions ahead of time. archive_months
+detaches months older than COMMISSION_ARCHIVE_AFTER_MONTHS that hold no
+pending entries and moves them into the commission_archive schema. If
+COMMISSION_ARCHIVE_TABLESPACE is set, they also move to that tablespace,
+e.g. one on compressed storage. Each archived month is recorded in
+commission_ledger_archives. ledger_source gives readers one selectable
+over the live table and the archived months a date range reaches.
+"""
+
+import asyncio
+import contextlib
+import logging
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import column, func, select, table, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import settings
+from app.database import async_session, engine
+from app.models.commission import CommissionLedger, CommissionLedgerArchive
+from app.services.cache_service import get_redis
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = "commission_archive"
+_PARTITION_RE = re.compile(r"^commission_ledger_(\d{4})(\d{2})$")
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_LOCK_KEY = "commission:ledger:maintenance:lock"
+_LOCK_TTL = 3600  # seconds
+
+_stop: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+
+
+def month_of(ts: datetime) -> date:
+    """ledger_month of a timestamp (naive values are taken as UTC)."""
+    if ts.tzinfo:
+        ts = ts.astimezone(timezone.utc)
+    return date(ts.year, ts.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"commission_ledger_{month:%Y%m}"
+
+
+def _partition_month(name: str) -> date | None:
+    match = _PARTITION_RE.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+# ─── Partitions ───────────────────────────────────────────────────
+
+async def ensure_partitions(session: AsyncSession, months_ahead: int | None = None) -> list[str]:
+    """Create the partitions of the current month and the next months_ahead months.
+
+    Returns the names of partitions that did not exist yet.
+    """
+    if months_ahead is None:
+        months_ahead = settings.COMMISSION_LEDGER_PARTITIONS_AHEAD
+    existing = {name for name, _ in await _partitions(session)}
+    current = month_of(datetime.now(timezone.utc))
+    created = []
+    for n in range(months_ahead + 1):
+        month = add_months(current, n)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        await session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF commission_ledger "
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        ))
+        created.append(name)
+    return created
+
+
+async def _partitions(session: AsyncSession) -> list[tuple[str, date]]:
+    """(name, month) of the attached monthly partitions, oldest first."""
+    rows = (await session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'commission_ledger'::regclass"
+    ))).scalars().all()
+    found = [(name, _partition_month(name)) for name in rows]
+    return sorted((name, month) for name, month in found if month)
+
+
+async def _detached_leftovers(session: AsyncSession) -> list[tuple[str, date]]:
+    """Monthly tables already detached but not yet moved to the archive schema.
+
+    Left behind when a run stops between the detach and the move.
+    """
+    rows = (await session.execute(text(
+        "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind = 'r' AND NOT c.relispartition "
+        "AND c.relname ~ '^commission_ledger_[0-9]{6}$'"
+    ))).scalars().all()
+    return sorted((name, _partition_month(name)) for name in rows)
+
+
+# ─── Archive ──────────────────────────────────────────────────────
+
+async def archived_months(
+    session: AsyncSession,
+    month_from: date | None = None,
+    month_to: date | None = None,
+) -> list[CommissionLedgerArchive]:
+    """Archived months within [month_from, month_to] (None leaves that side open)."""
+    stmt = select(CommissionLedgerArchive).order_by(CommissionLedgerArchive.month)
+    if month_from:
+        stmt = stmt.where(CommissionLedgerArchive.month >= month_from)
+    if month_to:
+        stmt = stmt.where(CommissionLedgerArchive.month <= month_to)
+    return list((await session.scalars(stmt)).all())
+
+
+async def _move_to_archive(name: str, month: date) -> dict:
+    """Move a detached monthly table into the archive schema and record it."""
+    tablespace = settings.COMMISSION_ARCHIVE_TABLESPACE
+    if tablespace and not _IDENTIFIER_RE.match(tablespace):
+        raise ValueError(f"Invalid COMMISSION_ARCHIVE_TABLESPACE: {tablespace!r}")
+
+    async with async_session() as session:
+        await session.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        if tablespace:
+            # Rewrites the table onto the archive storage
+            await session.execute(text(f"ALTER TABLE {ARCHIVE_SCHEMA}.{name} SET TABLESPACE {tablespace}"))
+        row_count, total = (await session.execute(text(
+            f"SELECT count(*), coalesce(sum(commission_amount), 0) FROM {ARCHIVE_SCHEMA}.{name}"
+        ))).one()
+        session.add(CommissionLedgerArchive(
+            month=month,
+            table_name=f"{ARCHIVE_SCHEMA}.{name}",
+            row_count=row_count,
+            commission_total=total,
+        ))
+        await session.commit()
+    logger.info("Archived commission ledger month %s (%d rows)", month, row_count)
+    return {"month": month, "table_name": f"{ARCHIVE_SCHEMA}.{name}", "row_count": row_count}
+
+
+async def archive_months(older_than_months: int | None = None) -> list[dict]:
+    """Detach and archive the settled months older than older_than_months.
+
+    A month is archived only when none of its entries is still pending, so
+    open settlements never reach the archive. Detaching runs CONCURRENTLY
+    in autocommit mode; writers to other months are not blocked.
+    """
+    if older_than_months is None:
+        older_than_months = settings.COMMISSION_ARCHIVE_AFTER_MONTHS
+    cutoff = add_months(month_of(datetime.now(timezone.utc)), -older_than_months)
+
+    async with async_session() as session:
+        leftovers = await _detached_leftovers(session)
+        candidates = []
+        for name, month in await _partitions(session):
+            if month >= cutoff:
+                break
+            pending = (await session.execute(text(
+                f"SELECT EXISTS (SELECT 1 FROM {name} WHERE status = 'pending')"
+            ))).scalar()
+            if pending:
+                logger.info("Ledger month %s still has pending entries; not archived", month)
+                continue
+            candidates.append((name, month))
+
+    archived = [await _move_to_archive(name, month) for name, month in leftovers]
+    for name, month in candidates:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(f"ALTER TABLE commission_ledger DETACH PARTITION {name} CONCURRENTLY"))
+        archived.append(await _move_to_archive(name, month))
+    return archived
+
+
+# ─── Readers ──────────────────────────────────────────────────────
+
+async def ledger_source(
+    session: AsyncSession,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+):
+    """CommissionLedger, or an alias of it that also covers archived months in the range.
+
+    Use the result in place of CommissionLedger in select()/where(); combine
+    with ledger_period so each branch is pruned to the months asked for.
+    """
+    archives = await archived_months(
+        session,
+        month_from=month_of(date_from) if date_from else None,
+        month_to=month_of(date_to) if date_to else None,
+    )
+    if not archives:
+        return CommissionLedger
+
+    live = CommissionLedger.__table__
+    branches = [select(live)]
+    for archive in archives:
+        schema, name = archive.table_name.split(".", 1)
+        archived = table(name, *[column(c.name, c.type) for c in live.c], schema=schema)
+        branches.append(select(*[archived.c[c.name] for c in live.c]))
+    return aliased(CommissionLedger, union_all(*branches).subquery("commission_ledger_all"))
+
+
+def ledger_period(entity, date_from: datetime | None, date_to: datetime | None) -> list:
+    """created_at bounds plus the matching ledger_month bounds for partition pruning."""
+    clauses = []
+    if date_from:
+        clauses += [entity.created_at >= date_from, entity.ledger_month >= month_of(date_from)]
+    if date_to:
+        clauses += [entity.created_at <= date_to, entity.ledger_month <= month_of(date_to)]
+    return clauses
+
+
+async def first_live_month(session: AsyncSession) -> date | None:
+    """The month after the newest archived one (None if nothing is archived)."""
+    newest = (await session.execute(select(func.max(CommissionLedgerArchive.month)))).scalar()
+    return add_months(newest, 1) if newest else None
+
+
+# ─── Maintenance loop ─────────────────────────────────────────────
+
+async def run_maintenance() -> dict:
+    """Create upcoming partitions, then archive old months (one process at a time)."""
+    async with async_session() as session:
+        created = await ensure_partitions(session)
+        await session.commit()
+
+    archived: list[dict] = []
+    if settings.COMMISSION_ARCHIVE_AFTER_MONTHS > 0:
+        r = await get_redis()
+        if await r.set(_LOCK_KEY, "1", nx=True, ex=_LOCK_TTL):
+            try:
+                archived = await archive_months()
+            finally:
+                await r.delete(_LOCK_KEY)
+    return {"created_partitions": created, "archived": archived}
+
+
+async def _maintenance_loop(stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            await run_maintenance()
+        except Exception:
+            logger.exception("Commission ledger maintenance failed")
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(stop.wait(), timeout=settings.COMMISSION_LEDGER_MAINTENANCE_INTERVAL)
+
+
+def start_maintenance() -> None:
+    """Start the periodic partition/archive task (called from the app lifespan)."""
+    global _stop, _task
+    if _task is not None:
+        return
+    _stop = asyncio.Event()
+    _task = asyncio.create_task(_maintenance_loop(_stop))
+
+
+async def stop_maintenance() -> None:
+    global _task
+    if _stop is not None:
+        _stop.set()
+    if _task is not None:
+        try:
+            await asyncio.wait_for(_task, timeout=5)
+        except TimeoutError:
+            _task.cancel()
+        _task = None
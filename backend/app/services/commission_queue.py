@@ -0,0 +1,256 @@
+"""Durable commission event queue on Redis Streams.
+
+Webhooks append events to one of COMMISSION_QUEUE_PARTITIONS streams chosen
+by bettor id, so every user's events stay in order. Each partition is read
+through one consumer group by exactly one worker at a time (a Redis lease),
+under a fixed consumer name: a worker that takes over a partition re-reads
+the previous holder's unacknowledged entries first (at-least-once).
+
+Entries are acknowledged only after the commission transaction commits.
+Replays are harmless because ledger writes are idempotent through
+uq_ledger_idempotency (see commission_engine._write_ledger).
+"""
+
+import asyncio
+import json
+import logging
+import time
+from decimal import Decimal
+from uuid import uuid4
+
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.database import async_session
+from app.services.cache_service import get_redis
+from app.services.commission_cache import mark_rounds_seen, seen_rounds
+from app.services.commission_engine import (
+    calculate_losing_commission,
+    calculate_rolling_commission,
+    process_round_settlement,
+)
+
+logger = logging.getLogger(__name__)
+
+_STREAM_PREFIX = "commission:events"
+_DEAD_LETTER_STREAM = "commission:events:dead"
+_GROUP = "commission-workers"
+
+_READ_COUNT = 100
+_BLOCK_MS = 1000
+_LEASE_TTL_MS = 15_000
+_MAX_ATTEMPTS = 5
+_RETRY_DELAY = 1.0  # seconds
+
+_stop: asyncio.Event | None = None
+_tasks: list[asyncio.Task] = []
+
+
+def _stream_key(partition: int) -> str:
+    return f"{_STREAM_PREFIX}:{partition}"
+
+
+def partition_for(user_id: int) -> int:
+    return user_id % settings.COMMISSION_QUEUE_PARTITIONS
+
+
+async def enqueue_event(event_type: str, payload: dict) -> str:
+    """Append a webhook event to its bettor's partition. Returns the stream entry id."""
+    r = await get_redis()
+    event = {"type": event_type, **payload}
+    entry_id = await r.xadd(
+        _stream_key(partition_for(payload["user_id"])),
+        {"event": json.dumps(event, default=str)},
+    )
+    return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+# Commission types each event type can produce (for the processed-round check)
+_EVENT_TYPES = {
+    "bet": ("rolling",),
+    "round_result": ("losing",),
+    "round_settlement": ("rolling", "losing"),
+}
+
+
+async def _apply_event(event: dict) -> None:
+    commission_types = _EVENT_TYPES[event["type"]]
+    seen = [await seen_rounds(ctype, [event["round_id"]]) for ctype in commission_types]
+    if all(seen):
+        return
+    async with async_session() as session:
+        if event["type"] == "bet":
+            await calculate_rolling_commission(
+                session=session,
+                user_id=event["user_id"],
+                game_category=event["game_category"],
+                bet_amount=Decimal(event["bet_amount"]),
+                round_id=event["round_id"],
+                game_code=event.get("game_code"),
+            )
+        elif event["type"] == "round_result" and event.get("result") == "lose":
+            await calculate_losing_commission(
+                session=session,
+                user_id=event["user_id"],
+                game_category=event["game_category"],
+                bet_amount=Decimal(event["bet_amount"]),
+                win_amount=Decimal(event["win_amount"]),
+                round_id=event["round_id"],
+                game_code=event.get("game_code"),
+            )
+        elif event["type"] == "round_settlement":
+            await process_round_settlement(
+                session=session,
+                user_id=event["user_id"],
+                game_category=event["game_category"],
+                bet_amount=Decimal(event["bet_amount"]),
+                win_amount=Decimal(event["win_amount"]),
+                round_id=event["round_id"],
+                result=event["result"],
+                game_code=event.get("game_code"),
+            )
+        await session.commit()
+    for ctype in commission_types:
+        await mark_rounds_seen(ctype, [event["round_id"]])
+
+
+async def _ensure_group(r, stream: str) -> None:
+    try:
+        await r.xgroup_create(stream, _GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _hold_lease(r, key: str, token: str) -> bool:
+    if await r.set(key, token, nx=True, px=_LEASE_TTL_MS):
+        return True
+    if await r.get(key) == token.encode():
+        await r.pexpire(key, _LEASE_TTL_MS)
+        return True
+    return False
+
+
+async def _run_partition(partition: int, stop: asyncio.Event) -> None:
+    """Drain one partition in order while holding its lease."""
+    stream = _stream_key(partition)
+    consumer = f"p{partition}"
+    lease_key = f"{stream}:lease"
+    token = uuid4().hex
+    attempts: dict[bytes, int] = {}
+
+    while not stop.is_set():
+        try:
+            r = await get_redis()
+            await _ensure_group(r, stream)
+            if not await _hold_lease(r, lease_key, token):
+                await asyncio.sleep(_LEASE_TTL_MS / 3000)
+                continue
+
+            # Redeliveries first (our consumer's pending list), then new entries
+            resp = await r.xreadgroup(_GROUP, consumer, {stream: "0"}, count=_READ_COUNT)
+            entries = resp[0][1] if resp else []
+            if not entries:
+                resp = await r.xreadgroup(
+                    _GROUP, consumer, {stream: ">"}, count=_READ_COUNT, block=_BLOCK_MS,
+                )
+                entries = resp[0][1] if resp else []
+
+            renewed_at = time.monotonic()
+            for entry_id, fields in entries:
+                if time.monotonic() - renewed_at > _LEASE_TTL_MS / 3000:
+                    if not await _hold_lease(r, lease_key, token):
+                        break
+                    renewed_at = time.monotonic()
+                try:
+                    await _apply_event(json.loads(fields[b"event"]))
+                except Exception as e:
+                    attempts[entry_id] = attempts.get(entry_id, 0) + 1
+                    logger.warning(
+                        "Commission event %s on %s failed (attempt %d): %s",
+                        entry_id, stream, attempts[entry_id], e,
+                    )
+                    if attempts[entry_id] < _MAX_ATTEMPTS:
+                        # Stop here so later events of the same users keep their order
+                        await asyncio.sleep(_RETRY_DELAY)
+                        break
+                    await r.xadd(_DEAD_LETTER_STREAM, {**fields, b"error": str(e)})
+                attempts.pop(entry_id, None)
+                await r.xack(stream, _GROUP, entry_id)
+            else:
+                if entries:
+                    await r.xtrim(stream, minid=entries[-1][0], approximate=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Commission queue worker %s error: %s", stream, e)
+            await asyncio.sleep(_RETRY_DELAY)
+
+    try:
+        r = await get_redis()
+        if await r.get(lease_key) == token.encode():
+            await r.delete(lease_key)
+    except Exception:
+        pass
+
+
+def start_workers() -> None:
+    """Start one worker task per partition (called from the app lifespan)."""
+    global _stop
+    if _tasks:
+        return
+    _stop = asyncio.Event()
+    for partition in range(settings.COMMISSION_QUEUE_PARTITIONS):
+        _tasks.append(asyncio.create_task(_run_partition(partition, _stop)))
+
+
+async def stop_workers() -> None:
+    if _stop is not None:
+        _stop.set()
+    if _tasks:
+        await asyncio.wait(_tasks, timeout=_BLOCK_MS / 1000 + 1)
+        for task in _tasks:
+            task.cancel()
+        _tasks.clear()
+
+
+def _entry_age(entry_id: bytes | str | None, now_ms: int) -> float | None:
+    if not entry_id:
+        return None
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    return max(now_ms - int(entry_id.split("-")[0]), 0) / 1000
+
+
+async def get_queue_stats() -> list[dict]:
+    """Per-partition backlog: length, undelivered lag, pending and oldest-entry age."""
+    r = await get_redis()
+    now_ms = int(time.time() * 1000)
+    stats = []
+    for partition in range(settings.COMMISSION_QUEUE_PARTITIONS):
+        stream = _stream_key(partition)
+        await _ensure_group(r, stream)
+        length = await r.xlen(stream)
+        group = next(
+            (g for g in await r.xinfo_groups(stream) if g["name"] in (_GROUP, _GROUP.encode())),
+            {},
+        )
+        pending = await r.xpending(stream, _GROUP)
+
+        # Oldest unfinished entry: first pending one, else first not yet delivered
+        oldest = pending.get("min")
+        if not oldest:
+            last_delivered = group.get("last-delivered-id") or b"0-0"
+            if isinstance(last_delivered, bytes):
+                last_delivered = last_delivered.decode()
+            after = await r.xrange(stream, min=f"({last_delivered}", count=1)
+            oldest = after[0][0] if after else None
+
+        stats.append({
+            "partition": partition,
+            "length": length,
+            "lag": group.get("lag"),
+            "pending": pending.get("pending", 0),
+            "oldest_age_seconds": _entry_age(oldest, now_ms),
+        })
+    return stats
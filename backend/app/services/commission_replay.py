@@ -0,0 +1,409 @@
+"""Commission replay: recompute past rounds from bet_records.
+
+After a rate or tree fix, past commissions can be recomputed with the
+current UserGameRollingRate rows, referral tree and policies. Bet records
+in a date range are read through a server-side cursor in chunks and handed
+to worker tasks, each with its own session, so memory stays bounded by the
+chunk size no matter how many rows the range holds.
+
+The live webhooks credit only the first record of a round per bettor, so
+only that record is read (see first_bets); the other records of a round can
+then land in any chunk, or outside the range, without a second worker
+recomputing the same round.
+
+For every (round, bettor, type, recipient) the expected amount is compared
+with what the ledger holds. A dry run only reports the differences; apply
+mode writes one correcting entry per key under reference_id
+"<round_id>~replay" (reference_type "replay") and credits the difference
+to the recipient's points. A later replay updates that entry in place while
+it is still pending, so repeated runs converge instead of stacking up.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import and_, exists, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.database import async_session
+from app.models.bet_record import BetRecord
+from app.models.commission import CommissionLedger
+from app.models.user import User
+from app.services.commission_cache import get_waterfalls, resolve_policy
+from app.services.commission_engine import calc_amount, credit_points
+from app.services.commission_partitions import first_live_month, month_of
+from app.services.commission_rollup import RollupDeltas, add_delta, apply_rollup, utc_day
+
+logger = logging.getLogger(__name__)
+
+REPLAY_SUFFIX = "~replay"
+
+_ZERO = Decimal("0")
+_MAX_ROUND_ID = 100 - len(REPLAY_SUFFIX)  # reference_id is VARCHAR(100)
+_SETTLE_MARGIN = timedelta(minutes=10)  # leave rounds still in the webhook pipeline alone
+_MAX_SAMPLES = 100
+_TOP_RECIPIENTS = 50
+_UPSERT_CHUNK = 1000
+
+# Key of one commission share: (round_id, bettor_id, type, recipient_id)
+Key = tuple[str, int, str, int]
+
+
+def _new_report(dry_run: bool) -> dict:
+    return {
+        "dry_run": dry_run,
+        "bets_scanned": 0,
+        "rounds_changed": 0,
+        "entries_changed": 0,
+        "total_delta": {"rolling": _ZERO, "losing": _ZERO},
+        "corrections_written": 0,
+        "locked": 0,
+        "skipped_long_round_ids": 0,
+        "recipient_deltas": {},
+        "samples": [],
+    }
+
+
+def _source_amount(bet, commission_type: str) -> Decimal:
+    """Amount the live webhooks would have charged commission on."""
+    if commission_type == "rolling":
+        return bet.bet_amount
+    if bet.status != "settled":
+        return _ZERO
+    return max(bet.bet_amount - bet.win_amount, _ZERO)
+
+
+def first_bets(date_from: datetime, date_to: datetime, game_category: str | None = None):
+    """Bets placed in [date_from, date_to) that are the first of their round for their bettor.
+
+    A round whose first record lies before date_from is left out entirely:
+    it belongs to the replay of that earlier range.
+    """
+    earlier = aliased(BetRecord, name="earlier")
+    stmt = (
+        select(
+            BetRecord.user_id,
+            BetRecord.game_category,
+            BetRecord.round_id,
+            BetRecord.bet_amount,
+            BetRecord.win_amount,
+            BetRecord.status,
+        )
+        .where(
+            BetRecord.bet_at >= date_from,
+            BetRecord.bet_at < date_to,
+            BetRecord.round_id.is_not(None),
+            BetRecord.status.in_(("pending", "settled")),
+            ~exists().where(
+                earlier.round_id == BetRecord.round_id,
+                earlier.user_id == BetRecord.user_id,
+                earlier.status.in_(("pending", "settled")),
+                or_(
+                    earlier.bet_at < BetRecord.bet_at,
+                    and_(earlier.bet_at == BetRecord.bet_at, earlier.id < BetRecord.id),
+                ),
+            ),
+        )
+        .order_by(BetRecord.bet_at, BetRecord.id)
+    )
+    if game_category:
+        stmt = stmt.where(BetRecord.game_category == game_category)
+    return stmt
+
+
+async def _expected_shares(
+    session: AsyncSession,
+    bets: list,
+    types: tuple[str, ...],
+) -> tuple[dict[Key, tuple[int, Decimal, Decimal, Decimal, int | None, str]], set[tuple[str, int, str]]]:
+    """Recompute the waterfall of a chunk with today's rates, tree and policies.
+
+    Returns (expected, covered): expected maps each key to (level, rate,
+    source, amount, policy_id, category); covered is every (round, bettor,
+    type) the chunk is authoritative for, whether or not it earns anything now.
+    """
+    user_ids = list({b.user_id for b in bets})
+    user_stmt = select(User.id, User.commission_enabled, User.commission_type).where(
+        User.id.in_(user_ids)
+    )
+    bettors = {row.id: row for row in (await session.execute(user_stmt)).all()}
+
+    covered: set[tuple[str, int, str]] = set()
+    eligible = []  # (bet, type, source, policy)
+    bettors_by_group: dict[tuple[str, str], set[int]] = {}
+    for b in bets:
+        bettor = bettors.get(b.user_id)
+        for ctype in types:
+            key = (b.round_id, b.user_id, ctype)
+            if key in covered:
+                continue  # first_bets already yields one record per round and bettor
+            covered.add(key)
+            if not bettor or not bettor.commission_enabled or bettor.commission_type != ctype:
+                continue
+            source = _source_amount(b, ctype)
+            if source <= 0:
+                continue
+            policy = await resolve_policy(session, ctype, b.game_category)
+            if policy and b.bet_amount < policy.min_bet_amount:
+                continue
+            eligible.append((b, ctype, source, policy))
+            bettors_by_group.setdefault((b.game_category, ctype), set()).add(b.user_id)
+
+    waterfalls = {
+        (category, ctype): await get_waterfalls(session, list(ids), category, ctype)
+        for (category, ctype), ids in bettors_by_group.items()
+    }
+
+    expected = {}
+    for b, ctype, source, policy in eligible:
+        for level, uid, effective_rate in waterfalls[(b.game_category, ctype)][b.user_id]:
+            amount = calc_amount(source, effective_rate)
+            if amount <= 0:
+                continue
+            expected[(b.round_id, b.user_id, ctype, uid)] = (
+                level, effective_rate, source, amount, policy.id if policy else None, b.game_category,
+            )
+    return expected, covered
+
+
+async def _ledger_state(
+    session: AsyncSession,
+    covered: set[tuple[str, int, str]],
+) -> tuple[dict[Key, tuple[Decimal, int, str | None]], dict[Key, tuple[Decimal, str]]]:
+    """Current ledger amounts for the covered rounds.
+
+    Returns (originals, corrections): originals sums the live entries per key
+    (amount, level, category); corrections holds the replay entry (amount,
+    status, source, created_at).
+    """
+    round_ids = {r for r, _, _ in covered}
+    stmt = select(
+        CommissionLedger.reference_id,
+        CommissionLedger.user_id,
+        CommissionLedger.type,
+        CommissionLedger.recipient_user_id,
+        CommissionLedger.level,
+        CommissionLedger.game_category,
+        CommissionLedger.commission_amount,
+        CommissionLedger.source_amount,
+        CommissionLedger.status,
+        CommissionLedger.created_at,
+    ).where(
+        CommissionLedger.reference_id.in_(
+            [*round_ids, *(f"{r}{REPLAY_SUFFIX}" for r in round_ids)]
+        ),
+        CommissionLedger.user_id.in_({u for _, u, _ in covered}),
+        CommissionLedger.type.in_({t for _, _, t in covered}),
+    )
+
+    originals: dict[Key, tuple[Decimal, int, str | None]] = {}
+    corrections: dict[Key, tuple[Decimal, str, Decimal, datetime]] = {}
+    for row in (await session.execute(stmt)).all():
+        is_replay = row.reference_id.endswith(REPLAY_SUFFIX)
+        round_id = row.reference_id[: -len(REPLAY_SUFFIX)] if is_replay else row.reference_id
+        if (round_id, row.user_id, row.type) not in covered:
+            continue
+        key = (round_id, row.user_id, row.type, row.recipient_user_id)
+        if is_replay:
+            corrections[key] = (row.commission_amount, row.status, row.source_amount, row.created_at)
+        elif row.status != "cancelled":
+            amount, _, _ = originals.get(key, (_ZERO, 0, None))
+            originals[key] = (amount + row.commission_amount, row.level, row.game_category)
+    return originals, corrections
+
+
+async def _write_corrections(
+    session: AsyncSession,
+    rows: list[dict],
+    deltas: dict[Key, tuple[Decimal, Decimal, Decimal | None]],
+) -> tuple[int, int]:
+    """Upsert replay entries (pending ones only), credit the deltas written, update the rollup.
+
+    deltas maps each key to (amount delta, new source, previous correction
+    source or None if there was none). Returns (written, locked): locked counts
+    keys whose replay entry has already been settled and was left untouched.
+    """
+    credits: dict[int, Decimal] = {}
+    rollup: RollupDeltas = {}
+    written = 0
+    for start in range(0, len(rows), _UPSERT_CHUNK):
+        stmt = pg_insert(CommissionLedger).values(rows[start:start + _UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_ledger_idempotency",
+            set_={
+                "level": stmt.excluded.level,
+                "source_amount": stmt.excluded.source_amount,
+                "rate": stmt.excluded.rate,
+                "commission_amount": stmt.excluded.commission_amount,
+                "description": stmt.excluded.description,
+            },
+            where=CommissionLedger.status == "pending",
+        ).returning(
+            CommissionLedger.reference_id,
+            CommissionLedger.user_id,
+            CommissionLedger.type,
+            CommissionLedger.recipient_user_id,
+            CommissionLedger.created_at,
+        )
+        for ref, user_id, ctype, recipient, created_at in (await session.execute(stmt)).all():
+            delta, source, old_source = deltas[(ref[: -len(REPLAY_SUFFIX)], user_id, ctype, recipient)]
+            credits[recipient] = credits.get(recipient, _ZERO) + delta
+            add_delta(
+                rollup, recipient, utc_day(created_at), ctype, "pending",
+                delta, source - (old_source or _ZERO), 0 if old_source is not None else 1,
+            )
+            written += 1
+    await credit_points(session, credits)
+    await apply_rollup(session, rollup)
+    return written, len(rows) - written
+
+
+async def _replay_chunk(
+    session: AsyncSession,
+    bets: list,
+    types: tuple[str, ...],
+    dry_run: bool,
+    report: dict,
+) -> None:
+    expected, covered = await _expected_shares(session, bets, types)
+    originals, corrections = await _ledger_state(session, covered)
+
+    now = datetime.now(timezone.utc)
+    rows: list[dict] = []
+    deltas: dict[Key, tuple[Decimal, Decimal, Decimal | None]] = {}
+    changed_rounds: set[tuple[str, int, str]] = set()
+    for key in expected.keys() | originals.keys() | corrections.keys():
+        round_id, user_id, ctype, recipient = key
+        level, rate, source, amount, policy_id, category = expected.get(
+            key, (None, _ZERO, _ZERO, _ZERO, None, None)
+        )
+        original, orig_level, orig_category = originals.get(key, (_ZERO, 0, None))
+        correction, _, correction_source, correction_at = corrections.get(
+            key, (_ZERO, "pending", None, None)
+        )
+        delta = amount - original - correction
+        if delta == 0:
+            continue
+
+        changed_rounds.add((round_id, user_id, ctype))
+        report["entries_changed"] += 1
+        report["total_delta"][ctype] += delta
+        recipient_deltas = report["recipient_deltas"]
+        recipient_deltas[recipient] = recipient_deltas.get(recipient, _ZERO) + delta
+        if len(report["samples"]) < _MAX_SAMPLES:
+            report["samples"].append({
+                "round_id": round_id,
+                "user_id": user_id,
+                "type": ctype,
+                "recipient_user_id": recipient,
+                "expected": amount,
+                "recorded": original + correction,
+                "delta": delta,
+            })
+
+        if dry_run:
+            continue
+        if len(round_id) > _MAX_ROUND_ID:
+            report["skipped_long_round_ids"] += 1
+            continue
+        deltas[key] = (delta, source, correction_source)
+        level = orig_level if level is None else level
+        # An existing correction keeps its timestamp so the upsert targets its partition
+        created_at = now if correction_at is None else correction_at.replace(tzinfo=timezone.utc)
+        rows.append({
+            "recipient_user_id": recipient,
+            "user_id": user_id,
+            "policy_id": policy_id,
+            "type": ctype,
+            "level": level,
+            "game_category": category or orig_category,
+            "source_amount": source,
+            "rate": rate,
+            "commission_amount": amount - original,
+            "status": "pending",
+            "reference_type": "replay",
+            "reference_id": f"{round_id}{REPLAY_SUFFIX}",
+            "description": f"Replay correction {ctype} L{level} {category or orig_category or ''}".strip(),
+            "created_at": created_at,
+            "ledger_month": month_of(created_at),
+        })
+
+    report["bets_scanned"] += len(bets)
+    report["rounds_changed"] += len(changed_rounds)
+    if rows:
+        written, locked = await _write_corrections(session, rows, deltas)
+        report["corrections_written"] += written
+        report["locked"] += locked
+
+
+async def replay_commissions(
+    date_from: datetime,
+    date_to: datetime,
+    *,
+    dry_run: bool = True,
+    commission_type: str | None = None,
+    game_category: str | None = None,
+    workers: int = 4,
+    chunk_size: int = 2000,
+) -> dict:
+    """Recompute commissions of bets placed in [date_from, date_to).
+
+    One task streams bet_records through a server-side cursor and queues
+    chunks; `workers` tasks recompute them concurrently, each in its own
+    session. In apply mode every chunk commits separately, so an interrupted
+    run can simply be repeated. Returns an aggregate diff report.
+
+    Raises ValueError when the range reaches archived ledger months, whose
+    entries the diff could not see.
+    """
+    async with async_session() as session:
+        live_from = await first_live_month(session)
+    if live_from and month_of(date_from) < live_from:
+        raise ValueError(f"Ledger months before {live_from} are archived; replay from {live_from} on")
+
+    if not dry_run:
+        date_to = min(date_to, datetime.now(timezone.utc) - _SETTLE_MARGIN)
+    types = (commission_type,) if commission_type else ("rolling", "losing")
+
+    stmt = first_bets(date_from, date_to, game_category).execution_options(yield_per=chunk_size)
+
+    report = _new_report(dry_run)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+
+    async def produce() -> None:
+        async with async_session() as session:
+            result = await session.stream(stmt)
+            async for partition in result.partitions():
+                await queue.put(partition)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def consume() -> None:
+        while (bets := await queue.get()) is not None:
+            async with async_session() as session:
+                await _replay_chunk(session, bets, types, dry_run, report)
+                if not dry_run:
+                    await session.commit()
+            logger.info(
+                "Commission replay: %d bets scanned, %d entries changed",
+                report["bets_scanned"], report["entries_changed"],
+            )
+
+    tasks = [asyncio.create_task(produce())]
+    tasks.extend(asyncio.create_task(consume()) for _ in range(workers))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    top = sorted(report["recipient_deltas"].items(), key=lambda kv: abs(kv[1]), reverse=True)
+    report["recipient_deltas"] = [
+        {"recipient_user_id": uid, "delta": delta} for uid, delta in top[:_TOP_RECIPIENTS]
+    ]
+    return report
@@ -0,0 +1,124 @@
+"""Daily commission rollups (commission_rollups).
+
+Every path that inserts ledger rows or changes their amount or status adds
+its deltas here in the same transaction, so the rollup always equals
+GROUP BY (recipient_user_id, UTC day, type, status) over commission_ledger.
+Readers use sum_by_type instead of aggregating raw ledger rows.
+"""
+
+from collections.abc import Iterable
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.commission import CommissionRollup
+from app.services import subtree_stats
+
+_ZERO = Decimal("0")
+_UPSERT_CHUNK = 1000
+
+# (recipient_user_id, day, type, status) -> [amount, source, count]
+RollupDeltas = dict[tuple[int, date, str, str], list]
+
+
+def utc_day(ts: datetime) -> date:
+    """Rollup day of a ledger timestamp (naive values are taken as UTC)."""
+    return ts.astimezone(timezone.utc).date() if ts.tzinfo else ts.date()
+
+
+def add_delta(
+    deltas: RollupDeltas,
+    recipient_user_id: int,
+    day: date,
+    commission_type: str,
+    status: str,
+    amount: Decimal,
+    source: Decimal,
+    count: int,
+) -> None:
+    acc = deltas.setdefault((recipient_user_id, day, commission_type, status), [_ZERO, _ZERO, 0])
+    acc[0] += amount
+    acc[1] += source
+    acc[2] += count
+
+
+def entry_deltas(entries: Iterable) -> RollupDeltas:
+    """Deltas for newly inserted ledger entries (CommissionLedger or rows alike)."""
+    deltas: RollupDeltas = {}
+    for e in entries:
+        add_delta(
+            deltas, e.recipient_user_id, utc_day(e.created_at), e.type, e.status,
+            e.commission_amount, e.source_amount, 1,
+        )
+    return deltas
+
+
+async def apply_rollup(session: AsyncSession, deltas: RollupDeltas) -> None:
+    """Add deltas to the rollup (upsert in key order to keep lock order stable).
+
+    The same deltas feed the recipients' subtree stats at commit.
+    """
+    subtree_stats.record_rollup(session, deltas)
+    rows = [
+        {
+            "recipient_user_id": recipient,
+            "day": day,
+            "type": ctype,
+            "status": status,
+            "total_amount": amount,
+            "source_total": source,
+            "entry_count": count,
+        }
+        for (recipient, day, ctype, status), (amount, source, count) in sorted(deltas.items())
+        if amount or source or count
+    ]
+    for start in range(0, len(rows), _UPSERT_CHUNK):
+        stmt = pg_insert(CommissionRollup).values(rows[start:start + _UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["recipient_user_id", "day", "type", "status"],
+            set_={
+                "total_amount": CommissionRollup.total_amount + stmt.excluded.total_amount,
+                "source_total": CommissionRollup.source_total + stmt.excluded.source_total,
+                "entry_count": CommissionRollup.entry_count + stmt.excluded.entry_count,
+            },
+        )
+        await session.execute(stmt)
+
+
+async def sum_by_type(
+    session: AsyncSession,
+    *,
+    recipient_ids: list[int] | None = None,
+    day_from: date | None = None,
+    day_to: date | None = None,
+    commission_type: str | None = None,
+    status: str | None = None,
+) -> dict[str, tuple[Decimal, Decimal, int]]:
+    """(amount, source, count) per commission type over the filtered rollup rows.
+
+    day_from / day_to are inclusive; None leaves that side open.
+    """
+    stmt = select(
+        CommissionRollup.type,
+        func.sum(CommissionRollup.total_amount),
+        func.sum(CommissionRollup.source_total),
+        func.sum(CommissionRollup.entry_count),
+    ).group_by(CommissionRollup.type)
+    if recipient_ids is not None:
+        stmt = stmt.where(CommissionRollup.recipient_user_id.in_(recipient_ids))
+    if day_from:
+        stmt = stmt.where(CommissionRollup.day >= day_from)
+    if day_to:
+        stmt = stmt.where(CommissionRollup.day <= day_to)
+    if commission_type:
+        stmt = stmt.where(CommissionRollup.type == commission_type)
+    if status:
+        stmt = stmt.where(CommissionRollup.status == status)
+
+    return {
+        ctype: (amount or _ZERO, source or _ZERO, int(count or 0))
+        for ctype, amount, source, count in (await session.execute(stmt)).all()
+    }
@@ -0,0 +1,167 @@
+"""Rate-change impact simulation over historical bets.
+
+Given proposed UserGameRollingRate changes, estimates how much commission
+each recipient would have earned over a date range before and after the
+change. Only bettors in the subtree of a changed user can be affected, so
+only their bets are read.
+
+The waterfall is linear in the source amount, so bets are not loaded row
+by row: Postgres sums them per (bettor, category) in one GROUP BY per
+category, and the waterfall runs once per bettor on those sums. The result
+can differ from the ledger by the per-bet rounding to 0.01.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.bet_record import BetRecord
+from app.models.user import User, UserTree
+from app.services.commission_cache import (
+    compute_waterfall,
+    get_ancestor_chains,
+    get_rates,
+    resolve_policy,
+)
+from app.services.commission_engine import calc_amount
+
+_ZERO = Decimal("0")
+_TYPES = ("rolling", "losing")
+
+
+async def _bettor_sources(
+    session: AsyncSession,
+    changed_user_ids: list[int],
+    game_category: str,
+    date_from: datetime,
+    date_to: datetime,
+) -> dict[str, dict[int, Decimal]]:
+    """Per-type commission source sums of every eligible bettor under the changed users."""
+    mins = {}
+    for ctype in _TYPES:
+        policy = await resolve_policy(session, ctype, game_category)
+        mins[ctype] = policy.min_bet_amount if policy else _ZERO
+
+    subtree = (
+        select(UserTree.descendant_id)
+        .where(UserTree.ancestor_id.in_(changed_user_ids))
+        .distinct()
+        .subquery()
+    )
+    stmt = (
+        select(
+            BetRecord.user_id,
+            User.commission_type,
+            func.coalesce(func.sum(BetRecord.bet_amount).filter(
+                BetRecord.bet_amount >= mins["rolling"],
+            ), 0).label("rolling"),
+            func.coalesce(func.sum(func.greatest(BetRecord.bet_amount - BetRecord.win_amount, 0)).filter(
+                and_(BetRecord.status == "settled", BetRecord.bet_amount >= mins["losing"]),
+            ), 0).label("losing"),
+        )
+        .join(subtree, subtree.c.descendant_id == BetRecord.user_id)
+        .join(User, User.id == BetRecord.user_id)
+        .where(
+            BetRecord.game_category == game_category,
+            BetRecord.bet_at >= date_from,
+            BetRecord.bet_at < date_to,
+            BetRecord.status.in_(("pending", "settled")),
+            User.commission_enabled == True,
+        )
+        .group_by(BetRecord.user_id, User.commission_type)
+    )
+
+    sources: dict[str, dict[int, Decimal]] = {ctype: {} for ctype in _TYPES}
+    for row in (await session.execute(stmt)).all():
+        if row.commission_type in sources:
+            amount = getattr(row, row.commission_type)
+            if amount > 0:
+                sources[row.commission_type][row.user_id] = amount
+    return sources
+
+
+async def simulate_rate_changes(
+    session: AsyncSession,
+    changes: list[dict],
+    date_from: datetime,
+    date_to: datetime,
+) -> dict:
+    """Per-recipient commission before/after the proposed rate changes.
+
+    Each change: user_id, game_category, and rolling_rate and/or losing_rate
+    (None keeps the current rate). Returns totals over the affected bettors and
+    one item per recipient whose commission differs, largest change first.
+    """
+    by_category: dict[str, dict[int, dict[str, Decimal]]] = {}
+    for change in changes:
+        proposed = by_category.setdefault(change["game_category"], {}).setdefault(change["user_id"], {})
+        for ctype in _TYPES:
+            if change.get(f"{ctype}_rate") is not None:
+                proposed[ctype] = change[f"{ctype}_rate"]
+
+    # recipient_id -> [before, after] per type
+    totals: dict[int, dict[str, list[Decimal]]] = {}
+    bettors_scanned = 0
+    for category, proposed in by_category.items():
+        sources = await _bettor_sources(session, list(proposed), category, date_from, date_to)
+        bettor_ids = list(sources["rolling"].keys() | sources["losing"].keys())
+        if not bettor_ids:
+            continue
+        bettors_scanned += len(bettor_ids)
+        chains = {
+            uid: [uid, *chain.active_ids()]
+            for uid, chain in (await get_ancestor_chains(session, bettor_ids)).items()
+        }
+
+        for ctype in _TYPES:
+            if not sources[ctype]:
+                continue
+            members = list({m for uid in sources[ctype] for m in chains[uid]})
+            before_rates = await get_rates(session, members, category, ctype)
+            after_rates = {
+                **before_rates,
+                **{uid: rates[ctype] for uid, rates in proposed.items() if ctype in rates},
+            }
+            for uid, source in sources[ctype].items():
+                for column, rates in ((0, before_rates), (1, after_rates)):
+                    for _, recipient, effective_rate in compute_waterfall(chains[uid], rates):
+                        pair = totals.setdefault(recipient, {}).setdefault(ctype, [_ZERO, _ZERO])
+                        pair[column] += calc_amount(source, effective_rate)
+
+    items = []
+    total_before = total_after = _ZERO
+    for recipient, per_type in totals.items():
+        before = sum((pair[0] for pair in per_type.values()), _ZERO)
+        after = sum((pair[1] for pair in per_type.values()), _ZERO)
+        total_before += before
+        total_after += after
+        if before == after:
+            continue
+        items.append({
+            "recipient_user_id": recipient,
+            "before": before,
+            "after": after,
+            "delta": after - before,
+            "by_type": {
+                ctype: {"before": pair[0], "after": pair[1]} for ctype, pair in per_type.items()
+            },
+        })
+    items.sort(key=lambda item: abs(item["delta"]), reverse=True)
+
+    if items:
+        name_stmt = select(User.id, User.username).where(
+            User.id.in_([item["recipient_user_id"] for item in items])
+        )
+        usernames = dict((await session.execute(name_stmt)).all())
+        for item in items:
+            item["username"] = usernames.get(item["recipient_user_id"])
+
+    return {
+        "bettors_scanned": bettors_scanned,
+        "total_before": total_before,
+        "total_after": total_after,
+        "total_delta": total_after - total_before,
+        "items": items,
+    }
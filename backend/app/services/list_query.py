@@ -0,0 +1,185 @@
+"""Shared filters and pagination for the large list endpoints.
+
+Filters are small builders that return lists of WHERE conditions, so every
+list spells "equals if given", "day range" and "substring search" the same
+way: ``base.where(*equals(...), *day_range(...))``.
+
+Pagination is offset/limit (page, page_size) by default. Passing ``cursor``
+switches an endpoint to keyset mode on (timestamp, id) descending:
+
+- ``cursor=`` (empty) asks for the first page; every response carries
+  ``next_cursor`` for the following one (None on the last page)
+- a page is an index range scan from the cursor however deep it is, where
+  OFFSET reads and discards every row before the page
+- totals and sums are computed for the first page only; later pages return
+  them as None, the client keeps the first page's figures
+
+Totals come from count_total: exact up to EXACT_COUNT_MAX, estimated
+above it, flagged by ``total_is_estimate`` in the response.
+
+Cursors are opaque (base64 of the last row's timestamp and id).
+"""
+
+import base64
+import json
+from datetime import datetime, time, timezone
+
+from sqlalchemy import and_, func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+
+EXACT_COUNT_MAX = 10_000  # totals above this are returned as estimates
+
+# ─── Filters ──────────────────────────────────────────────────────
+
+
+def equals(*pairs) -> list:
+    """column == value for each (column, value) pair whose value is given."""
+    return [column == value for column, value in pairs if value not in (None, "")]
+
+
+def between(column, start: datetime | None = None, end: datetime | None = None) -> list:
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column <= end)
+    return conditions
+
+
+def day_range(column, start_date: str | None, end_date: str | None) -> list:
+    """Whole UTC days from start_date to end_date (YYYY-MM-DD, inclusive)."""
+    start = end = None
+    if start_date:
+        start = datetime.combine(datetime.strptime(start_date, "%Y-%m-%d").date(), time.min, tzinfo=timezone.utc)
+    if end_date:
+        end = datetime.combine(datetime.strptime(end_date, "%Y-%m-%d").date(), time.max, tzinfo=timezone.utc)
+    return between(column, start, end)
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def contains_any(columns, term: str | None) -> list:
+    """Case-insensitive substring match on any of the columns."""
+    if not term:
+        return []
+    pattern = f"%{escape_like(term)}%"
+    return [or_(*(column.ilike(pattern, escape="\\") for column in columns))]
+
+
+# ─── Keyset pagination ────────────────────────────────────────────
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    raw = json.dumps([ts.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int] | None:
+    """(timestamp, id) after which to continue; None for the first page (empty cursor)."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+
+
+def wants_totals(cursor: str | None) -> bool:
+    """Totals are computed in offset mode and for the first keyset page."""
+    return not cursor
+
+
+# ─── Counts ───────────────────────────────────────────────────────
+
+
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, with its bind parameters."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+async def count_rows(session: AsyncSession, base) -> int:
+    return (await session.execute(select(func.count()).select_from(base.subquery()))).scalar() or 0
+
+
+async def estimate_rows(session: AsyncSession, base) -> int:
+    """The planner's row estimate for base (from table statistics, nothing is read)."""
+    plan = (await session.execute(_Explain(base))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def count_total(session: AsyncSession, base) -> tuple[int, bool]:
+    """(total, total_is_estimate) for a list query.
+
+    Filtered queries are counted exactly, reading at most EXACT_COUNT_MAX + 1
+    rows; only when that cap is hit is the planner's estimate returned (never
+    below the cap). Planner estimates of ILIKE and trigram filters can be off
+    by orders of magnitude, so they never decide by themselves. An unfiltered
+    query takes the estimate directly when it is above the cap, which for a
+    whole table is accurate (from its statistics).
+    """
+    if base.whereclause is None:
+        estimate = await estimate_rows(session, base)
+        if estimate > EXACT_COUNT_MAX:
+            return estimate, True
+        return await count_rows(session, base), False
+    count = await count_rows(session, base.limit(EXACT_COUNT_MAX + 1))
+    if count <= EXACT_COUNT_MAX:
+        return count, False
+    return max(await estimate_rows(session, base), count), True
+
+
+async def fetch_page(
+    session: AsyncSession,
+    base,
+    *,
+    ts_column,
+    id_column,
+    page: int,
+    page_size: int,
+    cursor: str | None = None,
+    rank: list | None = None,
+) -> tuple[list, str | None]:
+    """Rows of one page, newest first, and the cursor of the next page.
+
+    Offset mode when cursor is None (next_cursor is then always None); rank
+    orders its pages ahead of the timestamp, keyset pages ignore it. Raises
+    ValueError for a malformed cursor. The first selected entity must carry
+    the ts_column / id_column attributes.
+    """
+    order = (ts_column.desc(), id_column.desc())
+    if cursor is None:
+        stmt = base.order_by(*(rank or ()), *order).offset((page - 1) * page_size).limit(page_size)
+        result = await session.execute(stmt)
+        return result.all(), None
+
+    after = decode_cursor(cursor)
+    stmt = base
+    if after is not None:
+        ts, row_id = after
+        # The plain bound lets a single-column timestamp index drive the scan
+        stmt = stmt.where(and_(ts_column <= ts, tuple_(ts_column, id_column) < tuple_(ts, row_id)))
+    rows = (await session.execute(stmt.order_by(*order).limit(page_size + 1))).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1][0]
+        next_cursor = encode_cursor(getattr(last, ts_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -5,15 +5,23 @@ commission_engine. Settlement serves as a reconciliation/audit batch
 that marks ledger entries as "settled" for accounting purposes.
 """
 
-from datetime import datetime, timezone
+import logging
+from datetime import datetime, time, timezone
 from decimal import Decimal
+from uuid import uuid4
 
-from sqlalchemy import and_, func, select, update
+from sqlalchemy import Integer, and_, case, column, delete, func, insert, select, update, values
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.database import async_session
 from app.models.commission import CommissionLedger
 from app.models.settlement import Settlement
 from app.models.user import User
+from app.services.cache_service import cache_get, cache_set, get_redis
+from app.services.commission_partitions import ledger_period
+from app.services.commission_rollup import RollupDeltas, add_delta, apply_rollup, sum_by_type
+
+logger = logging.getLogger(__name__)
 
 
 async def _check_duplicate_settlement(
@@ -39,6 +47,16 @@ async def _check_duplicate_settlement(
         )
 
 
+def _whole_days(period_start: datetime, period_end: datetime) -> bool:
+    """True when the period covers whole UTC days, so the daily rollup answers it exactly."""
+    return (
+        period_start.tzinfo is None
+        and period_end.tzinfo is None
+        and period_start.time() == time.min
+        and period_end.time() >= time(23, 59, 59)
+    )
+
+
 async def preview_settlement(
     session: AsyncSession,
     recipient_user_id: int,
@@ -49,24 +67,31 @@ async def preview_settlement(
     if not user:
         raise ValueError("User not found")
 
-    base = select(
-        CommissionLedger.type,
-        func.sum(CommissionLedger.commission_amount).label("total"),
-        func.count().label("cnt"),
-    ).where(
-        and_(
-            CommissionLedger.recipient_user_id == recipient_user_id,
-            CommissionLedger.status == "pending",
-            CommissionLedger.created_at >= period_start,
-            CommissionLedger.created_at <= period_end,
-        )
-    ).group_by(CommissionLedger.type)
-
-    result = await session.execute(base)
-    rows = result.all()
-
     totals = {"rolling": Decimal("0"), "losing": Decimal("0")}
     total_entries = 0
+    if _whole_days(period_start, period_end):
+        by_type = await sum_by_type(
+            session,
+            recipient_ids=[recipient_user_id],
+            day_from=period_start.date(),
+            day_to=period_end.date(),
+            status="pending",
+        )
+        rows = [(ctype, amount, count) for ctype, (amount, _, count) in by_type.items()]
+    else:
+        base = select(
+            CommissionLedger.type,
+            func.sum(CommissionLedger.commission_amount).label("total"),
+            func.count().label("cnt"),
+        ).where(
+            and_(
+                CommissionLedger.recipient_user_id == recipient_user_id,
+                CommissionLedger.status == "pending",
+                *ledger_period(CommissionLedger, period_start, period_end),
+            )
+        ).group_by(CommissionLedger.type)
+        rows = (await session.execute(base)).all()
+
     for row in rows:
         if row[0] in totals:
             totals[row[0]] = row[1] or Decimal("0")
@@ -75,12 +100,13 @@ async def preview_settlement(
     gross = sum(totals.values())
 
     return {
-        "recipient_user_id": recipient_user_id,
-        "recipient_username": user.username,
+        "agent_id": recipient_user_id,
+        "agent_username": user.username,
         "period_start": period_start.strftime("%Y-%m-%d"),
         "period_end": period_end.strftime("%Y-%m-%d"),
         "rolling_total": totals["rolling"],
         "losing_total": totals["losing"],
+        "deposit_total": Decimal("0"),
         "gross_total": gross,
         "pending_entries": total_entries,
     }
@@ -103,8 +129,7 @@ async def create_settlement(
                 CommissionLedger.recipient_user_id == recipient_user_id,
                 CommissionLedger.status == "pending",
                 CommissionLedger.settlement_id.is_(None),
-                CommissionLedger.created_at >= period_start,
-                CommissionLedger.created_at <= period_end,
+                *ledger_period(CommissionLedger, period_start, period_end),
             )
         )
         .with_for_update()
@@ -183,7 +208,7 @@ async def reject_settlement(
     settlement.status = "rejected"
     session.add(settlement)
 
-    # Unlink ledger entries
+    # Unlink ledger entries (status stays pending, so the rollup is unchanged)
     stmt = (
         update(CommissionLedger)
         .where(CommissionLedger.settlement_id == settlement_id)
@@ -211,15 +236,265 @@ async def pay_settlement(
         raise ValueError(f"Cannot pay: status is '{settlement.status}'")
 
     now = datetime.now(timezone.utc)
-    stmt = (
+    settled = (
         update(CommissionLedger)
-        .where(CommissionLedger.settlement_id == settlement_id)
+        .where(
+            CommissionLedger.settlement_id == settlement_id,
+            CommissionLedger.status == "pending",
+        )
         .values(status="settled", settled_at=now)
+        .returning(
+            CommissionLedger.recipient_user_id,
+            CommissionLedger.created_at,
+            CommissionLedger.type,
+            CommissionLedger.commission_amount,
+            CommissionLedger.source_amount,
+        )
+        .cte("settled")
     )
-    await session.execute(stmt)
+    day = func.date(settled.c.created_at)  # created_at is stored as naive UTC
+    stmt = select(
+        settled.c.recipient_user_id,
+        day,
+        settled.c.type,
+        func.sum(settled.c.commission_amount),
+        func.sum(settled.c.source_amount),
+        func.count(),
+    ).group_by(settled.c.recipient_user_id, day, settled.c.type)
+
+    # Move the paid entries from the pending to the settled rollup rows
+    rollup: RollupDeltas = {}
+    for recipient, entry_day, ctype, amount, source, count in (await session.execute(stmt)).all():
+        add_delta(rollup, recipient, entry_day, ctype, "pending", -amount, -source, -count)
+        add_delta(rollup, recipient, entry_day, ctype, "settled", amount, source, count)
+    await apply_rollup(session, rollup)
 
     settlement.status = "paid"
     settlement.paid_at = now
     session.add(settlement)
 
     return settlement
+
+
+# ─── Bulk period settlement ───────────────────────────────────────
+
+_BULK_CHUNK = 1000  # recipients per transaction
+_BULK_JOB_TTL = 7 * 86400  # seconds the job progress stays readable
+_BULK_LOCK_KEY = "settlement:bulk:lock"
+_BULK_LOCK_TTL = 600  # seconds; refreshed after every chunk
+
+
+def _pending_in_period(period_start: datetime, period_end: datetime):
+    return and_(
+        CommissionLedger.status == "pending",
+        CommissionLedger.settlement_id.is_(None),
+        *ledger_period(CommissionLedger, period_start, period_end),
+    )
+
+
+async def _settle_chunk(
+    session: AsyncSession,
+    recipient_ids: list[int],
+    period_start: datetime,
+    period_end: datetime,
+    memo: str | None,
+) -> dict:
+    """Create and fill draft settlements for one chunk of recipients.
+
+    Overlaps are checked for the whole chunk in one query. Ledger rows are
+    linked by a single UPDATE ... RETURNING whose output is aggregated in SQL
+    into the settlement totals, so the totals are exactly the linked rows.
+    """
+    overlap_stmt = select(Settlement.agent_id).where(
+        Settlement.agent_id.in_(recipient_ids),
+        Settlement.status.in_(["draft", "confirmed"]),
+        Settlement.period_start <= period_end,
+        Settlement.period_end >= period_start,
+    ).distinct()
+    overlapping = set((await session.execute(overlap_stmt)).scalars().all())
+    eligible = [rid for rid in recipient_ids if rid not in overlapping]
+    if not eligible:
+        return {"created": 0, "overlapping": len(overlapping), "gross": Decimal("0")}
+
+    # Settlement.agent_id is reused to store recipient_user_id
+    now = datetime.now(timezone.utc)
+    created = (await session.execute(
+        insert(Settlement).values([
+            {
+                "uuid": uuid4(),
+                "agent_id": rid,
+                "period_start": period_start,
+                "period_end": period_end,
+                "status": "draft",
+                "memo": memo,
+                "created_at": now,
+            }
+            for rid in eligible
+        ]).returning(Settlement.id, Settlement.agent_id)
+    )).all()
+
+    settle_map = values(
+        column("recipient_id", Integer),
+        column("settlement_id", Integer),
+        name="settle_map",
+    ).data([(agent_id, sid) for sid, agent_id in created])
+    linked = (
+        update(CommissionLedger)
+        .where(
+            CommissionLedger.recipient_user_id == settle_map.c.recipient_id,
+            _pending_in_period(period_start, period_end),
+        )
+        .values(settlement_id=settle_map.c.settlement_id)
+        .returning(
+            CommissionLedger.settlement_id,
+            CommissionLedger.type,
+            CommissionLedger.commission_amount,
+        )
+        .cte("linked")
+    )
+    rolling = func.coalesce(func.sum(case(
+        (linked.c.type == "rolling", linked.c.commission_amount), else_=0,
+    )), 0)
+    losing = func.coalesce(func.sum(case(
+        (linked.c.type == "losing", linked.c.commission_amount), else_=0,
+    )), 0)
+    totals = (
+        select(
+            linked.c.settlement_id,
+            rolling.label("rolling"),
+            losing.label("losing"),
+        )
+        .group_by(linked.c.settlement_id)
+        .cte("totals")
+    )
+    filled = (await session.execute(
+        update(Settlement)
+        .where(Settlement.id == totals.c.settlement_id)
+        .values(
+            rolling_total=totals.c.rolling,
+            losing_total=totals.c.losing,
+            gross_total=totals.c.rolling + totals.c.losing,
+            net_total=totals.c.rolling + totals.c.losing,
+        )
+        .returning(Settlement.id, Settlement.gross_total)
+        .execution_options(synchronize_session=False)
+    )).all()
+
+    # Recipients whose entries were taken by a concurrent settlement in between
+    empty = {sid for sid, _ in created} - {sid for sid, _ in filled}
+    if empty:
+        await session.execute(delete(Settlement).where(Settlement.id.in_(empty)))
+
+    return {
+        "created": len(filled),
+        "overlapping": len(overlapping),
+        "gross": sum((gross for _, gross in filled), Decimal("0")),
+    }
+
+
+async def get_bulk_settlement_job(job_id: str) -> dict | None:
+    return await cache_get(f"settlement_bulk:{job_id}")
+
+
+async def start_bulk_settlement(
+    period_start: datetime,
+    period_end: datetime,
+    memo: str | None,
+    started_by: int,
+) -> dict:
+    """Register a bulk settlement job; run it with run_bulk_settlement(job).
+
+    Only one job runs at a time. Raises ValueError if another one holds the lock.
+    """
+    job = {
+        "job_id": uuid4().hex,
+        "status": "running",
+        "period_start": period_start.isoformat(),
+        "period_end": period_end.isoformat(),
+        "memo": memo,
+        "started_by": started_by,
+        "recipients_total": None,
+        "recipients_done": 0,
+        "settlements_created": 0,
+        "skipped_overlapping": 0,
+        "gross_total": "0",
+        "last_recipient_id": 0,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None,
+        "error": None,
+    }
+    r = await get_redis()
+    if not await r.set(_BULK_LOCK_KEY, job["job_id"], nx=True, ex=_BULK_LOCK_TTL):
+        raise ValueError("Another bulk settlement job is running")
+    await cache_set(f"settlement_bulk:{job['job_id']}", job, ttl=_BULK_JOB_TTL)
+    return job
+
+
+async def run_bulk_settlement(job: dict) -> dict:
+    """Create draft settlements for every recipient with pending entries in the period.
+
+    Recipients are walked in id order, _BULK_CHUNK per committed transaction.
+    Progress (including the last committed recipient id) is stored after every
+    chunk. Rerunning the same period is safe and resumes naturally: recipients
+    already settled have no unlinked entries left and are skipped.
+    """
+    period_start = datetime.fromisoformat(job["period_start"])
+    period_end = datetime.fromisoformat(job["period_end"])
+    key = f"settlement_bulk:{job['job_id']}"
+    gross = Decimal(job["gross_total"])
+
+    try:
+        async with async_session() as session:
+            count_stmt = select(func.count(func.distinct(CommissionLedger.recipient_user_id))).where(
+                _pending_in_period(period_start, period_end),
+            )
+            job["recipients_total"] = (await session.execute(count_stmt)).scalar() or 0
+        await cache_set(key, job, ttl=_BULK_JOB_TTL)
+
+        while True:
+            async with async_session() as session:
+                chunk_stmt = (
+                    select(CommissionLedger.recipient_user_id)
+                    .where(
+                        _pending_in_period(period_start, period_end),
+                        CommissionLedger.recipient_user_id > job["last_recipient_id"],
+                    )
+                    .group_by(CommissionLedger.recipient_user_id)
+                    .order_by(CommissionLedger.recipient_user_id)
+                    .limit(_BULK_CHUNK)
+                )
+                recipient_ids = list((await session.execute(chunk_stmt)).scalars().all())
+                if not recipient_ids:
+                    break
+                result = await _settle_chunk(
+                    session, recipient_ids, period_start, period_end, job["memo"],
+                )
+                await session.commit()
+
+            gross += result["gross"]
+            job["recipients_done"] += len(recipient_ids)
+            job["settlements_created"] += result["created"]
+            job["skipped_overlapping"] += result["overlapping"]
+            job["gross_total"] = str(gross)
+            job["last_recipient_id"] = recipient_ids[-1]
+            await cache_set(key, job, ttl=_BULK_JOB_TTL)
+            await (await get_redis()).expire(_BULK_LOCK_KEY, _BULK_LOCK_TTL)
+            logger.info(
+                "Bulk settlement %s: %d/%s recipients, %d settlements",
+                job["job_id"], job["recipients_done"], job["recipients_total"],
+                job["settlements_created"],
+            )
+
+        job["status"] = "completed"
+    except Exception as e:
+        logger.exception("Bulk settlement %s failed", job["job_id"])
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["finished_at"] = datetime.now(timezone.utc).isoformat()
+        await cache_set(key, job, ttl=_BULK_JOB_TTL)
+        r = await get_redis()
+        if await r.get(_BULK_LOCK_KEY) == job["job_id"].encode():
+            await r.delete(_BULK_LOCK_KEY)
+
+    return job
@@ -0,0 +1,487 @@
+"""Per-node subtree aggregates (user_subtree_stats, agent_subtree_stats).
+
+Writers record deltas on the session instead of touching the aggregates:
+
+- record_user / record_agent: node additions and balance changes
+- record_user(bettors=1): a user's first commission (see credit_points)
+- record_rollup: commission rollup deltas (called from apply_rollup)
+
+At commit the deltas are summed per node and applied in one
+INSERT ... SELECT per tree over the closure table, so a transaction costs one
+statement however many writes it made. Every ancestor-or-self row gets the
+node's delta, except descendant counts, which only strict ancestors take.
+Rows are upserted in ascending id order, the same lock order
+commission_engine uses for points, so concurrent commits queue instead of
+deadlocking on shared ancestors.
+
+Subtree moves shift the moved node's totals from the old ancestors to the
+new ones (shift_user / shift_agent, around the closure update).
+
+reconcile() recomputes every row from users / admin_users and
+commission_rollups and logs how many had drifted. It holds an EXCLUSIVE
+lock on the table while it runs: readers continue, committing writers wait.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import (
+    Integer,
+    Numeric,
+    bindparam,
+    case,
+    column,
+    event,
+    func,
+    literal,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from app.config import settings
+from app.database import async_session
+from app.models.admin_user import AdminUser, AdminUserTree
+from app.models.subtree_stats import AgentSubtreeStats, UserSubtreeStats
+from app.models.user import User, UserTree
+from app.services.cache_service import get_redis
+from app.services.closure_tree import subtree_totals
+
+logger = logging.getLogger(__name__)
+
+_ZERO = Decimal("0")
+_PENDING_KEY = "subtree_stats_pending"
+_LOCK_KEY = "subtree_stats:reconcile:lock"
+_LOCK_TTL = 3600
+
+# Delta slots per user: nodes, bettors, balance, bet, commission, day_bet, day_commission, month_bet, month_commission
+_USER_FIELDS = 9
+_USER_COUNTS = 2  # leading integer slots
+# ... per agent: nodes, balance
+_AGENT_FIELDS = 2
+_AGENT_COUNTS = 1
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+# ─── Recording ────────────────────────────────────────────────────
+
+def _pending(session) -> dict:
+    session = getattr(session, "sync_session", session)
+    pending = session.info.get(_PENDING_KEY)
+    if pending is None:
+        pending = session.info[_PENDING_KEY] = {"day": utc_today(), "user": {}, "agent": {}}
+    return pending
+
+
+def _add(slots: dict[int, list], node_id: int, size: int, counts: int, changes: dict[int, object]) -> None:
+    acc = slots.get(node_id)
+    if acc is None:
+        acc = slots[node_id] = [0] * counts + [_ZERO] * (size - counts)
+    for i, amount in changes.items():
+        acc[i] += amount
+
+
+def record_user(
+    session, user_id: int, *, nodes: int = 0, bettors: int = 0, balance: Decimal = _ZERO
+) -> None:
+    """A user joined the tree (nodes=1), first earned commission with a bet
+    (bettors=1) and/or their balance changed by `balance`."""
+    _add(_pending(session)["user"], user_id, _USER_FIELDS, _USER_COUNTS,
+         {0: nodes, 1: bettors, 2: balance})
+
+
+def record_agent(session, agent_id: int, *, nodes: int = 0, balance: Decimal = _ZERO) -> None:
+    """An agent joined the tree (nodes=1) and/or their balance changed by `balance`."""
+    _add(_pending(session)["agent"], agent_id, _AGENT_FIELDS, _AGENT_COUNTS, {0: nodes, 1: balance})
+
+
+def record_rollup(session, deltas) -> None:
+    """Commission rollup deltas ((recipient, day, type, status) -> [amount, source, count]).
+
+    Every status counts: status moves net out, so only new or corrected
+    amounts change the totals. The day / month buckets take deltas dated in
+    the current UTC day / month.
+    """
+    pending = _pending(session)
+    today = pending["day"]
+    month = today.replace(day=1)
+    for (recipient, day, commission_type, _status), (amount, source, _count) in deltas.items():
+        bet = source if commission_type == "rolling" else _ZERO
+        changes = {3: bet, 4: amount}
+        if day == today:
+            changes.update({5: bet, 6: amount})
+        if day >= month:
+            changes.update({7: bet, 8: amount})
+        _add(pending["user"], recipient, _USER_FIELDS, _USER_COUNTS, changes)
+
+
+# ─── Applying at commit ───────────────────────────────────────────
+
+def _bucket(stored_day, stored, excluded_day, excluded):
+    """Add within the same period, start over in a newer one, ignore older deltas."""
+    return case(
+        (stored_day == excluded_day, stored + excluded),
+        (stored_day > excluded_day, stored),
+        else_=excluded,
+    )
+
+
+def _delta_table(deltas: dict[int, list], names: list[str], counts: int):
+    """Deltas as unnest() of one array per column: a fixed number of bind
+    parameters however many nodes changed (a VALUES list needs one per cell)."""
+    node_ids = sorted(deltas)
+    arrays = [node_ids] + [[deltas[node_id][i] for node_id in node_ids] for i in range(len(names) - 1)]
+    types = [Integer] * (1 + counts) + [Numeric(18, 2)] * (len(names) - 1 - counts)
+    return func.unnest(*(
+        bindparam(name, array, type_=ARRAY(type_)) for name, array, type_ in zip(names, arrays, types, strict=True)
+    )).table_valued(*(column(name, type_) for name, type_ in zip(names, types, strict=True))).render_derived(name="delta")
+
+
+def _apply_users(session: Session, deltas: dict[int, list], day: date) -> None:
+    month = day.replace(day=1)
+    names = ["node_id", "nodes", "bettors", "balance", "bet", "commission",
+             "day_bet", "day_commission", "month_bet", "month_commission"]
+    delta = _delta_table(deltas, names, _USER_COUNTS)
+    per_ancestor = (
+        select(
+            UserTree.ancestor_id,
+            func.sum(case((UserTree.depth > 0, delta.c.nodes), else_=0)),
+            *(func.sum(delta.c[name]) for name in names[2:6]),
+            literal(day),
+            *(func.sum(delta.c[name]) for name in names[6:8]),
+            literal(month),
+            *(func.sum(delta.c[name]) for name in names[8:]),
+            func.now(),
+        )
+        .join(delta, delta.c.node_id == UserTree.descendant_id)
+        .group_by(UserTree.ancestor_id)
+        .order_by(UserTree.ancestor_id)
+    )
+    stmt = pg_insert(UserSubtreeStats).from_select(
+        ["user_id", "descendant_count", "bettor_count", "subtree_balance", "bet_total", "commission_total",
+         "day", "day_bet_amount", "day_commission", "month", "month_bet_amount",
+         "month_commission", "updated_at"],
+        per_ancestor,
+    )
+    s, ex = UserSubtreeStats, stmt.excluded
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "descendant_count": s.descendant_count + ex.descendant_count,
+            "bettor_count": s.bettor_count + ex.bettor_count,
+            "subtree_balance": s.subtree_balance + ex.subtree_balance,
+            "bet_total": s.bet_total + ex.bet_total,
+            "commission_total": s.commission_total + ex.commission_total,
+            "day_bet_amount": _bucket(s.day, s.day_bet_amount, ex.day, ex.day_bet_amount),
+            "day_commission": _bucket(s.day, s.day_commission, ex.day, ex.day_commission),
+            "day": func.greatest(s.day, ex.day),
+            "month_bet_amount": _bucket(s.month, s.month_bet_amount, ex.month, ex.month_bet_amount),
+            "month_commission": _bucket(s.month, s.month_commission, ex.month, ex.month_commission),
+            "month": func.greatest(s.month, ex.month),
+            "updated_at": ex.updated_at,
+        },
+    ))
+
+
+def _apply_agents(session: Session, deltas: dict[int, list]) -> None:
+    delta = _delta_table(deltas, ["node_id", "nodes", "balance"], _AGENT_COUNTS)
+    per_ancestor = (
+        select(
+            AdminUserTree.ancestor_id,
+            func.sum(case((AdminUserTree.depth > 0, delta.c.nodes), else_=0)),
+            func.sum(delta.c.balance),
+            func.now(),
+        )
+        .join(delta, delta.c.node_id == AdminUserTree.descendant_id)
+        .group_by(AdminUserTree.ancestor_id)
+        .order_by(AdminUserTree.ancestor_id)
+    )
+    stmt = pg_insert(AgentSubtreeStats).from_select(
+        ["agent_id", "descendant_count", "subtree_balance", "updated_at"], per_ancestor,
+    )
+    s, ex = AgentSubtreeStats, stmt.excluded
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["agent_id"],
+        set_={
+            "descendant_count": s.descendant_count + ex.descendant_count,
+            "subtree_balance": s.subtree_balance + ex.subtree_balance,
+            "updated_at": ex.updated_at,
+        },
+    ))
+
+
+def _nonzero(deltas: dict[int, list]) -> dict[int, list]:
+    return {node_id: acc for node_id, acc in deltas.items() if any(acc)}
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_pending(session: Session) -> None:
+    if not session.info.get(_PENDING_KEY):
+        return
+    # New closure rows must be in the database before the deltas join them
+    session.flush()
+    pending = session.info.pop(_PENDING_KEY)
+    # Users before agents, like reconcile, so table locks are taken in one order
+    users = _nonzero(pending["user"])
+    if users:
+        _apply_users(session, users, pending["day"])
+    agents = _nonzero(pending["agent"])
+    if agents:
+        _apply_agents(session, agents)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+# ─── Subtree moves ────────────────────────────────────────────────
+
+def _shifted(stats, moved, sign: int, columns: list[str]) -> dict:
+    return {
+        getattr(stats, name): getattr(stats, name) + sign * getattr(moved, name)
+        for name in columns
+    }
+
+
+async def shift_user(session: AsyncSession, user_id: int, sign: int) -> None:
+    """Remove (sign=-1) or add (+1) a user's subtree totals on their strict ancestors.
+
+    Called before and after the closure update of a move; period buckets
+    move only between rows on the same day / month (reconcile fixes the rest).
+    """
+    s = UserSubtreeStats
+    moved = aliased(UserSubtreeStats, name="moved")
+    changes = _shifted(s, moved, sign, ["bettor_count", "subtree_balance", "bet_total", "commission_total"])
+    changes[s.descendant_count] = s.descendant_count + sign * (moved.descendant_count + 1)
+    for day_col, cols in (("day", ["day_bet_amount", "day_commission"]),
+                          ("month", ["month_bet_amount", "month_commission"])):
+        same = getattr(s, day_col) == getattr(moved, day_col)
+        for name in cols:
+            changes[getattr(s, name)] = case(
+                (same, getattr(s, name) + sign * getattr(moved, name)), else_=getattr(s, name),
+            )
+    await session.execute(
+        update(s)
+        .where(
+            moved.user_id == user_id,
+            UserTree.descendant_id == user_id,
+            UserTree.depth > 0,
+            s.user_id == UserTree.ancestor_id,
+        )
+        .values(changes)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def shift_agent(session: AsyncSession, agent_id: int, sign: int) -> None:
+    """shift_user for the agent tree."""
+    s = AgentSubtreeStats
+    moved = aliased(AgentSubtreeStats, name="moved")
+    changes = _shifted(s, moved, sign, ["subtree_balance"])
+    changes[s.descendant_count] = s.descendant_count + sign * (moved.descendant_count + 1)
+    await session.execute(
+        update(s)
+        .where(
+            moved.agent_id == agent_id,
+            AdminUserTree.descendant_id == agent_id,
+            AdminUserTree.depth > 0,
+            s.agent_id == AdminUserTree.ancestor_id,
+        )
+        .values(changes)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# ─── Reading ──────────────────────────────────────────────────────
+
+def user_totals(stats: UserSubtreeStats | None, today: date | None = None) -> dict:
+    """Plain totals of a stats row; past day / month buckets read as zero."""
+    if stats is None:
+        stats = UserSubtreeStats(user_id=0)
+    today = today or utc_today()
+    same_day = stats.day == today
+    same_month = stats.month == today.replace(day=1)
+    return {
+        "descendant_count": stats.descendant_count,
+        "bettor_count": stats.bettor_count,
+        "subtree_balance": stats.subtree_balance,
+        "bet_total": stats.bet_total,
+        "commission_total": stats.commission_total,
+        "day_bet_amount": stats.day_bet_amount if same_day else _ZERO,
+        "day_commission": stats.day_commission if same_day else _ZERO,
+        "month_bet_amount": stats.month_bet_amount if same_month else _ZERO,
+        "month_commission": stats.month_commission if same_month else _ZERO,
+    }
+
+
+async def get_user_totals(session: AsyncSession, user_id: int) -> dict:
+    """Subtree totals of one user: a single-row read."""
+    return user_totals(await session.get(UserSubtreeStats, user_id))
+
+
+async def node_totals(
+    session: AsyncSession, tree: str, node_ids: list[int]
+) -> dict[int, tuple[int, Decimal]]:
+    """(descendant count, subtree balance) per node from the stats rows.
+
+    tree is "user" or "agent". Nodes without a row yet are summed over the
+    closure table instead.
+    """
+    if not node_ids:
+        return {}
+    if tree == "user":
+        model, key, closure, nodes = UserSubtreeStats, UserSubtreeStats.user_id, UserTree, User
+    else:
+        model, key, closure, nodes = AgentSubtreeStats, AgentSubtreeStats.agent_id, AdminUserTree, AdminUser
+    rows = await session.execute(
+        select(key, model.descendant_count, model.subtree_balance).where(key.in_(node_ids))
+    )
+    found = {node_id: (count, balance) for node_id, count, balance in rows.all()}
+    missing = [node_id for node_id in node_ids if node_id not in found]
+    if missing:
+        found.update(await subtree_totals(session, tree=closure, nodes=nodes, node_ids=missing))
+    return found
+
+
+# ─── Reconcile ────────────────────────────────────────────────────
+
+_RECONCILE_USERS = text("""
+    WITH earned AS (
+        SELECT recipient_user_id AS id,
+               sum(source_total) FILTER (WHERE type = 'rolling') AS bet,
+               sum(total_amount) AS commission,
+               sum(source_total) FILTER (WHERE type = 'rolling' AND day = :day) AS day_bet,
+               sum(total_amount) FILTER (WHERE day = :day) AS day_commission,
+               sum(source_total) FILTER (WHERE type = 'rolling' AND day >= :month) AS month_bet,
+               sum(total_amount) FILTER (WHERE day >= :month) AS month_commission
+        FROM commission_rollups
+        GROUP BY recipient_user_id
+    ), node AS (
+        SELECT u.id, u.balance, (u.first_commission_at IS NOT NULL)::int AS bettor,
+               coalesce(e.bet, 0) AS bet, coalesce(e.commission, 0) AS commission,
+               coalesce(e.day_bet, 0) AS day_bet, coalesce(e.day_commission, 0) AS day_commission,
+               coalesce(e.month_bet, 0) AS month_bet, coalesce(e.month_commission, 0) AS month_commission
+        FROM users u LEFT JOIN earned e ON e.id = u.id
+    )
+    INSERT INTO user_subtree_stats AS s (
+        user_id, descendant_count, bettor_count, subtree_balance, bet_total, commission_total,
+        day, day_bet_amount, day_commission, month, month_bet_amount, month_commission, updated_at
+    )
+    SELECT t.ancestor_id, count(*) - 1, sum(n.bettor), sum(n.balance), sum(n.bet), sum(n.commission),
+           :day, sum(n.day_bet), sum(n.day_commission),
+           :month, sum(n.month_bet), sum(n.month_commission), now()
+    FROM user_tree t JOIN node n ON n.id = t.descendant_id
+    GROUP BY t.ancestor_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        descendant_count = EXCLUDED.descendant_count,
+        bettor_count = EXCLUDED.bettor_count,
+        subtree_balance = EXCLUDED.subtree_balance,
+        bet_total = EXCLUDED.bet_total,
+        commission_total = EXCLUDED.commission_total,
+        day = EXCLUDED.day,
+        day_bet_amount = EXCLUDED.day_bet_amount,
+        day_commission = EXCLUDED.day_commission,
+        month = EXCLUDED.month,
+        month_bet_amount = EXCLUDED.month_bet_amount,
+        month_commission = EXCLUDED.month_commission,
+        updated_at = EXCLUDED.updated_at
+    WHERE (s.descendant_count, s.bettor_count, s.subtree_balance, s.bet_total, s.commission_total,
+           CASE WHEN s.day = :day THEN s.day_bet_amount ELSE 0 END,
+           CASE WHEN s.day = :day THEN s.day_commission ELSE 0 END,
+           CASE WHEN s.month = :month THEN s.month_bet_amount ELSE 0 END,
+           CASE WHEN s.month = :month THEN s.month_commission ELSE 0 END)
+        IS DISTINCT FROM
+          (EXCLUDED.descendant_count, EXCLUDED.bettor_count, EXCLUDED.subtree_balance, EXCLUDED.bet_total,
+           EXCLUDED.commission_total, EXCLUDED.day_bet_amount, EXCLUDED.day_commission,
+           EXCLUDED.month_bet_amount, EXCLUDED.month_commission)
+    RETURNING s.user_id
+""")
+
+_RECONCILE_AGENTS = text("""
+    INSERT INTO agent_subtree_stats AS s (agent_id, descendant_count, subtree_balance, updated_at)
+    SELECT t.ancestor_id, count(*) - 1, sum(a.balance), now()
+    FROM admin_user_tree t JOIN admin_users a ON a.id = t.descendant_id
+    GROUP BY t.ancestor_id
+    ON CONFLICT (agent_id) DO UPDATE SET
+        descendant_count = EXCLUDED.descendant_count,
+        subtree_balance = EXCLUDED.subtree_balance,
+        updated_at = EXCLUDED.updated_at
+    WHERE (s.descendant_count, s.subtree_balance)
+        IS DISTINCT FROM (EXCLUDED.descendant_count, EXCLUDED.subtree_balance)
+    RETURNING s.agent_id
+""")
+
+
+async def reconcile() -> dict:
+    """Recompute both tables from source rows; returns the number of corrected rows."""
+    today = utc_today()
+    corrected = {}
+    for table, stmt in (("user_subtree_stats", _RECONCILE_USERS),
+                        ("agent_subtree_stats", _RECONCILE_AGENTS)):
+        started = time.perf_counter()
+        async with async_session() as session:
+            # Committing writers wait; their deltas land on the recomputed rows
+            await session.execute(text(f"LOCK TABLE {table} IN EXCLUSIVE MODE"))
+            result = await session.execute(
+                stmt, {"day": today, "month": today.replace(day=1)},
+            )
+            corrected[table] = len(result.all())
+            await session.commit()
+        level = logging.WARNING if corrected[table] else logging.INFO
+        logger.log(level, "Reconciled %s: %d rows corrected in %.1fs",
+                   table, corrected[table], time.perf_counter() - started)
+    return corrected
+
+
+_stop: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+
+
+async def _reconcile_loop(stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(stop.wait(), timeout=settings.SUBTREE_STATS_RECONCILE_INTERVAL)
+        if stop.is_set():
+            break
+        try:
+            r = await get_redis()
+            if await r.set(_LOCK_KEY, "1", nx=True, ex=_LOCK_TTL):
+                try:
+                    await reconcile()
+                finally:
+                    await r.delete(_LOCK_KEY)
+        except Exception:
+            logger.exception("Subtree stats reconcile failed")
+
+
+def start_reconcile() -> None:
+    """Start the periodic reconcile task (called from the app lifespan)."""
+    global _stop, _task
+    if _task is not None or settings.SUBTREE_STATS_RECONCILE_INTERVAL <= 0:
+        return
+    _stop = asyncio.Event()
+    _task = asyncio.create_task(_reconcile_loop(_stop))
+
+
+async def stop_reconcile() -> None:
+    global _task
+    if _stop is not None:
+        _stop.set()
+    if _task is not None:
+        try:
+            await asyncio.wait_for(_task, timeout=5)
+        except TimeoutError:
+            _task.cancel()
+        _task = None
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.transaction import Transaction
 from app.models.user import User
+from app.services import subtree_stats
 
 
 async def create_deposit(
@@ -88,10 +89,12 @@ async def approve_transaction(session: AsyncSession, tx_id: int, admin_id: int)
 
     if tx.action == "credit":
         user.balance += tx.amount
+        subtree_stats.record_user(session, user.id, balance=tx.amount)
     elif tx.action == "debit":
         if user.balance < tx.amount:
             raise ValueError(f"Insufficient balance: {user.balance} < {tx.amount}")
         user.balance -= tx.amount
+        subtree_stats.record_user(session, user.id, balance=-tx.amount)
 
     tx.balance_after = user.balance
     tx.status = "approved"
@@ -141,10 +144,12 @@ async def create_adjustment(
 
     if action == "credit":
         user.balance += amount
+        subtree_stats.record_user(session, user.id, balance=amount)
     elif action == "debit":
         if user.balance < amount:
             raise ValueError(f"Insufficient balance: {user.balance} < {amount}")
         user.balance -= amount
+        subtree_stats.record_user(session, user.id, balance=-amount)
 
     tx = Transaction(
         user_id=user_id,
@@ -1,9 +1,11 @@
 """Closure Table operations for agent hierarchy."""
 
-from sqlalchemy import and_, delete, func, select
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.admin_user import AdminUser, AdminUserTree
+from app.services import subtree_stats
+from app.services.closure_tree import children_page, move_subtree
 
 
 async def insert_node(session: AsyncSession, user_id: int, parent_id: int | None) -> None:
@@ -24,6 +26,9 @@ async def insert_node(session: AsyncSession, user_id: int, parent_id: int | None
                 depth=anc.depth + 1,
             ))
 
+    node = await session.get(AdminUser, user_id)
+    subtree_stats.record_agent(session, user_id, nodes=1, balance=node.balance if node else 0)
+
 
 async def get_descendants(
     session: AsyncSession, user_id: int, max_depth: int | None = None
@@ -116,61 +121,48 @@ async def get_subtree_for_tree_view(session: AsyncSession, root_id: int) -> list
     ]
 
 
-async def move_node(session: AsyncSession, node_id: int, new_parent_id: int) -> None:
-    """Move a node (and its subtree) to a new parent.
-    1. Delete old ancestor links (except subtree-internal ones)
-    2. Insert new ancestor links via new parent"""
-
-    # Get all descendants (including self) of the node being moved
-    sub_stmt = select(AdminUserTree.descendant_id).where(
-        AdminUserTree.ancestor_id == node_id
+async def get_children_page(
+    session: AsyncSession, user_id: int, cursor: int | None = None, limit: int = 50
+) -> tuple[list[dict], int | None]:
+    """One page of direct children with subtree totals, for expand-on-demand tree views."""
+    children, next_cursor = await children_page(
+        session, nodes=AdminUser, parent_column=AdminUser.parent_id,
+        node_id=user_id, cursor=cursor, limit=limit,
     )
-    sub_result = await session.execute(sub_stmt)
-    subtree_ids = [r[0] for r in sub_result.all()]
-
-    # Delete links from ancestors OUTSIDE the subtree to nodes INSIDE the subtree
-    del_stmt = delete(AdminUserTree).where(
-        and_(
-            AdminUserTree.descendant_id.in_(subtree_ids),
-            AdminUserTree.ancestor_id.notin_(subtree_ids),
-        )
+    totals = await subtree_stats.node_totals(session, "agent", [c.id for c in children])
+    items = []
+    for u in children:
+        count, balance = totals.get(u.id, (0, u.balance))
+        items.append({
+            "id": u.id,
+            "username": u.username,
+            "agent_code": u.agent_code,
+            "role": u.role,
+            "status": u.status,
+            "depth": u.depth,
+            "parent_id": u.parent_id,
+            "balance": float(u.balance),
+            "descendant_count": count,
+            "subtree_balance": float(balance),
+            "has_children": count > 0,
+        })
+    return items, next_cursor
+
+
+async def move_node(session: AsyncSession, node_id: int, new_parent_id: int) -> int:
+    """Move a node (and its subtree) to a new parent; returns the subtree size.
+
+    Runs as a fixed number of set-based statements (see closure_tree).
+    Raises ValueError on a missing node or a circular move."""
+    return await move_subtree(
+        session,
+        tree=AdminUserTree,
+        nodes=AdminUser,
+        parent_column=AdminUser.parent_id,
+        node_id=node_id,
+        new_parent_id=new_parent_id,
+        shift_totals=subtree_stats.shift_agent,
     )
-    await session.execute(del_stmt)
-
-    # Get all ancestors of the new parent (including self-reference)
-    anc_stmt = select(AdminUserTree).where(AdminUserTree.descendant_id == new_parent_id)
-    anc_result = await session.execute(anc_stmt)
-    new_ancestors = anc_result.scalars().all()
-
-    # Get subtree internal links (node_id as ancestor)
-    internal_stmt = select(AdminUserTree).where(AdminUserTree.ancestor_id == node_id)
-    internal_result = await session.execute(internal_stmt)
-    internal_links = internal_result.scalars().all()
-
-    # Create cross-product: new_ancestor × subtree_descendant
-    for anc in new_ancestors:
-        for link in internal_links:
-            session.add(AdminUserTree(
-                ancestor_id=anc.ancestor_id,
-                descendant_id=link.descendant_id,
-                depth=anc.depth + 1 + link.depth,
-            ))
-
-    # Update depth and parent_id on AdminUser records
-    node = await session.get(AdminUser, node_id)
-    new_parent = await session.get(AdminUser, new_parent_id)
-    depth_diff = new_parent.depth + 1 - node.depth
-    node.parent_id = new_parent_id
-    node.depth = new_parent.depth + 1
-    session.add(node)
-
-    # Update depth for all subtree descendants
-    for sid in subtree_ids:
-        if sid == node_id:
-            continue
-        desc = await session.get(AdminUser, sid)
-        desc.depth += depth_diff
-        session.add(desc)
 
 
 async def is_ancestor(session: AsyncSession, ancestor_id: int, descendant_id: int) -> bool:
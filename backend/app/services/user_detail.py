@@ -0,0 +1,94 @@
+"""User detail loading for GET /users/{id}/detail.
+
+The detail view shows a member with their referrer, direct referral count,
+wallet addresses, betting permissions, null-betting configs and rolling
+rates. It is opened on every row click of the admin user list, so all of it
+is read with one statement: the user row plus one correlated subquery per
+part, the child tables aggregated to JSON arrays (each an index lookup on
+user_id). One round trip whatever the member has configured.
+"""
+
+from sqlalchemy import JSON, String, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User, UserTree
+from app.models.user_betting_permission import UserBettingPermission
+from app.models.user_game_rolling_rate import UserGameRollingRate
+from app.models.user_null_betting_config import UserNullBettingConfig
+from app.models.user_wallet_address import UserWalletAddress
+
+
+class UserDetail:
+    __slots__ = (
+        "betting_permissions",
+        "direct_referral_count",
+        "game_rolling_rates",
+        "null_betting_configs",
+        "referrer_username",
+        "user",
+        "wallet_addresses",
+    )
+
+    def __init__(self, row):
+        (
+            self.user,
+            self.referrer_username,
+            self.direct_referral_count,
+            self.wallet_addresses,
+            self.betting_permissions,
+            self.null_betting_configs,
+            self.game_rolling_rates,
+        ) = row
+
+
+def _rows_json(model, **fields):
+    """The user's rows of model as a JSON array of {field: value} objects, by id."""
+    pairs = []
+    for name, column in fields.items():
+        pairs += [literal_column(f"'{name}'"), column]
+    rows = func.json_agg(aggregate_order_by(func.json_build_object(*pairs), model.id))
+    return (
+        select(func.coalesce(rows, literal_column("'[]'::json"), type_=JSON))
+        .where(model.user_id == User.id)
+        .scalar_subquery()
+    )
+
+
+def detail_statement(user_id: int):
+    referrer = User.__table__.alias("referrer")
+    referrer_username = (
+        select(referrer.c.username).where(referrer.c.id == User.referrer_id).scalar_subquery()
+    )
+    direct_referral_count = (
+        select(func.count())
+        .select_from(UserTree)
+        .where(UserTree.ancestor_id == User.id, UserTree.depth == 1)
+        .scalar_subquery()
+    )
+    w, bp, nbc, grr = UserWalletAddress, UserBettingPermission, UserNullBettingConfig, UserGameRollingRate
+    return select(
+        User,
+        referrer_username,
+        direct_referral_count,
+        _rows_json(
+            w, id=w.id, coin_type=w.coin_type, network=w.network, address=w.address,
+            label=w.label, is_primary=w.is_primary, status=w.status,
+        ),
+        _rows_json(bp, id=bp.id, game_category=bp.game_category, is_allowed=bp.is_allowed),
+        _rows_json(
+            nbc, id=nbc.id, game_category=nbc.game_category,
+            every_n_bets=nbc.every_n_bets, inherit_to_children=nbc.inherit_to_children,
+        ),
+        # Rates as text so they come back as exact decimals, not JSON floats
+        _rows_json(
+            grr, id=grr.id, game_category=grr.game_category,
+            provider=grr.provider, rolling_rate=cast(grr.rolling_rate, String),
+        ),
+    ).where(User.id == user_id)
+
+
+async def load_user_detail(session: AsyncSession, user_id: int) -> UserDetail | None:
+    """Everything the detail view shows, in one query; None if there is no such user."""
+    row = (await session.execute(detail_statement(user_id))).first()
+    return UserDetail(row) if row is not None else None
@@ -0,0 +1,478 @@
+"""Bulk user import from CSV / JSONL with in-memory closure construction.
+
+Built for onboarding a migrated operator (up to millions of users) in one
+transaction:
+
+1. parse and check every row, collecting errors instead of stopping at the first
+2. resolve referrers: earlier rows of the file or existing users
+3. order the rows parents-first (breadth-first from the roots; rows left
+   unreached sit on a referrer cycle)
+4. validate losing / rolling rates against the referrer in that same pass
+5. allocate ids from the users sequence, then COPY users, user_tree,
+   user_game_rolling_rates and user_subtree_stats; the closure rows are
+   generated while streaming, never held as a list
+6. update the existing referrers' ranks and subtree stats with a few
+   set-based statements
+
+Nothing is written unless the whole file is valid. The caller commits and
+then drops the tree index (user_tree_index.invalidate).
+"""
+
+import csv
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import Integer, String, any_, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User, UserTree
+from app.models.user_game_rolling_rate import UserGameRollingRate
+from app.services.commission_engine import LOSING_MAX_RATE, ROLLING_MAX_RATES
+
+logger = logging.getLogger(__name__)
+
+_MAX_ERRORS = 100
+_LOOKUP_CHUNK = 50_000
+_ROLLING_PREFIX = "rolling_"
+_TEXT_FIELDS = {"nickname": 50, "real_name": 100, "phone": 20, "email": 255, "memo": None}
+_COMMISSION_TYPES = ("rolling", "losing")
+_NONE = -1
+
+
+class UserImportError(ValueError):
+    """The file has invalid rows; errors lists them as "line N: message"."""
+
+    def __init__(self, errors: list[str]):
+        super().__init__(f"{len(errors)} invalid rows (first: {errors[0]})")
+        self.errors = errors
+
+
+# ─── Readers ──────────────────────────────────────────────────────
+
+def read_csv(lines: Iterable[str]) -> Iterator[dict]:
+    """CSV rows with a header; rolling rates as rolling_<category> columns."""
+    for row in csv.DictReader(lines):
+        rates = {
+            key[len(_ROLLING_PREFIX):]: value
+            for key, value in row.items()
+            if key and key.startswith(_ROLLING_PREFIX) and value not in (None, "")
+        }
+        row = {k: v for k, v in row.items() if k and not k.startswith(_ROLLING_PREFIX)}
+        if rates:
+            row["rolling_rates"] = rates
+        yield row
+
+
+def read_jsonl(lines: Iterable[str]) -> Iterator[dict]:
+    """One JSON object per line; rolling rates as {"rolling_rates": {category: rate}}."""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+# ─── Parsed batch ─────────────────────────────────────────────────
+
+class _Batch:
+    """Parallel per-row lists; row i is the i-th accepted line of the file."""
+
+    __slots__ = (
+        "children", "commission_type", "depth", "errors", "ext_parent", "fields",
+        "index", "level", "line", "losing_rate", "parent", "rates", "referrer", "username",
+    )
+
+    def __init__(self):
+        self.index: dict[str, int] = {}
+        self.username: list[str] = []
+        self.referrer: list[str | None] = []
+        self.line: list[int] = []
+        self.fields: list[tuple] = []  # nickname, real_name, phone, email, memo
+        self.level: list[int] = []
+        self.commission_type: list[str] = []
+        self.losing_rate: list[Decimal] = []
+        self.rates: list[dict[str, Decimal] | None] = []
+        self.parent: list[int] = []  # row index of an in-file referrer, or _NONE
+        self.ext_parent: list[int | None] = []  # users.id of an existing referrer
+        self.children: list[list[int]] = []
+        self.depth: list[int] = []
+        self.errors: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.username)
+
+    def error(self, line: int, message: str) -> None:
+        if len(self.errors) < _MAX_ERRORS:
+            self.errors.append(f"line {line}: {message}")
+
+
+def _decimal(value, name: str) -> Decimal:
+    try:
+        result = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"{name} is not a number: {value!r}") from None
+    if not result.is_finite() or result < 0:
+        raise ValueError(f"{name} must be a non-negative number")
+    return result
+
+
+def _parse(rows: Iterable[dict]) -> _Batch:
+    batch = _Batch()
+    for line, raw in enumerate(rows, start=1):
+        try:
+            username = str(raw.get("username") or "").strip()
+            if not 2 <= len(username) <= 50:
+                raise ValueError("username must be 2-50 characters")
+            if username in batch.index:
+                raise ValueError(f"duplicate username {username!r} (line {batch.line[batch.index[username]]})")
+            referrer = str(raw.get("referrer_code") or "").strip() or None
+            if referrer == username:
+                raise ValueError("user cannot refer themselves")
+
+            fields = []
+            for name, max_length in _TEXT_FIELDS.items():
+                value = raw.get(name)
+                value = str(value).strip() if value not in (None, "") else None
+                if value and max_length and len(value) > max_length:
+                    raise ValueError(f"{name} longer than {max_length} characters")
+                fields.append(value)
+
+            level = int(raw.get("level") or 1)
+            if not 1 <= level <= 99:
+                raise ValueError("level must be 1-99")
+            commission_type = str(raw.get("commission_type") or "rolling")
+            if commission_type not in _COMMISSION_TYPES:
+                raise ValueError(f"commission_type must be one of {', '.join(_COMMISSION_TYPES)}")
+            losing_rate = _decimal(raw.get("losing_rate") or 0, "losing_rate")
+            if losing_rate > LOSING_MAX_RATE:
+                raise ValueError(f"losing_rate is at most {LOSING_MAX_RATE}%")
+
+            rates = None
+            if raw.get("rolling_rates"):
+                rates = {}
+                for category, value in dict(raw["rolling_rates"]).items():
+                    if category not in ROLLING_MAX_RATES:
+                        raise ValueError(f"unknown game category {category!r}")
+                    rate = _decimal(value, f"rolling rate for {category}")
+                    if rate > ROLLING_MAX_RATES[category]:
+                        raise ValueError(f"{category} rolling rate is at most {ROLLING_MAX_RATES[category]}%")
+                    rates[category] = rate
+        except (TypeError, ValueError) as e:
+            batch.error(line, str(e))
+            continue
+
+        batch.index[username] = len(batch.username)
+        batch.username.append(username)
+        batch.referrer.append(referrer)
+        batch.line.append(line)
+        batch.fields.append(tuple(fields))
+        batch.level.append(level)
+        batch.commission_type.append(commission_type)
+        batch.losing_rate.append(losing_rate)
+        batch.rates.append(rates)
+    return batch
+
+
+# ─── Referrers, order and rates ───────────────────────────────────
+
+async def _existing(session: AsyncSession, columns, names: list[str]) -> list:
+    """Rows of users whose username is in names, in chunks of one array parameter each."""
+    found = []
+    for start in range(0, len(names), _LOOKUP_CHUNK):
+        chunk = bindparam("names", names[start:start + _LOOKUP_CHUNK], type_=ARRAY(String))
+        found.extend((await session.execute(
+            select(*columns).where(User.username == any_(chunk))
+        )).all())
+    return found
+
+
+async def _resolve(session: AsyncSession, batch: _Batch) -> dict[int, tuple]:
+    """Link rows to referrers; returns {users.id: (depth, losing_rate, rates)} of existing referrers."""
+    for (username,) in await _existing(session, [User.username], batch.username):
+        i = batch.index[username]
+        batch.error(batch.line[i], f"username {username!r} already exists")
+
+    external_names = sorted({r for r in batch.referrer if r is not None and r not in batch.index})
+    external = {
+        username: (uid, depth, losing_rate)
+        for username, uid, depth, losing_rate in await _existing(
+            session, [User.username, User.id, User.depth, User.losing_rate], external_names,
+        )
+    }
+    ext_ids = [uid for uid, _, _ in external.values()]
+    ext_rates: dict[int, dict[str, Decimal]] = {}
+    if ext_ids:
+        ids = bindparam("ids", ext_ids, type_=ARRAY(Integer))
+        rate_rows = await session.execute(
+            select(UserGameRollingRate.user_id, UserGameRollingRate.game_category,
+                   UserGameRollingRate.rolling_rate)
+            .where(UserGameRollingRate.user_id == any_(ids), UserGameRollingRate.provider.is_(None))
+        )
+        for uid, category, rate in rate_rows.all():
+            ext_rates.setdefault(uid, {})[category] = rate
+
+    _link(batch, {username: uid for username, (uid, _, _) in external.items()})
+    return {
+        uid: (depth, losing_rate, ext_rates.get(uid, {}))
+        for uid, depth, losing_rate in external.values()
+    }
+
+
+def _link(batch: _Batch, existing: dict[str, int]) -> None:
+    """Point each row at its referrer: a row of the file or an existing user id."""
+    batch.children = [[] for _ in range(len(batch))]
+    for i, referrer in enumerate(batch.referrer):
+        parent, ext_parent = _NONE, None
+        if referrer is not None:
+            if referrer in batch.index:
+                parent = batch.index[referrer]
+                batch.children[parent].append(i)
+            elif referrer in existing:
+                ext_parent = existing[referrer]
+            else:
+                batch.error(batch.line[i], f"referrer {referrer!r} not found")
+        batch.parent.append(parent)
+        batch.ext_parent.append(ext_parent)
+
+
+def _order(batch: _Batch, external: dict[int, tuple]) -> list[int]:
+    """Rows parents-first, with depths; checks rates against the referrer on the way."""
+    batch.depth = [0] * len(batch)
+    queue = deque(i for i in range(len(batch)) if batch.parent[i] == _NONE)
+    order = []
+    while queue:
+        i = queue.popleft()
+        order.append(i)
+        p = batch.parent[i]
+        if p != _NONE:
+            batch.depth[i] = batch.depth[p] + 1
+            parent_losing, parent_rates = batch.losing_rate[p], batch.rates[p] or {}
+        elif batch.ext_parent[i] is not None:
+            ext_depth, parent_losing, parent_rates = external[batch.ext_parent[i]]
+            batch.depth[i] = ext_depth + 1
+        else:
+            parent_losing, parent_rates = None, {}
+
+        if parent_losing is not None and batch.losing_rate[i] > parent_losing:
+            batch.error(batch.line[i], f"losing_rate above the referrer's ({parent_losing}%)")
+        for category, rate in (batch.rates[i] or {}).items():
+            if category in parent_rates and rate > parent_rates[category]:
+                batch.error(
+                    batch.line[i],
+                    f"{category} rolling rate above the referrer's ({parent_rates[category]}%)",
+                )
+        queue.extend(batch.children[i])
+
+    if len(order) < len(batch):
+        reached = set(order)
+        for i in range(len(batch)):
+            if i not in reached:
+                batch.error(batch.line[i], "referrer chain forms a cycle")
+    return order
+
+
+# ─── Loading ──────────────────────────────────────────────────────
+
+async def _copy(session: AsyncSession, table: str, columns: list[str], records) -> None:
+    """COPY records into table on the session's connection (same transaction)."""
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(table, columns=columns, records=records)
+
+
+def _user_defaults() -> dict:
+    """Scalar column defaults of User for the columns the import does not set."""
+    defaults = {}
+    for column in User.__table__.columns:
+        if column.default is not None and column.default.is_scalar:
+            defaults[column.name] = column.default.arg
+        elif column.nullable:
+            defaults[column.name] = None
+    return defaults
+
+
+def _ranks(batch: _Batch) -> list[str]:
+    """Ranks the promotion rules give each row from its in-file descendants."""
+    ranks = []
+    for i in range(len(batch)):
+        kids = batch.children[i]
+        if any(batch.children[c] for c in kids):
+            ranks.append("sub_hq")
+        elif kids:
+            ranks.append("distributor")
+        else:
+            ranks.append("agency")
+    return ranks
+
+
+def _closure(batch: _Batch, ids: list[int], order: list[int], ext_chains: dict[int, list]) -> Iterator[tuple]:
+    """(ancestor_id, descendant_id, depth) rows: in-file ancestors, then the existing chain."""
+    for i in order:
+        uid = ids[i]
+        yield (uid, uid, 0)
+        top, p, distance = i, batch.parent[i], 1
+        while p != _NONE:
+            yield (ids[p], uid, distance)
+            top, p, distance = p, batch.parent[p], distance + 1
+        ext = batch.ext_parent[top]
+        if ext is not None:
+            for ancestor_id, ext_distance in ext_chains[ext]:
+                yield (ancestor_id, uid, distance + ext_distance)
+
+
+async def import_users(session: AsyncSession, rows: Iterable[dict], *, dry_run: bool = False) -> dict:
+    """Validate and load rows (see read_csv / read_jsonl); returns counts and phase timings.
+
+    Raises UserImportError if any row is invalid; nothing is written then.
+    """
+    timings: dict[str, float] = {}
+    started = mark = time.perf_counter()
+
+    def phase(name: str) -> None:
+        nonlocal mark
+        now = time.perf_counter()
+        timings[name] = round(now - mark, 3)
+        mark = now
+
+    batch = _parse(rows)
+    phase("parse")
+    external = await _resolve(session, batch)
+    phase("resolve")
+    order = _order(batch, external)
+    phase("validate")
+    if batch.errors:
+        raise UserImportError(batch.errors)
+    n = len(batch)
+    result = {"users": n, "existing_referrers": len(external), "max_depth": max(batch.depth, default=0)}
+    if dry_run or not n:
+        result["timings"] = timings
+        return result
+
+    ids = list((await session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('users', 'id')) FROM generate_series(1, :n)"),
+        {"n": n},
+    )).scalars().all())
+    phase("allocate_ids")
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    defaults = _user_defaults()
+    ranks = _ranks(batch)
+    user_columns = [
+        "id", "uuid", "username", "nickname", "real_name", "phone", "email", "memo",
+        "referrer_id", "depth", "rank", "level", "commission_type", "losing_rate",
+        "created_at", "updated_at",
+    ]
+    rest = [name for name in defaults if name not in user_columns]
+    rest_values = tuple(defaults[name] for name in rest)
+
+    def user_records() -> Iterator[tuple]:
+        for i in order:
+            p = batch.parent[i]
+            yield (
+                ids[i], uuid.uuid4(), batch.username[i], *batch.fields[i],
+                ids[p] if p != _NONE else batch.ext_parent[i], batch.depth[i], ranks[i],
+                batch.level[i], batch.commission_type[i], batch.losing_rate[i], now, now,
+                *rest_values,
+            )
+
+    await _copy(session, "users", user_columns + rest, user_records())
+    phase("copy_users")
+
+    ext_ids = sorted(external)
+    ext_chains: dict[int, list] = {uid: [] for uid in ext_ids}
+    if ext_ids:
+        chain_rows = await session.execute(
+            select(UserTree.descendant_id, UserTree.ancestor_id, UserTree.depth)
+            .where(UserTree.descendant_id == any_(bindparam("ids", ext_ids, type_=ARRAY(Integer))))
+        )
+        for descendant_id, ancestor_id, depth in chain_rows.all():
+            ext_chains[descendant_id].append((ancestor_id, depth))
+    closure_rows = 0
+
+    def counted(records: Iterator[tuple]) -> Iterator[tuple]:
+        nonlocal closure_rows
+        for record in records:
+            closure_rows += 1
+            yield record
+
+    await _copy(session, "user_tree", ["ancestor_id", "descendant_id", "depth"],
+                counted(_closure(batch, ids, order, ext_chains)))
+    result["closure_rows"] = closure_rows
+    phase("copy_closure")
+
+    rate_rows = [
+        (ids[i], category, rate, now)
+        for i in order if batch.rates[i]
+        for category, rate in batch.rates[i].items()
+    ]
+    if rate_rows:
+        await _copy(session, "user_game_rolling_rates",
+                    ["user_id", "game_category", "rolling_rate", "updated_at"], rate_rows)
+    result["rolling_rates"] = len(rate_rows)
+    phase("copy_rates")
+
+    # In-file subtree sizes, leaves first; what each existing referrer gains
+    sizes = [0] * n
+    gained: dict[int, int] = {}
+    for i in reversed(order):
+        p = batch.parent[i]
+        if p != _NONE:
+            sizes[p] += sizes[i] + 1
+        elif batch.ext_parent[i] is not None:
+            gained[batch.ext_parent[i]] = gained.get(batch.ext_parent[i], 0) + sizes[i] + 1
+    zero = Decimal("0")
+    await _copy(
+        session, "user_subtree_stats",
+        ["user_id", "descendant_count", "subtree_balance", "bet_total", "commission_total",
+         "day_bet_amount", "day_commission", "month_bet_amount", "month_commission", "updated_at"],
+        ((ids[i], sizes[i], zero, zero, zero, zero, zero, zero, zero, now) for i in order),
+    )
+    if gained:
+        await _update_existing(session, batch, gained)
+    phase("existing_referrers")
+
+    timings["total"] = round(time.perf_counter() - started, 3)
+    result["timings"] = timings
+    logger.info("Imported %d users (%d closure rows) in %.1fs", n, closure_rows, timings["total"])
+    return result
+
+
+async def _update_existing(session: AsyncSession, batch: _Batch, gained: dict[int, int]) -> None:
+    """Subtree counts and ranks of the existing referrers and their ancestors."""
+    referrers = sorted(gained)
+    ids = bindparam("ids", referrers, type_=ARRAY(Integer))
+    await session.execute(text("""
+        UPDATE user_subtree_stats s
+        SET descendant_count = s.descendant_count + a.added, updated_at = now()
+        FROM (
+            SELECT t.ancestor_id, sum(g.added) AS added
+            FROM unnest(:ids, :added) AS g(id, added)
+            JOIN user_tree t ON t.descendant_id = g.id
+            GROUP BY t.ancestor_id
+        ) a
+        WHERE s.user_id = a.ancestor_id
+    """).bindparams(ids, bindparam("added", [gained[r] for r in referrers], type_=ARRAY(Integer))))
+
+    # A referrer whose new referrals brought their own is sub_hq, else at least
+    # distributor; everyone above a referrer now has a second generation
+    with_grandchildren = sorted({
+        batch.ext_parent[i] for i in range(len(batch))
+        if batch.ext_parent[i] is not None and batch.children[i]
+    })
+    await session.execute(text("""
+        UPDATE users SET rank = 'sub_hq'
+        WHERE rank <> 'sub_hq' AND (
+            id = ANY(:grand)
+            OR id IN (SELECT ancestor_id FROM user_tree WHERE descendant_id = ANY(:ids) AND depth > 0)
+        )
+    """).bindparams(ids, bindparam("grand", with_grandchildren, type_=ARRAY(Integer))))
+    await session.execute(
+        text("UPDATE users SET rank = 'distributor' WHERE rank = 'agency' AND id = ANY(:ids)")
+        .bindparams(ids)
+    )
@@ -0,0 +1,96 @@
+"""Member search for the admin user list.
+
+``ILIKE '%term%'`` over username / real_name / phone cannot use a btree
+index, so every search used to scan users. The search is now split by what
+the term looks like, and each part is served by an index (migration
+t0u1v2w3x4y5, v2w3x4y5z6a7):
+
+- a number: exact id match (primary key), alongside the text matches
+- shorter than 3 characters: username or real name prefix,
+  ``lower(username) LIKE 'ab%'`` on text_pattern_ops indexes; a trigram
+  index cannot serve such short substrings. A two-character real name (a
+  common Korean name length) is found by its full name or its first
+  character
+- otherwise: substring match on username and real_name through pg_trgm
+  GIN indexes (they serve ILIKE directly)
+- phone-like terms (digits, spaces, + ( ) - .): digit-only substring match
+  against the phone number with its formatting stripped, through an
+  expression trigram index, so "010-1234" finds "01012345678"
+
+Results are ranked: exact username or real name first, then prefix of
+either, then trigram similarity to them, newest first among equals.
+"""
+
+import re
+import unicodedata
+
+from sqlalchemy import case, func, literal_column, or_
+
+from app.models.user import User
+from app.services.list_query import escape_like
+
+MIN_TRIGRAM_LENGTH = 3
+_PHONE_CHARS = re.compile(r"[\d\s()+.\-]+")
+_MAX_ID = 2**31 - 1
+
+# Must match the expression of ix_users_phone_digits_trgm exactly, constants
+# included (bound parameters would keep the planner from using the index)
+PHONE_DIGITS = func.regexp_replace(
+    User.phone, literal_column("'[^0-9]'"), literal_column("''"), literal_column("'g'"),
+)
+
+
+def normalize(term: str) -> str:
+    """NFKC (full-width forms to ASCII), trimmed, inner whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFKC", term).split())
+
+
+def phone_digits(term: str) -> str | None:
+    """The digits of a phone-like term with at least MIN_TRIGRAM_LENGTH of them."""
+    if not _PHONE_CHARS.fullmatch(term):
+        return None
+    digits = re.sub(r"\D", "", term)
+    return digits if len(digits) >= MIN_TRIGRAM_LENGTH else None
+
+
+def search_filter(term: str | None) -> list:
+    """WHERE conditions for a search term ([] when there is nothing to search)."""
+    term = normalize(term or "")
+    if not term:
+        return []
+    clauses = []
+    if term.isdigit() and int(term) <= _MAX_ID:
+        clauses.append(User.id == int(term))
+    if len(term) < MIN_TRIGRAM_LENGTH:
+        prefix = f"{escape_like(term.lower())}%"
+        clauses.append(func.lower(User.username).like(prefix, escape="\\"))
+        clauses.append(func.lower(User.real_name).like(prefix, escape="\\"))
+    else:
+        pattern = f"%{escape_like(term)}%"
+        clauses.append(User.username.ilike(pattern, escape="\\"))
+        clauses.append(User.real_name.ilike(pattern, escape="\\"))
+    digits = phone_digits(term)
+    if digits:
+        clauses.append(PHONE_DIGITS.like(f"%{digits}%"))
+    return [or_(*clauses)]
+
+
+def search_rank(term: str | None) -> list:
+    """ORDER BY terms placing the best matches first ([] without a term)."""
+    term = normalize(term or "")
+    if not term:
+        return []
+    lowered = term.lower()
+    prefix = f"{escape_like(lowered)}%"
+    names = (func.lower(User.username), func.lower(User.real_name))
+    return [
+        case(
+            (or_(*(name == lowered for name in names)), 0),
+            (or_(*(name.like(prefix, escape="\\") for name in names)), 1),
+            else_=2,
+        ),
+        func.greatest(
+            func.similarity(User.username, term),
+            func.similarity(func.coalesce(User.real_name, ""), term),
+        ).desc(),
+    ]
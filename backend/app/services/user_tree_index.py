@@ -0,0 +1,356 @@
+"""In-process referral tree index built from users.referrer_id.
+
+The user_tree closure table holds one row per (ancestor, descendant) pair,
+O(n·depth) rows, and every ancestor check, subtree listing or count reads
+it. Each worker instead keeps the tree as array-backed parent / first-child /
+next-sibling links plus Euler-tour numbers. A depth-first walk numbers the
+nodes in visit order: a node gets its position on entry and the position
+past its last descendant on exit. A subtree is then one contiguous range of
+the tour:
+
+- is_ancestor: two comparisons
+- subtree enumeration: a slice of the tour order
+- descendant count: exit - entry - 1
+
+Users inserted after the last tour are linked into the arrays immediately
+and resolved by walking up to their nearest toured ancestor. Once enough of
+them accumulate, the tour is recomputed in memory without reloading.
+
+Other workers learn about inserts through a Redis version log (user id and
+referrer per change). user_tree_service reads through the index only while
+it is warm and falls back to the closure table otherwise, e.g. while the
+first build runs in the background or after the log was lost.
+"""
+
+import asyncio
+import logging
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import async_session
+from app.models.user import User
+from app.services.cache_service import VersionWatch
+
+logger = logging.getLogger(__name__)
+
+_NONE = -1
+_RETOUR_MIN = 1024  # untoured nodes tolerated before the tour is recomputed
+_RETOUR_FRACTION = 0.01  # ... or this share of the tree, whichever is larger
+_PENDING_KEY = "user_tree_index_pending"
+_BUILD_RETRY = 60.0  # seconds before a failed build is retried
+
+
+class TreeIndex:
+    """Referral forest over dense slots; ids are mapped to slots on insert."""
+
+    __slots__ = (
+        "child_count", "depth", "first_child", "ids", "next_sibling",
+        "order", "parent", "slot", "tin", "tout", "untoured",
+    )
+
+    def __init__(self):
+        self.slot: dict[int, int] = {}
+        self.ids = array("q")
+        self.parent = array("q")
+        self.first_child = array("q")
+        self.next_sibling = array("q")
+        self.child_count = array("l")
+        self.depth = array("l")
+        self.tin = array("q")
+        self.tout = array("q")
+        self.order = array("q")  # tour position -> slot
+        self.untoured = 0
+
+    @classmethod
+    def build(cls, edges: Iterable[tuple[int, int | None]]) -> "TreeIndex":
+        """Index (user_id, referrer_id) pairs; unknown referrers make roots."""
+        index = cls()
+        edges = list(edges)
+        for uid, _ in edges:
+            index._new_slot(uid)
+        for uid, referrer_id in edges:
+            s = index.slot[uid]
+            p = index.slot.get(referrer_id, _NONE) if referrer_id is not None else _NONE
+            if p != _NONE and p != s:
+                index._link(s, p)
+        index.retour()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.slot
+
+    # ─── Mutation ─────────────────────────────────────────────────
+
+    def _new_slot(self, user_id: int) -> int:
+        s = len(self.ids)
+        self.slot[user_id] = s
+        self.ids.append(user_id)
+        for arr in (self.parent, self.first_child, self.next_sibling, self.tin, self.tout):
+            arr.append(_NONE)
+        self.child_count.append(0)
+        self.depth.append(0)
+        return s
+
+    def _link(self, s: int, p: int) -> None:
+        self.parent[s] = p
+        self.next_sibling[s] = self.first_child[p]
+        self.first_child[p] = s
+        self.child_count[p] += 1
+
+    def add(self, user_id: int, referrer_id: int | None) -> None:
+        """Add a new leaf (idempotent: a known user is left as is)."""
+        if user_id in self.slot:
+            return
+        s = self._new_slot(user_id)
+        p = self.slot.get(referrer_id, _NONE) if referrer_id is not None else _NONE
+        if p != _NONE:
+            self._link(s, p)
+            self.depth[s] = self.depth[p] + 1
+        self.untoured += 1
+        if self.untoured > max(_RETOUR_MIN, int(len(self.ids) * _RETOUR_FRACTION)):
+            self.retour()
+
+    def retour(self) -> None:
+        """Recompute depths and Euler-tour numbers of the whole forest.
+
+        Iterative pre-order DFS: every subtree comes out as a contiguous run of
+        the order; exits are then filled in from the last position backwards.
+        """
+        n = len(self.ids)
+        order = array("q")
+        depth, first_child, next_sibling = self.depth, self.first_child, self.next_sibling
+        for root in range(n):
+            if self.parent[root] != _NONE:
+                continue
+            depth[root] = 0
+            stack = [root]
+            while stack:
+                s = stack.pop()
+                order.append(s)
+                c = first_child[s]
+                while c != _NONE:
+                    depth[c] = depth[s] + 1
+                    stack.append(c)
+                    c = next_sibling[c]
+        if len(order) != n:
+            # Nodes on a referrer cycle are never reached from a root
+            raise ValueError(f"Referral tree has {n - len(order)} nodes not reachable from a root")
+
+        tin, tout = self.tin, self.tout
+        for pos in range(n - 1, -1, -1):
+            s = order[pos]
+            end = pos + 1
+            c = first_child[s]
+            while c != _NONE:
+                end = max(end, tout[c])
+                c = next_sibling[c]
+            tin[s] = pos
+            tout[s] = end
+        self.order = order
+        self.untoured = 0
+
+    # ─── Queries (by user id) ─────────────────────────────────────
+
+    def _toured(self, s: int) -> bool:
+        # Slots added since the last tour are the trailing `untoured` ones
+        return s < len(self.ids) - self.untoured
+
+    def _toured_anchor(self, s: int) -> int:
+        """Nearest toured ancestor-or-self (_NONE if the walk reaches an untoured root)."""
+        while s != _NONE and not self._toured(s):
+            s = self.parent[s]
+        return s
+
+    def _slot_is_ancestor(self, a: int, d: int) -> bool:
+        """a is d or an ancestor of d."""
+        if self._toured(a):
+            # A toured node has no untoured ancestors, so compare at d's anchor
+            anchor = self._toured_anchor(d)
+            return anchor != _NONE and self.tin[a] <= self.tin[anchor] < self.tout[a]
+        while d != _NONE:
+            if d == a:
+                return True
+            d = self.parent[d]
+        return False
+
+    def is_ancestor(self, ancestor_id: int, descendant_id: int) -> bool:
+        """True if ancestor_id is a strict ancestor of descendant_id."""
+        a, d = self.slot.get(ancestor_id), self.slot.get(descendant_id)
+        if a is None or d is None or a == d:
+            return False
+        return self._slot_is_ancestor(a, d)
+
+    def _children(self, s: int) -> Iterator[int]:
+        c = self.first_child[s]
+        while c != _NONE:
+            yield c
+            c = self.next_sibling[c]
+
+    def _subtree_slots(self, s: int) -> Iterator[int]:
+        """s and all its descendants."""
+        if not self._toured(s):
+            stack = [s]
+            while stack:
+                x = stack.pop()
+                yield x
+                stack.extend(self._children(x))
+            return
+        yield from self.order[self.tin[s]:self.tout[s]]
+        if self.untoured:
+            lo, hi = self.tin[s], self.tout[s]
+            for x in range(len(self.ids) - self.untoured, len(self.ids)):
+                anchor = self._toured_anchor(x)
+                if anchor != _NONE and lo <= self.tin[anchor] < hi:
+                    yield x
+
+    def descendants(self, user_id: int, max_depth: int | None = None) -> list[tuple[int, int]]:
+        """(descendant_id, relative depth) pairs, excluding the user itself."""
+        s = self.slot.get(user_id)
+        if s is None:
+            return []
+        base = self.depth[s]
+        out = []
+        for x in self._subtree_slots(s):
+            rel = self.depth[x] - base
+            if rel > 0 and (max_depth is None or rel <= max_depth):
+                out.append((self.ids[x], rel))
+        return out
+
+    def descendant_count(self, user_id: int) -> int:
+        s = self.slot.get(user_id)
+        if s is None:
+            return 0
+        if self._toured(s) and not self.untoured:
+            return self.tout[s] - self.tin[s] - 1
+        return sum(1 for _ in self._subtree_slots(s)) - 1
+
+    def children(self, user_id: int) -> list[int]:
+        s = self.slot.get(user_id)
+        return [] if s is None else [self.ids[c] for c in self._children(s)]
+
+    def child_total(self, user_id: int) -> int:
+        s = self.slot.get(user_id)
+        return 0 if s is None else self.child_count[s]
+
+    def has_grandchildren(self, user_id: int) -> bool:
+        s = self.slot.get(user_id)
+        return s is not None and any(self.first_child[c] != _NONE for c in self._children(s))
+
+    def ancestors(self, user_id: int) -> list[tuple[int, int]]:
+        """(ancestor_id, distance) pairs, nearest first."""
+        s = self.slot.get(user_id)
+        out = []
+        distance = 0
+        while s is not None and self.parent[s] != _NONE:
+            s = self.parent[s]
+            distance += 1
+            out.append((self.ids[s], distance))
+        return out
+
+
+# ─── Worker-local instance ────────────────────────────────────────
+
+_index: TreeIndex | None = None
+TREE_VERSION_KEY = "user_tree:version"  # also watched by commission_cache for "reset"
+_watch = VersionWatch(TREE_VERSION_KEY)
+_build_task: asyncio.Task | None = None
+_build_failed_at = 0.0
+_publish_tasks: set[asyncio.Task] = set()
+
+
+async def _build() -> None:
+    global _index, _build_task, _build_failed_at
+    try:
+        _watch.checked_at = 0.0
+        await _watch.poll()  # pin the version before reading, so later changes are replayed
+        async with async_session() as session:
+            rows = (await session.execute(select(User.id, User.referrer_id))).all()
+        _index = TreeIndex.build(rows)
+        logger.info("User tree index built (%d users)", len(_index))
+    except Exception:
+        logger.exception("User tree index build failed")
+        _index = None
+        _build_failed_at = time.monotonic()
+    finally:
+        _build_task = None
+
+
+def _start_build() -> None:
+    global _build_task
+    if _build_task is None and time.monotonic() - _build_failed_at >= _BUILD_RETRY:
+        _build_task = asyncio.create_task(_build())
+
+
+async def get_index() -> TreeIndex | None:
+    """The warm index, synced with other workers; None means read the closure table.
+
+    A cold index starts building in the background on the first call.
+    """
+    global _index
+    if not settings.USER_TREE_INDEX_ENABLED:
+        return None
+    if _index is None:
+        _start_build()
+        return None
+    changes = await _watch.poll()
+    if changes is None:
+        # Lost track of other workers' inserts: rebuild from the database
+        _index = None
+        _start_build()
+        return None
+    for change in changes:
+        kind, _, rest = change.partition(":")
+        if kind == "add":
+            uid, _, referrer = rest.partition(":")
+            _index.add(int(uid), int(referrer) if referrer else None)
+        else:
+            _index = None
+            _start_build()
+            return None
+    return _index
+
+
+def record_insert(session, user_id: int, referrer_id: int | None) -> None:
+    """Queue an insert; it reaches the index (and other workers) once the session commits."""
+    session.info.setdefault(_PENDING_KEY, []).append((user_id, referrer_id))
+
+
+async def invalidate() -> None:
+    """Drop every worker's index after tree changes other than inserts (rebuilt lazily)."""
+    global _index
+    _index = None
+    await _watch.bump("reset")
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    for user_id, referrer_id in pending:
+        if _index is not None:
+            _index.add(user_id, referrer_id)
+        if loop is None:
+            continue
+        task = loop.create_task(
+            _watch.bump(f"add:{user_id}:{referrer_id if referrer_id is not None else ''}")
+        )
+        _publish_tasks.add(task)
+        task.add_done_callback(_publish_tasks.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -1,9 +1,19 @@
-"""Closure Table operations for user referral hierarchy."""
+"""Closure Table operations for user referral hierarchy.
 
-from sqlalchemy import func, select
+Reads are answered from the in-process tree index (user_tree_index) while
+it is warm and from the user_tree closure table otherwise.
+"""
+
+from sqlalchemy import Integer, any_, bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.user import User, UserTree
+from app.models.user_game_rolling_rate import UserGameRollingRate
+from app.services import subtree_stats
+from app.services.closure_tree import children_page, move_subtree
+from app.services.commission_cache import invalidate_ancestor_chain
+from app.services.user_tree_index import get_index, record_insert
 
 
 async def insert_node(session: AsyncSession, user_id: int, referrer_id: int | None) -> None:
@@ -22,11 +32,113 @@ async def insert_node(session: AsyncSession, user_id: int, referrer_id: int | No
                 depth=anc.depth + 1,
             ))
 
+    invalidate_ancestor_chain(user_id)
+    record_insert(session, user_id, referrer_id)
+    user = await session.get(User, user_id)
+    subtree_stats.record_user(session, user_id, nodes=1, balance=user.balance if user else 0)
+
+
+async def move_node(session: AsyncSession, user_id: int, new_referrer_id: int) -> int:
+    """Move a user (and their referral subtree) under a new referrer; returns the subtree size.
+
+    Raises ValueError on a missing user, a circular move, or a rolling or
+    losing rate of the user above the new referrer's (the child <= parent rule
+    the rate endpoints enforce). After committing, the caller must drop the
+    cached ancestor chains and the tree index (clear_ancestor_chains,
+    user_tree_index.invalidate).
+    """
+    async def check_rates(session: AsyncSession) -> None:
+        conflicts = await _locked_rate_conflicts(session, user_id, new_referrer_id)
+        if conflicts:
+            raise ValueError("Cannot move: " + "; ".join(conflicts))
+
+    return await move_subtree(
+        session,
+        tree=UserTree,
+        nodes=User,
+        parent_column=User.referrer_id,
+        node_id=user_id,
+        new_parent_id=new_referrer_id,
+        shift_totals=subtree_stats.shift_user,
+        check=check_rates,
+    )
+
+
+async def _locked_rate_conflicts(session: AsyncSession, user_id: int, referrer_id: int) -> list[str]:
+    """Rates of user_id that would exceed referrer_id's if it became the referrer.
+
+    Both users' rate rows are share-locked so they cannot change before the
+    move commits (the users themselves are locked by move_subtree).
+    """
+    rows = (await session.execute(
+        select(UserGameRollingRate)
+        .where(UserGameRollingRate.user_id.in_([user_id, referrer_id]))
+        .order_by(UserGameRollingRate.id)
+        .with_for_update(read=True)
+    )).scalars().all()
+    losing = dict((await session.execute(
+        select(User.id, User.losing_rate).where(User.id.in_([user_id, referrer_id]))
+    )).all())
+    return rate_conflicts(
+        [r for r in rows if r.user_id == user_id],
+        [r for r in rows if r.user_id == referrer_id],
+        losing.get(user_id),
+        losing.get(referrer_id),
+    )
+
+
+def rate_conflicts(child_rates, parent_rates, child_losing, parent_losing) -> list[str]:
+    """Child rates above the parent's, as messages; rates the parent has no row for are not limited."""
+    parent = {(r.game_category, r.provider): r for r in parent_rates}
+    conflicts = []
+    for r in child_rates:
+        p = parent.get((r.game_category, r.provider))
+        if p is None:
+            continue
+        category = f"{r.game_category}/{r.provider}" if r.provider else r.game_category
+        if r.rolling_rate > p.rolling_rate:
+            conflicts.append(f"{category} rolling rate {r.rolling_rate}% exceeds the referrer's {p.rolling_rate}%")
+        if r.losing_rate is not None and p.losing_rate is not None and r.losing_rate > p.losing_rate:
+            conflicts.append(f"{category} losing rate {r.losing_rate}% exceeds the referrer's {p.losing_rate}%")
+    if child_losing is not None and parent_losing is not None and child_losing > parent_losing:
+        conflicts.append(f"losing rate {child_losing}% exceeds the referrer's {parent_losing}%")
+    return conflicts
+
+
+async def _users_by_id(session: AsyncSession, user_ids: list[int]) -> dict[int, User]:
+    """Load users by id with one array parameter (no per-id bind limit)."""
+    if not user_ids:
+        return {}
+    ids = bindparam("user_ids", user_ids, type_=ARRAY(Integer))
+    result = await session.execute(select(User).where(User.id == any_(ids)))
+    return {u.id: u for u in result.scalars().all()}
+
+
+async def is_ancestor(session: AsyncSession, ancestor_id: int, descendant_id: int) -> bool:
+    """True if ancestor_id is a strict ancestor of descendant_id."""
+    index = await get_index()
+    if index is not None:
+        return index.is_ancestor(ancestor_id, descendant_id)
+    stmt = select(UserTree.depth).where(
+        UserTree.ancestor_id == ancestor_id,
+        UserTree.descendant_id == descendant_id,
+        UserTree.depth > 0,
+    )
+    return (await session.execute(stmt)).first() is not None
+
 
 async def get_descendants(
     session: AsyncSession, user_id: int, max_depth: int | None = None
 ) -> list[dict]:
     """Get all descendants of a node."""
+    index = await get_index()
+    if index is not None:
+        pairs = index.descendants(user_id, max_depth)
+        users = await _users_by_id(session, [uid for uid, _ in pairs])
+        rows = [{"user": users[uid], "depth": depth} for uid, depth in pairs if uid in users]
+        rows.sort(key=lambda r: (r["depth"], r["user"].username))
+        return rows
+
     stmt = (
         select(User, UserTree.depth)
         .join(UserTree, UserTree.descendant_id == User.id)
@@ -42,6 +154,11 @@ async def get_descendants(
 
 async def get_children(session: AsyncSession, user_id: int) -> list[User]:
     """Get direct children (depth=1) of a node."""
+    index = await get_index()
+    if index is not None:
+        users = await _users_by_id(session, index.children(user_id))
+        return sorted(users.values(), key=lambda u: u.username)
+
     stmt = (
         select(User)
         .join(UserTree, UserTree.descendant_id == User.id)
@@ -54,6 +171,12 @@ async def get_children(session: AsyncSession, user_id: int) -> list[User]:
 
 async def get_ancestors(session: AsyncSession, user_id: int) -> list[dict]:
     """Get all ancestors of a node (path to root)."""
+    index = await get_index()
+    if index is not None:
+        pairs = index.ancestors(user_id)
+        users = await _users_by_id(session, [uid for uid, _ in pairs])
+        return [{"user": users[uid], "depth": depth} for uid, depth in pairs if uid in users]
+
     stmt = (
         select(User, UserTree.depth)
         .join(UserTree, UserTree.ancestor_id == User.id)
@@ -66,6 +189,10 @@ async def get_ancestors(session: AsyncSession, user_id: int) -> list[dict]:
 
 async def get_descendant_count(session: AsyncSession, user_id: int) -> int:
     """Count all descendants (excluding self)."""
+    index = await get_index()
+    if index is not None:
+        return index.descendant_count(user_id)
+
     stmt = (
         select(func.count())
         .select_from(UserTree)
@@ -77,6 +204,10 @@ async def get_descendant_count(session: AsyncSession, user_id: int) -> int:
 
 async def get_direct_referral_count(session: AsyncSession, user_id: int) -> int:
     """Count direct referrals (depth=1 children)."""
+    index = await get_index()
+    if index is not None:
+        return index.child_total(user_id)
+
     stmt = (
         select(func.count())
         .select_from(UserTree)
@@ -88,6 +219,10 @@ async def get_direct_referral_count(session: AsyncSession, user_id: int) -> int:
 
 async def has_second_generation(session: AsyncSession, user_id: int) -> bool:
     """Check if user has any descendant at depth >= 2."""
+    index = await get_index()
+    if index is not None:
+        return index.has_grandchildren(user_id)
+
     stmt = (
         select(func.count())
         .select_from(UserTree)
@@ -99,14 +234,19 @@ async def has_second_generation(session: AsyncSession, user_id: int) -> bool:
 
 async def get_subtree_for_tree_view(session: AsyncSession, root_id: int) -> list[dict]:
     """Get full subtree data for tree visualization."""
-    stmt = (
-        select(User)
-        .join(UserTree, UserTree.descendant_id == User.id)
-        .where(UserTree.ancestor_id == root_id)
-        .order_by(User.depth, User.username)
-    )
-    result = await session.execute(stmt)
-    users = result.scalars().all()
+    index = await get_index()
+    if index is not None:
+        subtree = [root_id, *(uid for uid, _ in index.descendants(root_id))] if root_id in index else []
+        users = sorted((await _users_by_id(session, subtree)).values(), key=lambda u: (u.depth, u.username))
+    else:
+        stmt = (
+            select(User)
+            .join(UserTree, UserTree.descendant_id == User.id)
+            .where(UserTree.ancestor_id == root_id)
+            .order_by(User.depth, User.username)
+        )
+        result = await session.execute(stmt)
+        users = result.scalars().all()
 
     return [
         {
@@ -121,3 +261,38 @@ async def get_subtree_for_tree_view(session: AsyncSession, root_id: int) -> list
         }
         for u in users
     ]
+
+
+async def get_children_page(
+    session: AsyncSession, user_id: int, cursor: int | None = None, limit: int = 50
+) -> tuple[list[dict], int | None]:
+    """One page of direct referrals with subtree totals, for expand-on-demand tree views.
+
+    Totals are per-child rows of user_subtree_stats; descendant counts come
+    from the tree index instead while it is warm.
+    """
+    children, next_cursor = await children_page(
+        session, nodes=User, parent_column=User.referrer_id,
+        node_id=user_id, cursor=cursor, limit=limit,
+    )
+    totals = await subtree_stats.node_totals(session, "user", [c.id for c in children])
+    index = await get_index()
+    items = []
+    for u in children:
+        count, balance = totals.get(u.id, (0, u.balance))
+        if index is not None and u.id in index:
+            count = index.descendant_count(u.id)
+        items.append({
+            "id": u.id,
+            "username": u.username,
+            "rank": u.rank,
+            "status": u.status,
+            "depth": u.depth,
+            "referrer_id": u.referrer_id,
+            "balance": float(u.balance),
+            "points": float(u.points),
+            "descendant_count": count,
+            "subtree_balance": float(balance),
+            "has_children": count > 0,
+        })
+    return items, next_cursor
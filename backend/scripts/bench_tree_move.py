@@ -0,0 +1,101 @@
+"""Benchmark: move a large referral subtree with user_tree_service.move_node.
+
+Builds a synthetic subtree (default 100,000 users, fan-out 10) under a fresh
+root, then moves it back and forth between two other fresh roots and reports
+the timings. Everything runs in one transaction that is rolled back, so the
+database is left as it was.
+
+    python scripts/bench_tree_move.py --nodes 100000 --fanout 10 --repeat 3
+"""
+
+import sys
+from pathlib import Path
+
+# Ensure project root is on PYTHONPATH
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import asyncio
+import secrets
+import time
+
+from sqlalchemy import Integer, bindparam, func, insert, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.database import async_session
+from app.models.user import User, UserTree
+from app.services.user_tree_service import move_node
+
+_CHUNK = 5000
+
+
+async def _insert_level(session, tag: str, start: int, parents: list[int | None], depth: int) -> list[int]:
+    """Insert one level of users (one per parent entry) and their closure rows."""
+    ids: list[int] = []
+    for i in range(0, len(parents), _CHUNK):
+        rows = [
+            {"username": f"bench_{tag}_{start + i + j}", "referrer_id": p, "depth": depth}
+            for j, p in enumerate(parents[i:i + _CHUNK])
+        ]
+        result = await session.execute(insert(User).returning(User.id, sort_by_parameter_order=True), rows)
+        ids.extend(result.scalars().all())
+
+    level = bindparam("ids", ids, type_=ARRAY(Integer))
+    # Self links, then every ancestor of the referrer one level further away
+    await session.execute(text(
+        "INSERT INTO user_tree (ancestor_id, descendant_id, depth) "
+        "SELECT id, id, 0 FROM users WHERE id = ANY(:ids)"
+    ).bindparams(level))
+    await session.execute(text(
+        "INSERT INTO user_tree (ancestor_id, descendant_id, depth) "
+        "SELECT t.ancestor_id, u.id, t.depth + 1 FROM users u "
+        "JOIN user_tree t ON t.descendant_id = u.referrer_id WHERE u.id = ANY(:ids)"
+    ).bindparams(level))
+    return ids
+
+
+async def _build(session, tag: str, nodes: int, fanout: int) -> tuple[int, int, int]:
+    """Create roots A and B plus a subtree of `nodes` users under root S; returns (A, B, S)."""
+    a, b, s = await _insert_level(session, tag, 0, [None, None, None], 0)
+    created, level, depth = 1, [s], 1
+    while created < nodes:
+        parents = [p for p in level for _ in range(fanout)][:nodes - created]
+        level = await _insert_level(session, tag, created + 3, parents, depth)
+        created += len(level)
+        depth += 1
+        print(f"  depth {depth - 1}: {len(level)} users")
+    return a, b, s
+
+
+async def bench(nodes: int, fanout: int, repeat: int) -> None:
+    tag = secrets.token_hex(4)
+    async with async_session() as session:
+        try:
+            t0 = time.perf_counter()
+            a, b, s = await _build(session, tag, nodes, fanout)
+            closure = (await session.execute(
+                select(func.count()).select_from(UserTree).where(UserTree.ancestor_id == s)
+            )).scalar()
+            print(f"Built {closure} subtree users in {time.perf_counter() - t0:.1f}s")
+            await session.execute(text("ANALYZE users"))
+            await session.execute(text("ANALYZE user_tree"))
+
+            # Attach under A first so every timed move also deletes outside links
+            await move_node(session, s, a)
+            for i in range(repeat):
+                target = b if i % 2 == 0 else a
+                t0 = time.perf_counter()
+                moved = await move_node(session, s, target)
+                print(f"  move {i + 1}: {moved} users in {time.perf_counter() - t0:.3f}s")
+        finally:
+            await session.rollback()
+    print("Rolled back.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(bench(args.nodes, args.fanout, args.repeat))
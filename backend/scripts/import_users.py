@@ -0,0 +1,61 @@
+"""Bulk-import users (with referrers) from a CSV or JSONL file.
+
+Rows name their referrer by username (referrer_code): another row of the file,
+in any order, or an existing user. The whole file is validated first; any
+invalid row aborts the import with the list of errors and nothing written.
+
+    python scripts/import_users.py users.csv
+    python scripts/import_users.py users.jsonl --dry-run
+
+CSV columns: username, referrer_code, nickname, real_name, phone, email, memo,
+level, commission_type, losing_rate, and rolling_<category> per game category.
+JSONL objects use the same keys, with rolling rates as {"rolling_rates": {...}}.
+"""
+
+import sys
+from pathlib import Path
+
+# Ensure project root is on PYTHONPATH
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import asyncio
+import json
+
+from app.database import async_session
+from app.services import admin_scope, user_tree_index
+from app.services.user_import import UserImportError, import_users, read_csv, read_jsonl
+
+
+async def run(path: Path, fmt: str, dry_run: bool) -> int:
+    reader = read_csv if fmt == "csv" else read_jsonl
+    with path.open(encoding="utf-8-sig", newline="") as f:
+        async with async_session() as session:
+            try:
+                result = await import_users(session, reader(f), dry_run=dry_run)
+            except UserImportError as e:
+                await session.rollback()
+                print(f"Import aborted: {e}")
+                for error in e.errors:
+                    print(f"  {error}")
+                return 1
+            if dry_run:
+                await session.rollback()
+            else:
+                await session.commit()
+                await user_tree_index.invalidate()
+                # Imported usernames may match agents
+                await admin_scope.invalidate()
+    print(json.dumps(result, indent=2))
+    print("Dry run, nothing written." if dry_run else "Imported.")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    parser.add_argument("--dry-run", action="store_true", help="validate only")
+    args = parser.parse_args()
+    fmt = args.format or ("jsonl" if args.path.suffix in (".jsonl", ".ndjson") else "csv")
+    sys.exit(asyncio.run(run(args.path, fmt, args.dry_run)))
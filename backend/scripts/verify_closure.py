@@ -0,0 +1,42 @@
+"""Verify user_tree / admin_user_tree against the parent pointers, optionally repairing.
+
+    python scripts/verify_closure.py                 # both trees, report only
+    python scripts/verify_closure.py --tree user --apply
+
+Exits 1 when differences were found and left in place.
+"""
+
+import sys
+from pathlib import Path
+
+# Ensure project root is on PYTHONPATH
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import asyncio
+import json
+
+from app.services.closure_verify import TREES, verify_tree
+
+
+async def run(trees: list[str], apply: bool) -> int:
+    drift = False
+    for kind in trees:
+        try:
+            report = await verify_tree(kind, apply=apply)
+        except ValueError as e:
+            print(f"{kind}: {e}")
+            return 1
+        print(json.dumps(report, indent=2))
+        found = report["missing"] + report["extra"] + report["wrong_depth"] + report["node_depth_mismatches"]
+        drift = drift or bool(report["unplaced_nodes"]) or (found > 0 and not apply)
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tree", choices=[*TREES, "all"], default="all")
+    parser.add_argument("--apply", action="store_true", help="repair the differences")
+    args = parser.parse_args()
+    trees = list(TREES) if args.tree == "all" else [args.tree]
+    sys.exit(asyncio.run(run(trees, args.apply)))
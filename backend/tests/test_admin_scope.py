@@ -0,0 +1,21 @@
+from app.services import admin_scope
+from app.services.user_tree_index import TreeIndex
+
+
+async def test_access_is_membership_of_the_ancestor_chain(monkeypatch):
+    # 1 -> 2 -> 3 -> 4, and a separate tree 5 -> 6
+    index = TreeIndex.build([(1, None), (2, 1), (3, 2), (4, 3), (5, None), (6, 5)])
+
+    async def fake_index():
+        return index
+
+    async def fake_scope(session, admin_id):
+        return frozenset({2}) if admin_id == 10 else frozenset()
+
+    monkeypatch.setattr(admin_scope, "get_index", fake_index)
+    monkeypatch.setattr(admin_scope, "get_scope", fake_scope)
+
+    assert [await admin_scope.can_access(None, 10, uid) for uid in range(1, 7)] == [
+        False, True, True, True, False, False,
+    ]
+    assert not await admin_scope.can_access(None, 11, 3)
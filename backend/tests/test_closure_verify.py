@@ -0,0 +1,44 @@
+import random
+from array import array
+
+from app.services import closure_verify as cv
+
+
+def _forest(parents: dict[int, int | None], depths: dict[int, int] | None = None) -> cv._Forest:
+    ids = sorted(parents)
+    return cv._Forest(
+        array("q", ids),
+        array("q", [cv._NONE if parents[i] is None else parents[i] for i in ids]),
+        array("l", [(depths or {}).get(i, 0) for i in ids]),
+    )
+
+
+def _brute(parents: dict[int, int | None]) -> list[tuple[int, int, int]]:
+    rows = []
+    for uid in parents:
+        node, distance = uid, 0
+        while node is not None:
+            rows.append((node, uid, distance))
+            node, distance = parents.get(node), distance + 1
+    return sorted(rows)
+
+
+def test_expected_rows_come_out_in_primary_key_order(monkeypatch):
+    rng = random.Random(7)
+    ids = rng.sample(range(1, 10_000), 400)
+    parents = {}
+    for k, uid in enumerate(ids):
+        parents[uid] = rng.choice(ids[:k]) if k and rng.random() < 0.9 else None
+    # Exercise both the sorted and the marker-scan paths
+    for factor in (1, 10_000):
+        monkeypatch.setattr(cv, "_SCAN_FACTOR", factor)
+        assert list(_forest(parents).expected()) == _brute(parents)
+
+
+def test_cycles_are_unplaced_and_left_out():
+    parents = {1: None, 2: 1, 3: 4, 4: 5, 5: 3, 6: 5, 7: 7, 8: 99}
+    forest = _forest(parents, depths={2: 1})
+    assert forest.unplaced() == [3, 4, 5, 6, 7]
+    # An unknown parent makes a root
+    assert list(forest.expected()) == [(1, 1, 0), (1, 2, 1), (2, 2, 0), (8, 8, 0)]
+    assert list(forest.depth) == [0, 1, -1, -1, -1, -1, -1, 0]
@@ -0,0 +1,51 @@
+import time
+from array import array
+from decimal import Decimal
+
+from app.services import commission_cache as cc
+
+
+def _vector(ancestor_ids: list[int]) -> tuple:
+    chain = cc.AncestorChain(array("q", ancestor_ids), ("active",) * len(ancestor_ids), time.monotonic())
+    return chain, ((0, 0, Decimal("1")),)
+
+
+def test_rate_change_drops_only_the_subtree_waterfalls():
+    # 1 <- 2 <- 3, and 1 <- 4 (sibling branch)
+    cc._waterfalls.clear()
+    cc._waterfalls.update({
+        (3, "casino", "rolling"): _vector([2, 1]),
+        (2, "casino", "rolling"): _vector([1]),
+        (4, "casino", "rolling"): _vector([1]),
+        (3, "slot", "rolling"): _vector([2, 1]),
+    })
+    try:
+        cc._drop_rate(2, "casino")
+        assert set(cc._waterfalls) == {(4, "casino", "rolling"), (3, "slot", "rolling")}
+
+        cc.invalidate_user_status(1)
+        assert cc._waterfalls == {}
+    finally:
+        cc._waterfalls.clear()
+
+
+async def test_tree_reset_from_another_worker_drops_chains(monkeypatch, fake_redis):
+    monkeypatch.setattr(cc, "_tree_watch", cc.VersionWatch(cc.TREE_VERSION_KEY))
+    other_worker = cc.VersionWatch(cc.TREE_VERSION_KEY)
+    cc._chains.clear()
+    await cc._sync_tree()
+    cc._chains[3] = _vector([2, 1])[0]
+    cc._waterfalls[(3, "casino", "rolling")] = _vector([2, 1])
+    try:
+        await other_worker.bump("add:5:3")
+        cc._tree_watch.checked_at = 0.0
+        await cc._sync_tree()
+        assert 3 in cc._chains and cc._waterfalls
+
+        await other_worker.bump("reset")
+        cc._tree_watch.checked_at = 0.0
+        await cc._sync_tree()
+        assert cc._chains == {} and cc._waterfalls == {}
+    finally:
+        cc._chains.clear()
+        cc._waterfalls.clear()
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.config import settings
+from app.database import async_session
+from app.models.commission import CommissionLedger, CommissionLedgerKey, CommissionRollup
+from app.models.subtree_stats import UserSubtreeStats
+from app.models.user import User, UserTree
+from app.models.user_game_rolling_rate import UserGameRollingRate
+from app.services import commission_cache, commission_engine
+from app.services.commission_cache import compute_waterfall
+from app.services.commission_engine import calculate_rolling_commission
+from app.services.commission_partitions import add_months, ensure_partitions, month_of
+from app.services.user_tree_service import insert_node
+
+
+def test_compute_waterfall_shares():
+    # bettor 0.5%, referrer 1.0%, inactive-filtered grandparent 1.0% (no margin), root 1.5%
+    chain = [4, 3, 2, 1]
+    rates = {4: Decimal("0.5"), 3: Decimal("1.0"), 2: Decimal("1.0"), 1: Decimal("1.5")}
+    assert compute_waterfall(chain, rates) == [
+        (0, 4, Decimal("0.5")),
+        (1, 3, Decimal("0.5")),
+        (3, 1, Decimal("0.5")),
+    ]
+
+
+async def _create_user(session, username: str, referrer: User | None, rate: str) -> User:
+    user = User(
+        username=username,
+        referrer_id=referrer.id if referrer else None,
+        depth=referrer.depth + 1 if referrer else 0,
+    )
+    session.add(user)
+    await session.flush()
+    await insert_node(session, user.id, user.referrer_id)
+    session.add(UserGameRollingRate(
+        user_id=user.id, game_category="casino", rolling_rate=Decimal(rate),
+    ))
+    return user
+
+
+@pytest.mark.asyncio
+async def test_concurrent_rolling_on_overlapping_subtrees(db_available):
+    """Bets from sibling subtrees credit shared ancestors concurrently without deadlock."""
+    tag = uuid.uuid4().hex[:8]
+    async with async_session() as session:
+        root = await _create_user(session, f"cc_{tag}_root", None, "1.5")
+        mid_a = await _create_user(session, f"cc_{tag}_ma", root, "1.0")
+        mid_b = await _create_user(session, f"cc_{tag}_mb", root, "1.0")
+        leaves = [
+            await _create_user(session, f"cc_{tag}_la", mid_a, "0.5"),
+            await _create_user(session, f"cc_{tag}_lb", mid_b, "0.5"),
+            await _create_user(session, f"cc_{tag}_lc", mid_a, "0.5"),
+        ]
+        await session.commit()
+    user_ids = [root.id, mid_a.id, mid_b.id] + [leaf.id for leaf in leaves]
+
+    rounds = 30
+    bet = Decimal("1000")
+
+    async def place(n: int) -> int:
+        async with async_session() as s:
+            entries = await calculate_rolling_commission(
+                s, leaves[n % 3].id, "casino", bet, f"cc_{tag}_{n}",
+            )
+            await s.commit()
+            return len(entries)
+
+    try:
+        results = await asyncio.gather(*(place(n) for n in range(rounds)))
+        assert results == [3] * rounds
+
+        async with async_session() as session:
+            points = dict((await session.execute(
+                select(User.id, User.points).where(User.id.in_(user_ids))
+            )).all())
+        share = Decimal("5.00")  # 1000 x 0.5%
+        assert points[root.id] == share * rounds
+        assert points[mid_a.id] == share * 20
+        assert points[mid_b.id] == share * 10
+        for leaf in leaves:
+            assert points[leaf.id] == share * 10
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(CommissionLedger).where(
+                CommissionLedger.reference_id.like(f"cc_{tag}_%")
+            ))
+            await session.execute(delete(CommissionLedgerKey).where(
+                CommissionLedgerKey.reference_id.like(f"cc_{tag}_%")
+            ))
+            await session.execute(delete(UserGameRollingRate).where(
+                UserGameRollingRate.user_id.in_(user_ids)
+            ))
+            await session.execute(delete(UserTree).where(UserTree.descendant_id.in_(user_ids)))
+            for uid in reversed(user_ids):
+                await session.execute(delete(User).where(User.id == uid))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_retry_across_month_boundary_is_written_once(db_available, monkeypatch):
+    """Two deliveries of a round on either side of a month boundary credit it once.
+
+    Both go straight to the write, as when they raced past the duplicate lookup.
+    """
+    tag = uuid.uuid4().hex[:8]
+    next_month = add_months(month_of(datetime.now(timezone.utc)), 1)
+    boundary = datetime(next_month.year, next_month.month, 1, tzinfo=timezone.utc)
+    async with async_session() as session:
+        await ensure_partitions(session, months_ahead=1)
+        root = await _create_user(session, f"mb_{tag}_root", None, "1.5")
+        leaf = await _create_user(session, f"mb_{tag}_leaf", root, "0.5")
+        await session.commit()
+    user_ids = [root.id, leaf.id]
+    round_id = f"mb_{tag}_1"
+
+    async def deliver(at: datetime) -> int:
+        class _Clock(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return at
+
+        monkeypatch.setattr(commission_engine, "datetime", _Clock)
+        async with async_session() as s:
+            shares = await commission_engine.get_waterfall(s, leaf.id, "casino", "rolling")
+            rows = commission_engine._ledger_rows(
+                shares, user_id=leaf.id, commission_type="rolling", game_category="casino",
+                source_amount=Decimal("1000"), round_id=round_id, policy_id=None, game_code=None,
+            )
+            entries = await commission_engine._write_ledger(s, rows)
+            await s.commit()
+            return len(entries)
+
+    try:
+        assert await deliver(boundary - timedelta(seconds=1)) == 2
+        assert await deliver(boundary) == 0
+
+        async with async_session() as session:
+            months = (await session.execute(
+                select(CommissionLedger.ledger_month).where(CommissionLedger.reference_id == round_id)
+            )).scalars().all()
+            points = dict((await session.execute(
+                select(User.id, User.points).where(User.id.in_(user_ids))
+            )).all())
+        assert len(months) == 2 and set(months) == {month_of(boundary - timedelta(seconds=1))}
+        assert points[leaf.id] == Decimal("5.00")
+        assert points[root.id] == Decimal("10.00")
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(CommissionLedger).where(CommissionLedger.reference_id == round_id))
+            await session.execute(delete(CommissionLedgerKey).where(CommissionLedgerKey.reference_id == round_id))
+            await session.execute(delete(UserGameRollingRate).where(
+                UserGameRollingRate.user_id.in_(user_ids)
+            ))
+            await session.execute(delete(UserTree).where(UserTree.descendant_id.in_(user_ids)))
+            for uid in reversed(user_ids):
+                await session.execute(delete(User).where(User.id == uid))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_bet_batch_webhook_dedups_rounds(db_available, client, fake_redis, monkeypatch):
+    """Each round of a bet batch is credited once, and bad bets fail on their own.
+
+    A round repeated in the batch and one processed before it count as
+    duplicates; an unknown user and a losing-commission bettor do not stop the
+    other rounds. Delivering the batch again credits nothing more.
+    """
+    tag = uuid.uuid4().hex[:8]
+    async with async_session() as session:
+        root = await _create_user(session, f"wb_{tag}_root", None, "1.5")
+        leaf = await _create_user(session, f"wb_{tag}_leaf", root, "0.5")
+        loser = await _create_user(session, f"wb_{tag}_loser", root, "0.5")
+        loser.commission_type = "losing"
+        await session.commit()
+        await calculate_rolling_commission(session, leaf.id, "casino", Decimal("1000"), f"wb_{tag}_0")
+        await session.commit()
+    user_ids = [root.id, leaf.id, loser.id]
+
+    monkeypatch.setattr(settings, "WEBHOOK_SECRET", "test-secret")
+
+    async def get_redis():
+        return fake_redis
+
+    monkeypatch.setattr(commission_cache, "get_redis", get_redis)
+
+    async def deliver(bets: list[dict]) -> dict:
+        body = json.dumps({"bets": bets}).encode()
+        timestamp = str(int(time.time()))
+        signature = hmac.new(b"test-secret", f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+        response = await client.post(
+            "/api/v1/commissions/webhook/bets:batch",
+            content=body,
+            headers={"Content-Type": "application/json", "X-Timestamp": timestamp, "X-Signature": signature},
+        )
+        assert response.status_code == 201
+        return response.json()
+
+    def bet(user_id: int, n: int) -> dict:
+        return {"user_id": user_id, "game_category": "casino", "round_id": f"wb_{tag}_{n}", "bet_amount": "1000"}
+
+    batch = [
+        bet(leaf.id, 1),
+        bet(leaf.id, 1),  # repeated within the batch
+        bet(2**31 - 1, 2),  # no such user
+        bet(loser.id, 3),  # earns losing commission only
+        bet(leaf.id, 0),  # processed before the batch
+        bet(leaf.id, 4),
+    ]
+    try:
+        first = await deliver(batch)
+        assert [r["status"] for r in first["results"]] == [
+            "processed", "duplicate", "user_not_found", "skipped", "duplicate", "processed",
+        ]
+        assert (first["processed"], first["duplicates"], first["entries"]) == (2, 2, 4)
+        assert first["total"] == "30.00"  # two rounds of 1000 x (0.5% + 1.0%)
+
+        # Every round with a known bettor is now flagged as processed
+        again = await deliver(batch)
+        assert [r["status"] for r in again["results"]] == [
+            "duplicate", "duplicate", "user_not_found", "duplicate", "duplicate", "duplicate",
+        ]
+        assert again["entries"] == 0
+
+        async with async_session() as session:
+            points = dict((await session.execute(
+                select(User.id, User.points).where(User.id.in_(user_ids))
+            )).all())
+        assert points[leaf.id] == Decimal("15.00")
+        assert points[root.id] == Decimal("30.00")
+        assert points[loser.id] == 0
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(CommissionLedger).where(
+                CommissionLedger.reference_id.like(f"wb_{tag}_%")
+            ))
+            await session.execute(delete(CommissionLedgerKey).where(
+                CommissionLedgerKey.reference_id.like(f"wb_{tag}_%")
+            ))
+            await session.execute(delete(CommissionRollup).where(
+                CommissionRollup.recipient_user_id.in_(user_ids)
+            ))
+            await session.execute(delete(UserGameRollingRate).where(
+                UserGameRollingRate.user_id.in_(user_ids)
+            ))
+            await session.execute(delete(UserSubtreeStats).where(UserSubtreeStats.user_id.in_(user_ids)))
+            await session.execute(delete(UserTree).where(UserTree.descendant_id.in_(user_ids)))
+            for uid in reversed(user_ids):
+                await session.execute(delete(User).where(User.id == uid))
+            await session.commit()
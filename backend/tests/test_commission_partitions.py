@@ -0,0 +1,42 @@
+import warnings
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from app.models.commission import CommissionLedger, CommissionLedgerArchive
+from app.services import commission_partitions
+from app.services.commission_partitions import add_months, ledger_period, month_of, partition_name
+
+
+def test_month_helpers():
+    assert add_months(date(2026, 11, 1), 3) == date(2027, 2, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert month_of(datetime(2026, 3, 31, 23, 59)) == date(2026, 3, 1)
+    # 08:00 on April 1st in UTC+9 is still March in UTC
+    assert month_of(datetime(2026, 4, 1, 8, 0, tzinfo=timezone(timedelta(hours=9)))) == date(2026, 3, 1)
+    assert partition_name(date(2026, 3, 1)) == "commission_ledger_202603"
+
+
+def test_ledger_period_bounds_the_partition_key():
+    clauses = ledger_period(
+        CommissionLedger,
+        datetime(2026, 1, 15, tzinfo=timezone.utc),
+        datetime(2026, 3, 2, 23, 59, 59, tzinfo=timezone.utc),
+    )
+    compiled = [str(c.compile(compile_kwargs={"literal_binds": True})) for c in clauses]
+    assert any("ledger_month >= '2026-01-01'" in c for c in compiled)
+    assert any("ledger_month <= '2026-03-01'" in c for c in compiled)
+    assert ledger_period(CommissionLedger, None, None) == []
+
+
+async def test_ledger_source_unions_archived_months(monkeypatch):
+    async def fake_archives(session, month_from=None, month_to=None):
+        return [CommissionLedgerArchive(month=date(2025, 1, 1), table_name="commission_archive.commission_ledger_202501")]
+
+    monkeypatch.setattr(commission_partitions, "archived_months", fake_archives)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        ledger = await commission_partitions.ledger_source(None, datetime(2025, 1, 5), None)
+        sql = str(select(ledger.id, ledger.ledger_month).compile())
+    assert "FROM commission_ledger UNION ALL SELECT" in sql
+    assert "commission_archive.commission_ledger_202501.ledger_month" in sql
@@ -0,0 +1,82 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.database import async_session
+from app.models.bet_record import BetRecord
+from app.models.commission import CommissionLedger, CommissionRollup
+from app.models.subtree_stats import UserSubtreeStats
+from app.models.user import User, UserTree
+from app.models.user_game_rolling_rate import UserGameRollingRate
+from app.services.commission_replay import REPLAY_SUFFIX, replay_commissions
+from tests.test_commission_concurrency import _create_user
+
+
+def _bet(user_id: int, round_id: str, amount: str, at: datetime) -> BetRecord:
+    return BetRecord(
+        user_id=user_id, game_category="casino", round_id=round_id,
+        bet_amount=Decimal(amount), win_amount=Decimal("0"), profit=-Decimal(amount),
+        status="settled", bet_at=at,
+    )
+
+
+@pytest.mark.asyncio
+async def test_round_spanning_chunks_is_replayed_once(db_available):
+    """Records of one round in different chunks are recomputed from the first one only.
+
+    Neither round has live ledger entries, so the replay writes the whole
+    waterfall as corrections. A round whose first record predates the range
+    belongs to an earlier replay and is left alone.
+    """
+    tag = uuid.uuid4().hex[:8]
+    placed = datetime.now(timezone.utc) - timedelta(hours=1)
+    async with async_session() as session:
+        root = await _create_user(session, f"rp_{tag}_root", None, "1.5")
+        leaf = await _create_user(session, f"rp_{tag}_leaf", root, "0.5")
+        session.add_all([
+            _bet(leaf.id, f"rp_{tag}_1", "1000", placed),
+            _bet(leaf.id, f"rp_{tag}_1", "2000", placed + timedelta(seconds=1)),
+            _bet(leaf.id, f"rp_{tag}_2", "1000", placed - timedelta(hours=2)),
+            _bet(leaf.id, f"rp_{tag}_2", "1000", placed + timedelta(seconds=2)),
+        ])
+        await session.commit()
+    user_ids = [root.id, leaf.id]
+
+    try:
+        await replay_commissions(
+            placed - timedelta(minutes=1), placed + timedelta(minutes=1),
+            dry_run=False, commission_type="rolling", workers=1, chunk_size=1,
+        )
+
+        async with async_session() as session:
+            corrections = dict((await session.execute(
+                select(CommissionLedger.recipient_user_id, CommissionLedger.commission_amount)
+                .where(CommissionLedger.reference_id.like(f"rp_{tag}_%"))
+            )).all())
+            refs = (await session.execute(
+                select(CommissionLedger.reference_id).where(CommissionLedger.reference_id.like(f"rp_{tag}_%"))
+            )).scalars().all()
+            points = dict((await session.execute(
+                select(User.id, User.points).where(User.id.in_(user_ids))
+            )).all())
+        # Shares of the first record's 1000 (0.5% and 1.0%), not of the second's 2000
+        assert set(refs) == {f"rp_{tag}_1{REPLAY_SUFFIX}"}
+        assert corrections == {leaf.id: Decimal("5.00"), root.id: Decimal("10.00")}
+        assert points[leaf.id] == Decimal("5.00")
+        assert points[root.id] == Decimal("10.00")
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(CommissionLedger).where(CommissionLedger.reference_id.like(f"rp_{tag}_%")))
+            await session.execute(delete(CommissionRollup).where(CommissionRollup.recipient_user_id.in_(user_ids)))
+            await session.execute(delete(BetRecord).where(BetRecord.user_id.in_(user_ids)))
+            await session.execute(delete(UserGameRollingRate).where(
+                UserGameRollingRate.user_id.in_(user_ids)
+            ))
+            await session.execute(delete(UserSubtreeStats).where(UserSubtreeStats.user_id.in_(user_ids)))
+            await session.execute(delete(UserTree).where(UserTree.descendant_id.in_(user_ids)))
+            for uid in reversed(user_ids):
+                await session.execute(delete(User).where(User.id == uid))
+            await session.commit()
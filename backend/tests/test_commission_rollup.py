@@ -0,0 +1,37 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from app.services.commission_rollup import entry_deltas, utc_day
+
+
+def _entry(recipient: int, created_at: datetime, ctype: str, amount: str, source: str):
+    return SimpleNamespace(
+        recipient_user_id=recipient,
+        created_at=created_at,
+        type=ctype,
+        status="pending",
+        commission_amount=Decimal(amount),
+        source_amount=Decimal(source),
+    )
+
+
+def test_utc_day_uses_utc_for_aware_timestamps():
+    kst = timezone(timedelta(hours=9))
+    assert utc_day(datetime(2026, 3, 2, 8, 0, tzinfo=kst)) == date(2026, 3, 1)
+    assert utc_day(datetime(2026, 3, 2, 8, 0)) == date(2026, 3, 2)
+
+
+def test_entry_deltas_group_by_recipient_day_type_status():
+    ts = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+    deltas = entry_deltas([
+        _entry(1, ts, "rolling", "1.50", "100"),
+        _entry(1, ts + timedelta(hours=1), "rolling", "0.50", "50"),
+        _entry(1, ts + timedelta(days=1), "rolling", "1.00", "80"),
+        _entry(2, ts, "losing", "3.00", "60"),
+    ])
+    assert deltas == {
+        (1, date(2026, 3, 1), "rolling", "pending"): [Decimal("2.00"), Decimal("150"), 2],
+        (1, date(2026, 3, 2), "rolling", "pending"): [Decimal("1.00"), Decimal("80"), 1],
+        (2, date(2026, 3, 1), "losing", "pending"): [Decimal("3.00"), Decimal("60"), 1],
+    }
@@ -0,0 +1,84 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.user import User
+from app.services import list_query
+
+
+def test_cursor_round_trip():
+    ts = datetime(2026, 10, 17, 8, 30, 15, 123456)
+    cursor = list_query.encode_cursor(ts, 42)
+    assert list_query.decode_cursor(cursor) == (ts, 42)
+    assert list_query.decode_cursor("") is None
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        list_query.decode_cursor("not-a-cursor")
+
+
+def test_filters_skip_missing_values():
+    stmt = select(User.id).where(
+        *list_query.equals((User.status, "active"), (User.rank, None), (User.referrer_id, "")),
+        *list_query.contains_any([User.username, User.phone], "50%_off"),
+        *list_query.day_range(User.created_at, "2026-10-01", None),
+    )
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "users.status = " in sql
+    assert "users.rank" not in sql and "users.referrer_id" not in sql
+    assert "users.username ILIKE" in sql and " OR users.phone ILIKE" in sql
+    assert "users.created_at >= " in sql and "users.created_at <=" not in sql
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    assert "%50\\%\\_off%" in params.values()
+
+
+class _PlanSession:
+    """Answers EXPLAIN with a fixed row estimate and counts from `rows` matching rows."""
+
+    def __init__(self, estimate: int, rows: int):
+        self.estimate = estimate
+        self.rows = rows
+        self.statements = []
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+        if isinstance(stmt, list_query._Explain):
+            plan = [{"Plan": {"Node Type": "Seq Scan", "Plan Rows": self.estimate}}]
+            return _Scalar(json.dumps(plan))
+        if "LIMIT" in str(stmt.compile(dialect=postgresql.dialect())):
+            return _Scalar(min(self.rows, list_query.EXACT_COUNT_MAX + 1))
+        return _Scalar(self.rows)
+
+
+class _Scalar:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+async def test_count_total_counts_filtered_queries_up_to_the_cap():
+    base = select(User).where(User.username.ilike("%kim%"))
+    sql = str(list_query._Explain(base).compile(dialect=postgresql.dialect()))
+    assert sql.startswith("EXPLAIN (FORMAT JSON) SELECT")
+
+    # A bad planner estimate does not turn a small result into an estimate
+    misjudged = _PlanSession(estimate=50_000, rows=5)
+    assert await list_query.count_total(misjudged, base) == (5, False)
+    assert len(misjudged.statements) == 1
+
+    broad = _PlanSession(estimate=2_500_000, rows=2_400_000)
+    assert await list_query.count_total(broad, base) == (2_500_000, True)
+    underestimated = _PlanSession(estimate=300, rows=2_400_000)
+    assert await list_query.count_total(underestimated, base) == (list_query.EXACT_COUNT_MAX + 1, True)
+
+
+async def test_count_total_estimates_unfiltered_tables():
+    table = _PlanSession(estimate=2_500_000, rows=2_480_000)
+    assert await list_query.count_total(table, select(User)) == (2_500_000, True)
+    assert len(table.statements) == 1
+
+    small = _PlanSession(estimate=120, rows=118)
+    assert await list_query.count_total(small, select(User)) == (118, False)
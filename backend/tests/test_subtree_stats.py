@@ -0,0 +1,59 @@
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+from app.models.subtree_stats import UserSubtreeStats
+from app.services import subtree_stats
+from app.services.commission_engine import credit_points
+
+
+def _session(today: date) -> SimpleNamespace:
+    session = SimpleNamespace(info={})
+    subtree_stats._pending(session)["day"] = today
+    return session
+
+
+def test_rollup_deltas_fill_period_buckets():
+    session = _session(date(2026, 10, 17))
+    subtree_stats.record_rollup(session, {
+        (7, date(2026, 10, 17), "rolling", "pending"): [Decimal("2"), Decimal("100"), 1],
+        (7, date(2026, 10, 3), "losing", "pending"): [Decimal("5"), Decimal("40"), 1],
+        (7, date(2026, 9, 30), "rolling", "pending"): [Decimal("1"), Decimal("50"), 1],
+        # A status move nets out
+        (8, date(2026, 10, 17), "rolling", "pending"): [Decimal("-3"), Decimal("-30"), -1],
+        (8, date(2026, 10, 17), "rolling", "settled"): [Decimal("3"), Decimal("30"), 1],
+    })
+    subtree_stats.record_user(session, 7, nodes=1, balance=Decimal("9"))
+    subtree_stats.record_user(session, 7, bettors=1)
+
+    pending = session.info[subtree_stats._PENDING_KEY]["user"]
+    # nodes, bettors, balance, bet, commission, day_bet, day_commission, month_bet, month_commission
+    assert pending[7] == [1, 1, 9, 150, 8, 100, 2, 100, 7]
+    assert subtree_stats._nonzero(pending) == {7: pending[7]}
+
+
+def test_user_totals_zero_past_buckets():
+    stats = UserSubtreeStats(
+        user_id=1, descendant_count=4, bet_total=Decimal("10"),
+        day=date(2026, 10, 16), day_bet_amount=Decimal("3"),
+        month=date(2026, 10, 1), month_bet_amount=Decimal("6"),
+    )
+    totals = subtree_stats.user_totals(stats, today=date(2026, 10, 17))
+    assert totals["descendant_count"] == 4
+    assert totals["day_bet_amount"] == 0
+    assert totals["month_bet_amount"] == Decimal("6")
+    assert subtree_stats.user_totals(stats, today=date(2026, 11, 1))["month_bet_amount"] == 0
+    assert subtree_stats.user_totals(None)["bet_total"] == 0
+
+
+async def test_credit_points_counts_first_commission_only():
+    async def execute(stmt):
+        # (id, first commission) as returned under the row lock
+        return SimpleNamespace(all=lambda: [(3, False), (5, True)])
+
+    session = SimpleNamespace(info={}, execute=execute)
+    await credit_points(session, {3: Decimal("2")}, bettors={3, 5})
+
+    pending = session.info[subtree_stats._PENDING_KEY]["user"]
+    assert set(pending) == {5}
+    assert pending[5][1] == 1
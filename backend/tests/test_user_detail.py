@@ -0,0 +1,60 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from app.api.v1.users import get_user_detail
+from app.models.user import User
+from app.services.user_detail import detail_statement
+
+
+class _CountingSession:
+    """Records every statement and answers with the detail row."""
+
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+        return SimpleNamespace(first=lambda: self.row)
+
+    async def get(self, *args, **kwargs):
+        self.statements.append(args)
+        return None
+
+
+async def test_detail_is_one_round_trip():
+    user = User(id=7, username="alice", referrer_id=3, nickname="alice", password_hash="x")
+    row = (
+        user,
+        "bob",
+        2,
+        [{"id": 1, "coin_type": "USDT", "network": "TRC20", "address": "T1",
+          "label": None, "is_primary": True, "status": "active"}],
+        [{"id": 4, "game_category": "slot", "is_allowed": False}],
+        [],
+        [{"id": 9, "game_category": "casino", "provider": None, "rolling_rate": "1.50"}],
+    )
+    session = _CountingSession(row)
+    admin = SimpleNamespace(id=1, role="super_admin")
+
+    detail = await get_user_detail(7, session=session, current_user=admin)
+
+    assert len(session.statements) == 1
+    assert detail.user.referrer_username == "bob"
+    assert detail.user.direct_referral_count == 2
+    assert detail.wallet_addresses[0].address == "T1"
+    assert not detail.betting_permissions[0].is_allowed
+    assert detail.null_betting_configs == []
+    assert detail.game_rolling_rates[0].rolling_rate == Decimal("1.50")
+
+
+def test_detail_statement_covers_every_part():
+    sql = str(detail_statement(7).compile(dialect=postgresql.dialect()))
+    for table in (
+        "user_wallet_addresses", "user_betting_permissions",
+        "user_null_betting_configs", "user_game_rolling_rates", "user_tree",
+    ):
+        assert f"FROM {table}" in sql
+    assert sql.count("json_agg(") == 4
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+import pytest
+
+from app.services import user_import as ui
+
+CSV = """username,referrer_code,losing_rate,rolling_casino,rolling_slot
+leaf,mid,5,0.5,
+mid,top,10,1.0,4
+top,boss,20,1.5,5
+other,,0,,
+"""
+
+
+def _prepare(rows, existing=None, external=None):
+    batch = ui._parse(rows)
+    ui._link(batch, existing or {})
+    order = ui._order(batch, external or {})
+    return batch, order
+
+
+def test_rows_load_parents_first_with_closure_through_existing_chain():
+    # boss (id 100, depth 1) already exists under id 1
+    batch, order = _prepare(
+        ui.read_csv(CSV.splitlines(keepends=True)),
+        existing={"boss": 100},
+        external={100: (1, Decimal("30"), {"casino": Decimal("1.5")})},
+    )
+    assert not batch.errors
+    names = [batch.username[i] for i in order]
+    assert names.index("top") < names.index("mid") < names.index("leaf")
+    assert batch.rates[batch.index["mid"]] == {"casino": Decimal("1.0"), "slot": Decimal("4")}
+    assert [batch.depth[batch.index[n]] for n in ("top", "mid", "leaf", "other")] == [2, 3, 4, 0]
+    assert ui._ranks(batch) == ["agency", "distributor", "sub_hq", "agency"]
+
+    ids = [10, 11, 12, 13]  # leaf, mid, top, other
+    closure = set(ui._closure(batch, ids, order, {100: [(100, 0), (1, 1)]}))
+    leaf = {(a, d) for a, x, d in closure if x == 10}
+    assert leaf == {(10, 0), (11, 1), (12, 2), (100, 3), (1, 4)}
+    assert {(a, d) for a, x, d in closure if x == 13} == {(13, 0)}
+    assert len(closure) == 5 + 4 + 3 + 1
+
+
+def test_all_errors_are_collected():
+    rows = [
+        {"username": "a", "referrer_code": "b"},
+        {"username": "ok", "losing_rate": "60"},
+        {"username": "b1", "referrer_code": "c1"},
+        {"username": "c1", "referrer_code": "b1"},
+        {"username": "b1"},
+        {"username": "kid", "referrer_code": "par", "losing_rate": "8", "rolling_rates": {"casino": "1.2"}},
+        {"username": "par", "referrer_code": "ghost", "losing_rate": "5", "rolling_rates": {"casino": "1"}},
+        {"username": "x2", "rolling_rates": {"poker": "1"}},
+    ]
+    batch, _ = _prepare(rows)
+    errors = "\n".join(batch.errors)
+    assert "line 1: username must be 2-50 characters" in errors
+    assert "line 2: losing_rate is at most 50%" in errors
+    assert "line 5: duplicate username 'b1' (line 3)" in errors
+    assert "line 7: referrer 'ghost' not found" in errors
+    assert "line 6: losing_rate above the referrer's (5%)" in errors
+    assert "line 6: casino rolling rate above the referrer's (1%)" in errors
+    assert "line 8: unknown game category 'poker'" in errors
+    assert "line 3: referrer chain forms a cycle" in errors
+    assert "line 4: referrer chain forms a cycle" in errors
+
+
+def test_import_error_lists_rows():
+    with pytest.raises(ValueError, match="2 invalid rows"):
+        raise ui.UserImportError(["line 1: a", "line 2: b"])
@@ -0,0 +1,45 @@
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.user import User
+from app.services import user_search
+
+
+def _sql(term: str) -> tuple[str, dict]:
+    compiled = select(User.id).where(*user_search.search_filter(term)).compile(dialect=postgresql.dialect())
+    return str(compiled), compiled.params
+
+
+def test_short_terms_use_the_username_prefix():
+    sql, params = _sql(" a_ ")
+    assert "lower(users.username) LIKE" in sql and "ILIKE" not in sql
+    assert "a\\_%" in params.values()
+
+
+def test_short_terms_find_two_character_real_names():
+    sql, params = _sql("\uae40\uc218")  # a two-character Korean name
+    assert "lower(users.real_name) LIKE" in sql
+    assert "\uae40\uc218%" in params.values()
+    rank = select(User.id).order_by(*user_search.search_rank("\uae40\uc218"))
+    assert "lower(users.real_name) = " in str(rank.compile(dialect=postgresql.dialect()))
+
+
+def test_long_terms_use_trigram_substrings():
+    sql, params = _sql("\uff2b\uff49\uff4d")  # full-width "Kim"
+    assert "users.username ILIKE" in sql and "users.real_name ILIKE" in sql
+    assert "%Kim%" in params.values()
+    assert "regexp_replace" not in sql
+
+
+def test_numbers_match_id_and_normalized_phone():
+    sql, params = _sql("010-1234")
+    assert "regexp_replace(users.phone, '[^0-9]', '', 'g') LIKE" in sql
+    assert "%0101234%" in params.values()
+    assert "users.id = " not in sql
+    sql, params = _sql("12345")
+    assert "users.id = " in sql and 12345 in params.values()
+
+
+def test_blank_terms_do_not_filter():
+    assert user_search.search_filter("   ") == []
+    assert user_search.search_rank(None) == []
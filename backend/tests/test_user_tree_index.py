@@ -0,0 +1,77 @@
+import asyncio
+import random
+
+from app.services import cache_service
+from app.services import user_tree_index as uti
+from app.services.user_tree_index import TreeIndex
+
+
+def _ancestors(parents: dict[int, int | None], uid: int) -> list[int]:
+    out = []
+    while parents[uid] is not None:
+        uid = parents[uid]
+        out.append(uid)
+    return out
+
+
+def _check(index: TreeIndex, parents: dict[int, int | None]) -> None:
+    for uid in parents:
+        anc = _ancestors(parents, uid)
+        assert [a for a, _ in index.ancestors(uid)] == anc
+        for other in parents:
+            assert index.is_ancestor(other, uid) == (other in anc)
+        expected = {d for d in parents if uid in _ancestors(parents, d)}
+        got = index.descendants(uid)
+        assert {d for d, _ in got} == expected
+        assert all(depth == _ancestors(parents, d).index(uid) + 1 for d, depth in got)
+        assert index.descendant_count(uid) == len(expected)
+        assert sorted(index.children(uid)) == sorted(d for d, p in parents.items() if p == uid)
+
+
+def test_index_matches_brute_force_through_inserts_and_retours(monkeypatch):
+    monkeypatch.setattr(uti, "_RETOUR_MIN", 10)
+    rng = random.Random(7)
+    parents: dict[int, int | None] = {1: None, 2: None}
+    for uid in range(3, 60):
+        parents[uid] = rng.choice([None, *parents])
+    index = TreeIndex.build(parents.items())
+    _check(index, parents)
+
+    # New leaves are served before and after the in-memory retour
+    for uid in range(60, 90):
+        parents[uid] = rng.choice(list(parents))
+        index.add(uid, parents[uid])
+        if uid in (61, 75, 89):
+            _check(index, parents)
+    index.add(60, 1)  # already known: ignored
+    _check(index, parents)
+
+
+def test_unknown_ids_and_depth_limit():
+    index = TreeIndex.build([(1, None), (2, 1), (3, 2), (4, 3)])
+    assert index.descendants(1, max_depth=2) == [(2, 1), (3, 2)]
+    assert index.has_grandchildren(1) and not index.has_grandchildren(3)
+    assert index.descendant_count(99) == 0
+    assert not index.is_ancestor(99, 1)
+    assert not index.is_ancestor(1, 1)
+
+
+async def test_concurrent_inserts_are_replayed_not_rebuilt(monkeypatch, fake_redis):
+    monkeypatch.setattr(uti.settings, "USER_TREE_INDEX_ENABLED", True)
+    watch = cache_service.VersionWatch("test:user_tree:version")
+    other_worker = cache_service.VersionWatch("test:user_tree:version")
+    monkeypatch.setattr(uti, "_watch", watch)
+    index = TreeIndex.build([(1, None), (2, 1)])
+    monkeypatch.setattr(uti, "_index", index)
+    await watch.poll()
+
+    # One commit inserting two users here, another worker's signup in between
+    index.add(3, 1)
+    index.add(4, 3)
+    await asyncio.gather(watch.bump("add:3:1"), other_worker.bump("add:5:2"), watch.bump("add:4:3"))
+    assert watch.version is not None
+
+    watch.checked_at = 0.0
+    assert await uti.get_index() is index
+    _check(index, {1: None, 2: 1, 3: 1, 4: 3, 5: 2})
+    assert len(index) == 5
@@ -0,0 +1,25 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+from app.services.user_tree_service import rate_conflicts
+
+
+def _rate(category: str, rolling: str, losing: str | None = None, provider: str | None = None):
+    return SimpleNamespace(
+        game_category=category, provider=provider, rolling_rate=Decimal(rolling),
+        losing_rate=Decimal(losing) if losing is not None else None,
+    )
+
+
+def test_move_rate_check_applies_child_not_above_parent():
+    child = [_rate("casino", "1.0"), _rate("slot", "3", losing="10"), _rate("holdem", "5")]
+    parent = [_rate("casino", "1.5"), _rate("slot", "2.5", losing="8")]
+    assert rate_conflicts(child, parent, Decimal("20"), Decimal("30")) == [
+        "slot rolling rate 3% exceeds the referrer's 2.5%",
+        "slot losing rate 10% exceeds the referrer's 8%",
+    ]
+    assert rate_conflicts(child, parent, Decimal("40"), Decimal("30"))[-1] == (
+        "losing rate 40% exceeds the referrer's 30%"
+    )
+    # Categories the referrer has no rate for are not limited
+    assert rate_conflicts([_rate("holdem", "5")], parent, None, None) == []